@@ -133,6 +133,19 @@ async def read_asset_sample(session: SessionDep, current_user: CurrentUser, id:
 
     return FileResponse(sample_file_path)
 
+@router.get("/{id}/quicklook/{path:path}", response_model=None)
+def serve_asset_quicklook(id: uuid.UUID, path: str) -> Any:
+    """
+    Serve the quick-look 3D Tiles built while inspecting a point cloud (public like pipeline outputs).
+    """
+    base = os.path.realpath(get_asset_upload_path(f"{id}/quicklook"))
+    target = os.path.realpath(os.path.join(base, path))
+    if not target.startswith(base + os.sep):
+        raise HTTPException(status_code=404)
+    if not os.path.isfile(target):
+        raise HTTPException(status_code=404)
+    return FileResponse(target)
+
 @router.delete("/{id}")
 def delete_asset(
     session: SessionDep, current_user: CurrentUser, id: uuid.UUID
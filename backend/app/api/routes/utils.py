@@ -159,7 +159,25 @@ async def create_map_config(session: SessionDep, current_user: CurrentUser) -> A
         )
         pipelines = session.exec(statement.order_by(Pipeline.title.asc())).all()
 
+    if current_user.is_superuser:
+        statement = select(Asset).where(Asset.upload_status == SUCCESS)
+    else:
+        statement = (
+            select(Asset)
+            .where(Asset.owner_id == current_user.id)
+            .where(Asset.upload_status == SUCCESS)
+        )
+    assets = session.exec(statement.order_by(Asset.filename.asc())).all()
+
     catalog_services = {}
+    for asset in assets:
+        if asset.upload_result and asset.upload_result.get('quicklook_tileset'):
+            catalog_services[asset.id] = {
+                'url': f"{settings.server_host}{asset.upload_result['quicklook_tileset']}",
+                'type': '3dtiles',
+                'title': f"{asset.filename} (quick-look)",
+                'autoload': False
+            }
     for pipeline in pipelines:
         if pipeline.task_result and 'tileset' in pipeline.task_result:
             catalog_services[pipeline.id] = {
@@ -220,11 +238,14 @@ def create_asset(session, file_info, current_user, to_ellipsoidal_height):
             elif '.obj' in zip_file_extensions:
                 filename = filename.replace('.zip', '.obj.zip')
                 extension = "".join(Path(filename).suffixes)
+            elif all(ext in ['.las', '.laz', ''] for ext in zip_file_extensions) and any(ext in ['.las', '.laz'] for ext in zip_file_extensions):
+                filename = filename.replace('.zip', '.las.zip')
+                extension = "".join(Path(filename).suffixes)
             else:
                 if not all(ext in ['.jpg', '.json', '.jpg.png', '.png', ''] for ext in zip_file_extensions):
                     raise HTTPException(
                         status_code=500,
-                        detail="Not supported zip archive. Include a .obj mesh (optionally .mtl and textures), shapefile (.shp), or photogrammetry images.",
+                        detail="Not supported zip archive. Include a .obj mesh (optionally .mtl and textures), shapefile (.shp), LAS/LAZ point clouds, or photogrammetry images.",
                     )
                 else:
                     filename = filename.replace('.zip', '.phg.zip')
@@ -239,7 +260,7 @@ def create_asset(session, file_info, current_user, to_ellipsoidal_height):
         raise HTTPException(status_code=400, detail="Asset with this filename already exists")
 
     vector_data_extensions = [".shp.zip"]
-    point_cloud_data_extensions = [".laz", ".las"]
+    point_cloud_data_extensions = [".laz", ".las", ".las.zip"]
     raster_formats = [".tiff", ".tif"]
     photogrammetry_formats = [".phg.zip"]
     mesh_formats = [".obj", ".obj.zip"]
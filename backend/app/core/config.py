@@ -56,6 +56,15 @@ class Settings(BaseSettings):
     POSTGRES_TASKS_DB: str = ""
     ASSETS_DATA: str = ""
     DTT_ENABLE_USERS_MANAGEMENT: bool = False
+    # convert uploaded LAS/LAZ to COPC at inspection so later stages read only the needed octree nodes
+    DTT_POINT_CLOUD_COPC: bool = False
+    # cores / memory (MB) a point cloud worker may use, shared by its concurrent Celery tasks (default: whole host)
+    DTT_POINT_CLOUD_CPU_BUDGET: int | None = None
+    DTT_POINT_CLOUD_MEMORY_BUDGET_MB: int | None = None
+    # rows buffered by the worker COPY writer before each COPY ... FROM STDIN + commit
+    DTT_BULK_COPY_BATCH_SIZE: int = 5000
+    # polygon to polyhedron conversion workers per task (default: cores / CELERY_WORKER_CONCURRENCY)
+    DTT_VECTOR_WORKERS: int | None = None
 
     @computed_field  # type: ignore[prop-decorator]
     @property
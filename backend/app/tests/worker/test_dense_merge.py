@@ -0,0 +1,124 @@
+import json
+import os
+
+import pytest
+
+# numpy is a worker dependency, not installed in the API image
+np = pytest.importorskip("numpy")
+
+from app.worker.tasks.photogrammetry.ply import read_ply_header  # noqa: E402
+from app.worker.tasks.photogrammetry.sparse_reconstruction_to_dense_point_cloud import (  # noqa: E402
+    _owned_points,
+    _submodel_centroids,
+    merge_dense_point_clouds,
+)
+
+VERTEX_DTYPE = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+
+
+def _block(x: list, y: list) -> np.ndarray:
+    block = np.zeros(len(x), dtype=VERTEX_DTYPE)
+    block["x"] = x
+    block["y"] = y
+    return block
+
+
+def _write_ply(path: str, vertices: np.ndarray) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = (
+        "ply\nformat binary_little_endian 1.0\n"
+        f"element vertex {len(vertices)}\n"
+        "property float x\nproperty float y\nproperty float z\nend_header\n"
+    )
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(vertices.tobytes())
+
+
+def _write_survey(process_dir: str, centers: dict, labels: dict) -> list[str]:
+    """reconstruction.json with identity rotations (centre = -translation), clusters.npz and aligned submodels."""
+    shots = {
+        image: {"rotation": [0, 0, 0], "translation": [-x, -y, -z]}
+        for image, (x, y, z) in centers.items()
+    }
+    with open(os.path.join(process_dir, "reconstruction.json"), "w") as f:
+        json.dump([{"shots": shots}], f)
+
+    images = np.array(list(labels))
+    label_values = np.array([labels[image] for image in images])
+    os.makedirs(os.path.join(process_dir, "submodels"))
+    # the keys OpenSfM save_clusters writes
+    np.savez_compressed(
+        os.path.join(process_dir, "submodels", "clusters.npz"),
+        images=images,
+        positions=np.array([centers[image] for image in images]),
+        labels=label_values,
+        centers=np.zeros((label_values.max() + 1, 2)),
+    )
+
+    submodel_dirs = []
+    for index in range(label_values.max() + 1):
+        submodel_dir = os.path.join(process_dir, "submodels", f"submodel_{index:04d}")
+        os.makedirs(submodel_dir)
+        # every image of the aligned submodel, overlap included
+        with open(os.path.join(submodel_dir, "reconstruction.aligned.json"), "w") as f:
+            json.dump([{"shots": {image: shots[image] for image in centers}}], f)
+        submodel_dirs.append(submodel_dir)
+    return submodel_dirs
+
+
+def test_owned_points_split_every_point_once() -> None:
+    rng = np.random.default_rng(0)
+    centroids = np.array([[0.0, 0.0], [10.0, 0.0], [5.0, 8.0]])
+    block = _block(rng.uniform(-5, 15, 1000), rng.uniform(-5, 13, 1000))
+
+    masks = np.array([_owned_points(centroids, index, block) for index in range(len(centroids))])
+
+    assert np.array_equal(masks.sum(axis=0), np.ones(len(block)))
+    x = block["x"].astype(np.float64)
+    y = block["y"].astype(np.float64)
+    distances = (x[None, :] - centroids[:, 0, None]) ** 2 + (y[None, :] - centroids[:, 1, None]) ** 2
+    assert np.array_equal(masks.argmax(axis=0), distances.argmin(axis=0))
+
+
+def test_owned_points_ties_go_to_the_lower_index() -> None:
+    centroids = np.array([[10.0, 0.0], [0.0, 0.0], [0.0, 0.0]])
+    # (5, 0) is as far from the first two centroids, the last two are the same point
+    block = _block([5.0, 0.0], [0.0, 0.0])
+
+    masks = [_owned_points(centroids, index, block).tolist() for index in range(len(centroids))]
+
+    assert masks == [[True, False], [False, True], [False, False]]
+
+
+def test_submodel_centroids_use_the_cluster_labels(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    process_dir = str(tmp_path)
+    centers = {"a.jpg": (0, 0, 50), "b.jpg": (2, 0, 50), "c.jpg": (20, 10, 50), "d.jpg": (22, 10, 50)}
+    labels = {"a.jpg": 0, "b.jpg": 0, "c.jpg": 1, "d.jpg": 1}
+    submodel_dirs = _write_survey(process_dir, centers, labels)
+
+    centroids = _submodel_centroids(process_dir, submodel_dirs)
+
+    np.testing.assert_allclose(centroids, [[1, 0], [21, 10]])
+
+
+def test_merge_keeps_the_nearest_submodel_points(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    process_dir = str(tmp_path)
+    centers = {"a.jpg": (0, 0, 50), "b.jpg": (10, 0, 50)}
+    submodel_dirs = _write_survey(process_dir, centers, {"a.jpg": 0, "b.jpg": 1})
+    # both submodels reconstruct the whole overlap
+    cloud = _block(np.linspace(-2, 12, 15), np.zeros(15))
+    for submodel_dir in submodel_dirs:
+        _write_ply(os.path.join(submodel_dir, "undistorted", "depthmaps", "merged.ply"), cloud)
+
+    merge_dense_point_clouds(process_dir, submodel_dirs)
+
+    merged_path = os.path.join(process_dir, "undistorted", "depthmaps", "merged.ply")
+    with open(merged_path, "rb") as f:
+        _, vertex_count, properties, header_size = read_ply_header(f)
+    merged = np.fromfile(
+        merged_path, dtype=[(name, "<" + ply_type) for name, ply_type in properties], offset=header_size
+    )
+    assert vertex_count == len(cloud)
+    # x <= 5 from the first submodel (the tie at 5 included), the rest from the second
+    assert merged["x"].tolist() == cloud["x"].tolist()
@@ -0,0 +1,83 @@
+import struct
+
+import pytest
+
+# numpy is a worker dependency, not installed in the API image
+np = pytest.importorskip("numpy")
+
+from app.worker.common.ewkb import (  # noqa: E402
+    EWKB_SRID,
+    EWKB_Z,
+    WKB_POINT,
+    WKB_POLYGON,
+    WKB_POLYHEDRALSURFACE,
+    extrusion_to_ewkb,
+    point_z_to_ewkb,
+    triangles_to_ewkb,
+)
+
+
+def _read_polyhedral_surface(data: bytes) -> tuple[int, list]:
+    """srid and triangles (lists of 4 xyz points) of a POLYHEDRALSURFACE Z EWKB."""
+    byte_order, geometry_type, srid, count = struct.unpack_from("<BIII", data, 0)
+    assert byte_order == 1
+    assert geometry_type == WKB_POLYHEDRALSURFACE | EWKB_Z | EWKB_SRID
+    offset = struct.calcsize("<BIII")
+    triangles = []
+    for _ in range(count):
+        byte_order, member_type, rings, points = struct.unpack_from("<BIII", data, offset)
+        assert byte_order == 1
+        assert member_type == WKB_POLYGON | EWKB_Z
+        assert rings == 1
+        assert points == 4
+        offset += struct.calcsize("<BIII")
+        coordinates = struct.unpack_from("<12d", data, offset)
+        offset += struct.calcsize("<12d")
+        triangles.append([list(coordinates[i : i + 3]) for i in range(0, 12, 3)])
+    assert offset == len(data)
+    return srid, triangles
+
+
+def test_point_z_to_ewkb() -> None:
+    data = point_z_to_ewkb([11.5, 45.25, 12.0], srid=4979)
+    assert struct.unpack("<BII3d", data) == (
+        1,
+        WKB_POINT | EWKB_Z | EWKB_SRID,
+        4979,
+        11.5,
+        45.25,
+        12.0,
+    )
+    # missing or null z is 0
+    assert struct.unpack("<BII3d", point_z_to_ewkb([1, 2]))[3:] == (1.0, 2.0, 0.0)
+    assert struct.unpack("<BII3d", point_z_to_ewkb([1, 2, None]))[3:] == (1.0, 2.0, 0.0)
+
+
+def test_triangles_to_ewkb() -> None:
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 2], [0, 1, 2]], dtype=np.float64)
+    triangles = np.array([[0, 1, 2], [0, 2, 3]])
+    srid, decoded = _read_polyhedral_surface(triangles_to_ewkb(vertices, triangles, srid=3857))
+    assert srid == 3857
+    # closed rings: the first vertex is repeated at the end
+    assert decoded == [
+        [[0, 0, 0], [1, 0, 0], [1, 1, 2], [0, 0, 0]],
+        [[0, 0, 0], [1, 1, 2], [0, 1, 2], [0, 0, 0]],
+    ]
+
+
+def test_extrusion_to_ewkb_slices_features() -> None:
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]], dtype=np.float64)
+    result = {
+        "vertices": vertices,
+        "triangles": np.array([[0, 1, 2], [0, 2, 3], [1, 2, 3]]),
+        "triangle_offsets": np.array([0, 2, 2, 3]),
+    }
+    geometries = extrusion_to_ewkb(result)
+
+    assert len(geometries) == 3
+    assert geometries[1] is None
+    assert bytes(geometries[0]) == triangles_to_ewkb(vertices, result["triangles"][:2])
+    assert bytes(geometries[2]) == triangles_to_ewkb(vertices, result["triangles"][2:])
+    srid, decoded = _read_polyhedral_surface(bytes(geometries[2]))
+    assert srid == 4326
+    assert decoded == [[[1, 0, 0], [1, 1, 0], [0, 1, 0], [1, 0, 0]]]
@@ -0,0 +1,247 @@
+import math
+
+import pytest
+from sqlalchemy import text
+from sqlmodel import Session
+
+# numpy is a worker dependency, not installed in the API image
+pytest.importorskip("numpy")
+
+from app.worker.common.expression import (  # noqa: E402
+    compile_expression,
+    evaluate_expression_columns,
+    expression_to_sql,
+    get_func,
+    parse_expression,
+)
+
+
+def reference_parse_expression(type, value, feature, default_value=None):  # type: ignore[no-untyped-def]
+    """The original recursive, row by row evaluator the optimized paths must match."""
+    try:
+        if not isinstance(value, list):
+            if value is None:
+                return None
+            if type == "string":
+                return f"{value}"
+            if type == "number":
+                return float(value)
+            return value
+        operator = value[0]
+
+        _type = type
+        if operator in ["property", "func"]:
+            _type = ""
+
+        value_length = len(value)
+
+        a = None
+        if value_length > 1:
+            a = reference_parse_expression(_type, value[1], feature)
+
+        b = None
+        if value_length > 2:
+            b = reference_parse_expression(_type, value[2], feature)
+
+        if operator == "+":
+            return float(a) + float(b)  # type: ignore[arg-type]
+        if operator == "-":
+            return float(a) - float(b)  # type: ignore[arg-type]
+        if operator == "*":
+            return float(a) * float(b)  # type: ignore[arg-type]
+        if operator == "/":
+            return float(a) / float(b)  # type: ignore[arg-type]
+        if operator == "concat":
+            return f"{a}{b}"
+        if operator == "lowercase":
+            return f"{a}".lower()
+        if operator == "uppercase":
+            return f"{a}".upper()
+        if operator == "property":
+            if a in feature["properties"]:
+                return feature["properties"][a]
+        if operator == "func":
+            return get_func(a, feature)
+        return None
+    except Exception:
+        return default_value
+
+
+FEATURES = [
+    {
+        "properties": {"height": 10, "floors": 3, "name": "Tower", "code": "12.5"},
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[0, 0, 1], [1, 0, 4], [1, 1, 2], [0, 0, 1]]],
+        },
+    },
+    {
+        "properties": {"height": None, "floors": 0, "name": None, "code": "abc"},
+        "geometry": {"type": "Point", "coordinates": [5, 5, 7]},
+    },
+    {
+        "properties": {"height": 2.5, "floors": 2, "name": "house", "code": 4},
+        "geometry": {"type": "Point", "coordinates": [1, 2]},
+    },
+    {
+        "properties": {"height": "7", "floors": "x", "name": "Barn", "code": None},
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[0, 0, -2], [2, 0, 0], [2, 2, 3], [0, 0, -2]]],
+        },
+    },
+]
+
+EXPRESSIONS = [
+    ("number", 12),
+    ("number", "3.5"),
+    ("number", "not a number"),
+    ("string", 12),
+    ("string", None),
+    ("number", ["property", "height"]),
+    ("number", ["property", "missing"]),
+    ("number", ["+", ["property", "height"], 1]),
+    ("number", ["-", ["property", "height"], ["property", "floors"]]),
+    ("number", ["*", ["property", "floors"], 3]),
+    ("number", ["/", ["property", "height"], ["property", "floors"]]),
+    ("number", ["+", ["property", "code"], ["*", 2, ["property", "floors"]]]),
+    ("number", ["+", ["func", "$minZ"], ["property", "height"]]),
+    ("number", ["-", ["func", "$maxZ"], ["func", "$minZ"]]),
+    ("number", ["func", "$unknown"]),
+    ("string", ["concat", ["property", "name"], "-"]),
+    ("string", ["concat", ["property", "name"], ["property", "height"]]),
+    ("string", ["lowercase", ["property", "name"]]),
+    ("string", ["uppercase", ["concat", ["property", "name"], ["property", "code"]]]),
+    ("string", ["unknown", 1, 2]),
+    ("number", []),
+]
+
+
+def _same(a, b) -> bool:  # type: ignore[no-untyped-def]
+    if isinstance(a, float) and isinstance(b, float):
+        return a == b or (math.isnan(a) and math.isnan(b)) or math.isclose(a, b)
+    return type(a) is type(b) and a == b
+
+
+def _columns(features: list[dict]) -> tuple[dict, dict]:
+    properties = {
+        name: [feature["properties"].get(name) for feature in features]
+        for name in features[0]["properties"]
+    }
+    functions = {
+        name: [get_func(name, feature) for feature in features]
+        for name in ["$minZ", "$maxZ"]
+    }
+    return properties, functions
+
+
+@pytest.mark.parametrize("default_value", [None, 0, -1.5])
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+def test_compile_expression_matches_reference(expression, default_value) -> None:  # type: ignore[no-untyped-def]
+    type, value = expression
+    evaluate = compile_expression(type, value, default_value)
+    for feature in FEATURES:
+        expected = reference_parse_expression(type, value, feature, default_value)
+        assert _same(evaluate(feature), expected), (value, feature["properties"])
+
+
+@pytest.mark.parametrize("default_value", [None, 0, -1.5])
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+def test_parse_expression_matches_reference(expression, default_value) -> None:  # type: ignore[no-untyped-def]
+    type, value = expression
+    for feature in FEATURES:
+        expected = reference_parse_expression(type, value, feature, default_value)
+        # the second call reuses the compiled expression
+        assert _same(parse_expression(type, value, feature, default_value), expected)
+        assert _same(parse_expression(type, value, feature, default_value), expected)
+
+
+def test_parse_expression_cache_keeps_types_apart() -> None:
+    feature = {"properties": {}}
+    assert parse_expression("", 1, feature) == 1
+    assert parse_expression("", True, feature) is True
+    # a failing expression returns the default it was called with
+    assert isinstance(parse_expression("number", ["/", 1, 0], feature, 0), int)
+    assert isinstance(parse_expression("number", ["/", 1, 0], feature, 0.0), float)
+
+
+@pytest.mark.parametrize("default_value", [None, 0, -1.5])
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+def test_evaluate_expression_columns_matches_reference(expression, default_value) -> None:  # type: ignore[no-untyped-def]
+    type, value = expression
+    properties, functions = _columns(FEATURES)
+    values = evaluate_expression_columns(
+        type, value, properties, len(FEATURES), functions, default_value
+    )
+    assert len(values) == len(FEATURES)
+    for feature, result in zip(FEATURES, values, strict=True):
+        expected = reference_parse_expression(type, value, feature, default_value)
+        assert _same(result, expected), (value, feature["properties"])
+
+
+SQL_COLUMNS = {
+    "height": ("t.height", "number"),
+    "floors": ("t.floors", "number"),
+    "name": ("t.name", "string"),
+    "created": None,
+}
+
+SQL_ROWS = [
+    {"height": 10.0, "floors": 3.0, "name": "Tower"},
+    {"height": None, "floors": 0.0, "name": None},
+    {"height": 2.5, "floors": 2.0, "name": "house"},
+]
+
+SQL_EXPRESSIONS = [
+    ("number", ["property", "height"]),
+    ("number", ["+", ["property", "height"], 1]),
+    ("number", ["/", ["property", "height"], ["property", "floors"]]),
+    ("number", ["*", ["-", ["property", "height"], 0.5], ["property", "floors"]]),
+    ("string", ["concat", ["property", "name"], "'s"]),
+    ("string", ["uppercase", ["property", "name"]]),
+    ("string", ["lowercase", ["concat", "A-", ["property", "name"]]]),
+    ("number", ["property", "missing"]),
+]
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        # no exact SQL counterpart: evaluated in Python
+        ("number", ["+", ["property", "name"], 1]),
+        ("string", ["concat", ["property", "height"], "m"]),
+        ("number", ["property", "created"]),
+        ("number", ["property", ["concat", "hei", "ght"]]),
+        ("string", ["property", "height"]),
+    ],
+)
+def test_expression_to_sql_unsupported(expression) -> None:  # type: ignore[no-untyped-def]
+    type, value = expression
+    assert expression_to_sql(type, value, SQL_COLUMNS, default_value=0) is None
+
+
+@pytest.mark.parametrize("default_value", [None, 0])
+@pytest.mark.parametrize("expression", SQL_EXPRESSIONS)
+def test_expression_to_sql_matches_reference(db: Session, expression, default_value) -> None:  # type: ignore[no-untyped-def]
+    type, value = expression
+    sql = expression_to_sql(type, value, SQL_COLUMNS, default_value=default_value)
+    assert sql is not None
+    rows = db.execute(
+        text(
+            f"SELECT {sql} FROM (VALUES "
+            "(CAST(:h0 AS double precision), CAST(:f0 AS double precision), CAST(:n0 AS text)), "
+            "(CAST(:h1 AS double precision), CAST(:f1 AS double precision), CAST(:n1 AS text)), "
+            "(CAST(:h2 AS double precision), CAST(:f2 AS double precision), CAST(:n2 AS text))"
+            ") AS t(height, floors, name)"
+        ),
+        {
+            **{f"h{i}": row["height"] for i, row in enumerate(SQL_ROWS)},
+            **{f"f{i}": row["floors"] for i, row in enumerate(SQL_ROWS)},
+            **{f"n{i}": row["name"] for i, row in enumerate(SQL_ROWS)},
+        },
+    ).all()
+    for row, (result,) in zip(SQL_ROWS, rows, strict=True):
+        expected = reference_parse_expression(
+            type, value, {"properties": row}, default_value
+        )
+        assert _same(result, expected), (value, row)
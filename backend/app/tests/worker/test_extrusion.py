@@ -0,0 +1,205 @@
+import math
+import random
+
+import pytest
+
+# numpy and mapbox_earcut are vector worker dependencies, not installed in the API image
+np = pytest.importorskip("numpy")
+mapbox_earcut = pytest.importorskip("mapbox_earcut")
+
+from app.worker.tasks.vector.pg2b3dm.extrusion import (  # noqa: E402
+    extrude_polygons,
+    geometries_to_batch,
+    to_polyhedrons,
+)
+
+# The original list based polyhedron builder the extrusion engine must match.
+
+
+def _earcut(coordinates):  # type: ignore[no-untyped-def]
+    try:
+        vertices = []
+        rings = []
+        for ring in coordinates:
+            vertices += [[p[0], p[1]] for p in ring]
+            rings.append(len(vertices))
+        return mapbox_earcut.triangulate_float32(vertices, rings)
+    except Exception:
+        return []
+
+
+def _parse_ring(ring, z, translate_z):  # type: ignore[no-untyped-def]
+    return [
+        [coords[0], coords[1], (z if z else (coords[2] if coords[2] else 0)) + (translate_z if translate_z else 0)]
+        for coords in ring
+    ]
+
+
+def _triangulate(coordinates, reverse):  # type: ignore[no-untyped-def]
+    indices = _earcut(coordinates)
+    vertices = [vertex for rings in coordinates for vertex in rings]
+    polyhedron = []
+    for i in range(0, len(indices), 3):
+        a, b, c = vertices[indices[i]], vertices[indices[i + 1]], vertices[indices[i + 2]]
+        polyhedron.append([a, c, b, a] if reverse else [a, b, c, a])
+    return polyhedron
+
+
+def _walls(lower, upper):  # type: ignore[no-untyped-def]
+    walls = []
+    for lower_ring, upper_ring in zip(lower, upper, strict=True):
+        for i in range(len(lower_ring) - 1):
+            if lower_ring[i + 1]:
+                bl, br = lower_ring[i], lower_ring[i + 1]
+                tl, tr = upper_ring[i], upper_ring[i + 1]
+                walls.append([bl, tl, br, bl])
+                walls.append([br, tl, tr, br])
+    return walls
+
+
+def _to_polyhedral_surface(lower, upper, remove_bottom_surface):  # type: ignore[no-untyped-def]
+    if not upper:
+        return _triangulate(lower, False)
+    surface = _triangulate(upper, False) + _walls(lower, upper)
+    if not remove_bottom_surface:
+        surface += _triangulate(lower, True)
+    return surface
+
+
+def reference_geometry_to_polyhedral_surface(geometry, options):  # type: ignore[no-untyped-def]
+    if geometry["type"] != "Polygon":
+        return []
+    lower_limit = options["lower_limit"]
+    upper_limit = options["upper_limit"]
+    translate_z = options["translate_z"]
+    remove_bottom_surface = options["remove_bottom_surface"]
+
+    lower = [_parse_ring(ring, lower_limit, translate_z) for ring in geometry["coordinates"]]
+    if lower_limit is None and upper_limit is None:
+        return _to_polyhedral_surface(lower, None, remove_bottom_surface)
+    upper = [_parse_ring(ring, upper_limit, translate_z) for ring in geometry["coordinates"]]
+
+    average_z_lower = sum(c[2] for c in lower[0]) / len(lower[0])
+    average_z_upper = sum(c[2] for c in upper[0]) / len(upper[0])
+    if average_z_lower > average_z_upper:
+        return _to_polyhedral_surface(upper, lower, remove_bottom_surface)
+    return _to_polyhedral_surface(lower, upper, remove_bottom_surface)
+
+
+def _ring(cx: float, cy: float, radius: float, sides: int, z: float) -> list:
+    ring = []
+    for i in range(sides):
+        angle = 2 * math.pi * i / sides
+        ring.append([cx + radius * math.cos(angle), cy + radius * math.sin(angle), z])
+    return ring + [ring[0]]
+
+
+def _polygon(*rings: list) -> dict:
+    return {"type": "Polygon", "coordinates": list(rings)}
+
+
+def _features() -> list[dict]:
+    rng = random.Random(0)
+    features = [
+        # square footprint, flat roof
+        {"geometry": _polygon(_ring(0, 0, 10, 4, 0)), "lower": None, "upper": 12.0},
+        # courtyard (reversed inner ring)
+        {
+            "geometry": _polygon(
+                _ring(100, 100, 20, 8, 5), list(reversed(_ring(100, 100, 5, 4, 5)))
+            ),
+            "lower": None,
+            "upper": 30.0,
+        },
+        # lower limit above the upper one: the sides are swapped
+        {"geometry": _polygon(_ring(-50, 20, 8, 6, 0)), "lower": 40.0, "upper": 10.0},
+        # both limits set
+        {"geometry": _polygon(_ring(0, -80, 15, 5, 2)), "lower": 3.0, "upper": 25.0},
+        # no limits: only the footprint is triangulated
+        {"geometry": _polygon(_ring(60, -60, 7, 7, 4)), "lower": None, "upper": None},
+        # not a polygon
+        {"geometry": {"type": "Point", "coordinates": [0, 0, 0]}, "lower": None, "upper": 5.0},
+    ]
+    for _ in range(50):
+        cx, cy = rng.uniform(0, 1000), rng.uniform(0, 1000)
+        radius = rng.uniform(5, 30)
+        z = rng.uniform(0, 50)
+        rings = [_ring(cx, cy, radius, rng.randint(4, 12), z)]
+        if rng.random() < 0.3:
+            rings.append(list(reversed(_ring(cx, cy, radius / 3, 4, z))))
+        features.append(
+            {"geometry": _polygon(*rings), "lower": None, "upper": rng.uniform(3, 60)}
+        )
+    return features
+
+
+def _polyhedrons_from_lists(
+    features: list[dict], translate_z: float, remove_bottom_surface: bool
+) -> list:
+    return [
+        reference_geometry_to_polyhedral_surface(
+            feature["geometry"],
+            {
+                "lower_limit": feature["lower"],
+                "upper_limit": feature["upper"],
+                "translate_z": translate_z,
+                "remove_bottom_surface": remove_bottom_surface,
+            },
+        )
+        for feature in features
+    ]
+
+
+def _polyhedrons_from_arrays(
+    features: list[dict], translate_z: float, remove_bottom_surface: bool
+) -> list:
+    batch = geometries_to_batch([feature["geometry"] for feature in features])
+    result = extrude_polygons(
+        batch,
+        lower_limits=[feature["lower"] for feature in features],
+        upper_limits=[feature["upper"] for feature in features],
+        translate_z=translate_z,
+        remove_bottom_surface=remove_bottom_surface,
+    )
+    return to_polyhedrons(result)
+
+
+@pytest.mark.parametrize("remove_bottom_surface", [True, False])
+@pytest.mark.parametrize("translate_z", [0, 7.5])
+def test_extrusion_matches_polyhedron(
+    remove_bottom_surface: bool, translate_z: float
+) -> None:
+    features = _features()
+    expected = _polyhedrons_from_lists(features, translate_z, remove_bottom_surface)
+    converted = _polyhedrons_from_arrays(features, translate_z, remove_bottom_surface)
+
+    assert len(converted) == len(expected)
+    for index, (polyhedron, extruded) in enumerate(zip(expected, converted, strict=True)):
+        assert len(extruded) == len(polyhedron), f"feature {index}"
+        if not polyhedron:
+            continue
+        # same triangles, in the same order, with the same (closed) rings of vertices
+        expected_rings = np.array(polyhedron, dtype=np.float64)
+        extruded_rings = np.array(extruded, dtype=np.float64)
+        assert extruded_rings.shape == expected_rings.shape, f"feature {index}"
+        np.testing.assert_allclose(
+            extruded_rings, expected_rings, err_msg=f"feature {index}"
+        )
+        assert np.array_equal(extruded_rings[:, 0], extruded_rings[:, -1])
+
+
+def test_extrusion_keeps_feature_alignment() -> None:
+    geometries = [
+        None,
+        _polygon(_ring(0, 0, 10, 4, 0)),
+        {"type": "LineString", "coordinates": [[0, 0, 0], [1, 1, 0]]},
+    ]
+    batch = geometries_to_batch(geometries)
+    result = extrude_polygons(batch, upper_limits=10.0)
+
+    assert len(result["triangle_offsets"]) == len(geometries) + 1
+    polyhedrons = to_polyhedrons(result)
+    assert polyhedrons[0] == []
+    assert polyhedrons[2] == []
+    # 2 roof triangles and 2 per wall
+    assert len(polyhedrons[1]) == 2 + 4 * 2
@@ -0,0 +1,85 @@
+import struct
+
+import pytest
+
+from app.worker.tasks.photogrammetry.image_metadata import read_image_size
+
+
+def _segment(code: int, payload: bytes) -> bytes:
+    return bytes([0xFF, code]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def _tiff(endian: str, entries: list[tuple[int, int, int]]) -> bytes:
+    """TIFF header and a first IFD of (tag, type, value) entries, right after the header."""
+    magic = b"II*\x00" if endian == "<" else b"MM\x00*"
+    ifd = struct.pack(endian + "H", len(entries))
+    for tag, field_type, value in entries:
+        if field_type == 3:
+            # SHORT values are left justified in the 4 byte value field
+            packed = struct.pack(endian + "HH", value, 0)
+        else:
+            packed = struct.pack(endian + "I", value)
+        ifd += struct.pack(endian + "HHI", tag, field_type, 1) + packed
+    return magic + struct.pack(endian + "I", 8) + ifd + struct.pack(endian + "I", 0)
+
+
+def _jpeg(width: int, height: int, orientation: int | None = None, fill: int = 0) -> bytes:
+    data = b"\xff\xd8"
+    data += _segment(0xE0, b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00")
+    if orientation is not None:
+        data += _segment(0xE1, b"Exif\x00\x00" + _tiff("<", [(274, 3, orientation)]))
+    # fill bytes may pad any marker
+    data += b"\xff" * fill
+    data += _segment(0xDB, bytes(65))
+    data += _segment(0xC0, struct.pack(">BHHB", 8, height, width, 3) + bytes(9))
+    return data + _segment(0xDA, bytes(10)) + b"\x00" * 16 + b"\xff\xd9"
+
+
+def _write(tmp_path, name: str, data: bytes) -> str:  # type: ignore[no-untyped-def]
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_jpeg_size(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    assert read_image_size(_write(tmp_path, "a.jpg", _jpeg(4000, 3000))) == (4000, 3000)
+
+
+def test_jpeg_size_with_fill_bytes(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    assert read_image_size(_write(tmp_path, "a.jpg", _jpeg(640, 480, fill=3))) == (640, 480)
+
+
+@pytest.mark.parametrize(
+    "orientation, expected",
+    [(1, (4000, 3000)), (3, (4000, 3000)), (5, (3000, 4000)), (6, (3000, 4000)), (7, (3000, 4000)), (8, (3000, 4000))],
+)
+def test_jpeg_exif_orientation(tmp_path, orientation: int, expected: tuple) -> None:  # type: ignore[no-untyped-def]
+    path = _write(tmp_path, "a.jpg", _jpeg(4000, 3000, orientation))
+    assert read_image_size(path) == expected
+
+
+def test_jpeg_without_frame_header(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    data = b"\xff\xd8" + _segment(0xDA, bytes(10)) + b"\xff\xd9"
+    assert read_image_size(_write(tmp_path, "a.jpg", data)) is None
+
+
+def test_png_size(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    ihdr = struct.pack(">II", 1920, 1080) + bytes([8, 2, 0, 0, 0])
+    data = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr)) + b"IHDR" + ihdr + bytes(4)
+    assert read_image_size(_write(tmp_path, "a.png", data)) == (1920, 1080)
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+def test_tiff_size(tmp_path, endian: str) -> None:  # type: ignore[no-untyped-def]
+    # width as LONG, height as SHORT
+    data = _tiff(endian, [(256, 4, 5000), (257, 3, 2500)])
+    assert read_image_size(_write(tmp_path, "a.tif", data)) == (5000, 2500)
+
+
+def test_big_endian_tiff_orientation(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    data = _tiff(">", [(256, 4, 5000), (257, 4, 2500), (274, 3, 6)])
+    assert read_image_size(_write(tmp_path, "a.tif", data)) == (2500, 5000)
+
+
+def test_unknown_format(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    assert read_image_size(_write(tmp_path, "a.jpg", b"GIF89a" + bytes(32))) is None
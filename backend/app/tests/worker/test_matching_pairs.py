@@ -0,0 +1,88 @@
+import json
+import os
+
+import pytest
+
+# numpy is a worker dependency, not installed in the API image
+np = pytest.importorskip("numpy")
+
+from app.worker.tasks.photogrammetry.matching_pairs import (  # noqa: E402
+    MAX_GPS_NEIGHBORS,
+    MIN_GPS_NEIGHBORS,
+    _neighbour_pairs,
+    gps_matching_limits,
+)
+
+# ~1 meter in degrees of latitude
+METER = 1 / 111320.0
+
+
+def _write_exifs(process_dir: str, rows: int, columns: int, spacing: float, focal_ratio=None) -> None:  # type: ignore[no-untyped-def]
+    """A survey grid of rows x columns images, spacing meters apart, flying at 100m."""
+    exif_dir = os.path.join(process_dir, "exif")
+    os.makedirs(exif_dir, exist_ok=True)
+    for row in range(rows):
+        for column in range(columns):
+            exif = {
+                "gps": {
+                    "latitude": 45.0 + row * spacing * METER,
+                    # close enough to 1 meter at 45 degrees for this test
+                    "longitude": 11.0 + column * spacing * METER / np.cos(np.radians(45.0)),
+                    "altitude": 100.0,
+                }
+            }
+            if focal_ratio:
+                exif["focal_ratio"] = focal_ratio
+            with open(os.path.join(exif_dir, f"IMG_{row:03d}_{column:03d}.JPG.exif"), "w") as f:
+                json.dump(exif, f)
+
+
+def test_neighbour_pairs_match_brute_force() -> None:
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(0, 500, (400, 2))
+    radius = 37.0
+
+    pairs = _neighbour_pairs(positions, radius)
+
+    distances = np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis=2)
+    i, j = np.nonzero(np.triu(distances < radius, k=1))
+    assert sorted(map(tuple, pairs.tolist())) == sorted(zip(i.tolist(), j.tolist(), strict=True))
+
+
+def test_gps_matching_limits_from_flight_height(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    process_dir = str(tmp_path)
+    _write_exifs(process_dir, 10, 10, 20.0, focal_ratio=1.0)
+
+    limits = gps_matching_limits(process_dir, {"flight_height": 100})
+
+    assert limits is not None
+    # footprint = flight height / focal ratio
+    assert limits["matching_gps_distance"] == pytest.approx(100.0)
+    assert MIN_GPS_NEIGHBORS <= limits["matching_gps_neighbors"] <= MAX_GPS_NEIGHBORS
+    # the preset graph pairs would be matched on top of the GPS ones
+    assert limits["matching_graph_rounds"] == 0
+
+
+def test_gps_matching_limits_from_image_spacing(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    process_dir = str(tmp_path)
+    _write_exifs(process_dir, 10, 10, 20.0)
+
+    limits = gps_matching_limits(process_dir, {"image_overlap": 0.75})
+
+    assert limits is not None
+    # footprint = spacing / (1 - overlap)
+    assert limits["matching_gps_distance"] == pytest.approx(80.0, rel=0.05)
+    assert MIN_GPS_NEIGHBORS <= limits["matching_gps_neighbors"] <= MAX_GPS_NEIGHBORS
+
+
+def test_gps_matching_limits_skipped_without_enough_gps(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    process_dir = str(tmp_path)
+    _write_exifs(process_dir, 2, 5, 20.0, focal_ratio=1.0)
+    assert gps_matching_limits(process_dir, {"flight_height": 100}) is None
+
+    # most images without GPS: exhaustive matching
+    _write_exifs(process_dir, 10, 10, 20.0, focal_ratio=1.0)
+    for index in range(200):
+        with open(os.path.join(process_dir, "exif", f"NO_GPS_{index}.JPG.exif"), "w") as f:
+            json.dump({"gps": {}}, f)
+    assert gps_matching_limits(process_dir, {"flight_height": 100}) is None
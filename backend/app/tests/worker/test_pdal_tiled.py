@@ -0,0 +1,114 @@
+import csv
+import json
+import math
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from app.worker.tasks.pointcloud.pdal.processes import (
+    TILE_ALIGNMENT,
+    _process_las_file,
+    _process_las_stages,
+    _tile_grid,
+    pdal_metadata,
+    process_tiled,
+)
+
+requires_pdal = pytest.mark.skipif(shutil.which("pdal") is None, reason="pdal is not installed")
+
+TILE_SIZE = 100.0
+
+
+def _inner_edges(tiles: list, axis: int) -> list:
+    # the widened outer edges never border another tile
+    lows = sorted({tile[axis] for tile in tiles})
+    return lows[1:]
+
+
+def test_tile_grid_edges_on_the_alignment_lattice() -> None:
+    bounds = [1234.5, -987.25, 1790.0, -310.0]
+
+    tiles = _tile_grid(bounds, TILE_SIZE)
+
+    for axis in (0, 1):
+        edges = _inner_edges(tiles, axis)
+        assert edges
+        assert all(edge % TILE_ALIGNMENT == 0 for edge in edges)
+        # tile_size is rounded up to the lattice
+        assert all(b - a == 2 * TILE_ALIGNMENT for a, b in zip(edges, edges[1:], strict=False))
+    # the cores cover the bounds
+    assert min(tile[0] for tile in tiles) < bounds[0]
+    assert min(tile[1] for tile in tiles) < bounds[1]
+    assert max(tile[2] for tile in tiles) > bounds[2]
+    assert max(tile[3] for tile in tiles) > bounds[3]
+
+
+def _write_scene(path: str) -> None:
+    """~1 point per square meter of sloped terrain with box buildings, and a few low outliers."""
+    rng = random.Random(0)
+    buildings = [
+        (rng.uniform(20, 380), rng.uniform(20, 380), rng.uniform(8, 20), rng.uniform(6, 15))
+        for _ in range(30)
+    ]
+    with open(path, "w") as f:
+        f.write("X,Y,Z\n")
+        for _ in range(160000):
+            x, y = rng.uniform(0, 400), rng.uniform(0, 400)
+            z = 0.05 * x + 2 * math.sin(y / 30)
+            for bx, by, size, height in buildings:
+                if abs(x - bx) < size / 2 and abs(y - by) < size / 2:
+                    z += height
+                    break
+            if rng.random() < 0.001:
+                z -= 20
+            f.write(f"{x:.2f},{y:.2f},{z:.2f}\n")
+
+
+def _pdal_pipeline(path: str, stages: list) -> None:
+    with open(path, "w") as f:
+        json.dump(stages, f)
+    subprocess.run(["pdal", "pipeline", path], check=True)
+
+
+def _classifications(tmp_path, las_path: str) -> dict:  # type: ignore[no-untyped-def]
+    csv_path = f"{las_path}.csv"
+    _pdal_pipeline(str(tmp_path / "read.pipeline.json"), [
+        las_path,
+        {"type": "writers.text", "format": "csv", "order": "X,Y,Z,Classification", "keep_unspecified": False, "filename": csv_path},
+    ])
+    with open(csv_path) as f:
+        rows = list(csv.DictReader(f))
+    return {(row["X"], row["Y"], row["Z"]): int(float(row["Classification"])) for row in rows}
+
+
+@requires_pdal
+def test_tiled_ground_classification_matches_monolithic(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    scene = str(tmp_path / "scene.csv")
+    _write_scene(scene)
+    input_path = str(tmp_path / "scene.las")
+    _pdal_pipeline(str(tmp_path / "scene.pipeline.json"), [scene, {"type": "writers.las", "filename": input_path}])
+    stages = _process_las_stages({}, ground_classification=True)
+
+    monolithic = _classifications(tmp_path, _process_las_file(input_path, str(tmp_path / "monolithic.laz"), stages))
+    tiled = _classifications(tmp_path, process_tiled(input_path, stages, str(tmp_path / "tiled.laz"), TILE_SIZE, max_workers=2))
+
+    # every point lands in exactly one tile core
+    assert tiled.keys() == monolithic.keys()
+
+    metadata = pdal_metadata(input_path)["metadata"]
+    tiles = _tile_grid([metadata["minx"], metadata["miny"], metadata["maxx"], metadata["maxy"]], TILE_SIZE)
+    x_edges, y_edges = _inner_edges(tiles, 0), _inner_edges(tiles, 1)
+    assert x_edges and y_edges
+
+    away = [
+        key for key in monolithic
+        if min(abs(float(key[0]) - edge) for edge in x_edges) > TILE_ALIGNMENT / 2
+        and min(abs(float(key[1]) - edge) for edge in y_edges) > TILE_ALIGNMENT / 2
+    ]
+    assert away
+    # filters.outlier thresholds on the neighbour distance statistics of all the points it sees,
+    # which differ a little per tile; the rest of the classification must match
+    mismatches = sum(tiled[key] != monolithic[key] for key in away)
+    assert mismatches <= 0.001 * len(away)
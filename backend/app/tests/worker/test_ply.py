@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+# numpy is a worker dependency, not installed in the API image
+np = pytest.importorskip("numpy")
+
+from app.worker.tasks.photogrammetry.ply import crop_ply, read_ply_header  # noqa: E402
+
+PROPERTIES = [
+    ("x", "f4"),
+    ("y", "f4"),
+    ("z", "f4"),
+    ("red", "u1"),
+    ("green", "u1"),
+    ("blue", "u1"),
+]
+TYPE_NAMES = {"f4": "float", "u1": "uchar"}
+
+
+def _vertices(count: int = 1000) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    vertices = np.empty(count, dtype=[(name, "<" + ply_type) for name, ply_type in PROPERTIES])
+    for name in ("x", "y", "z"):
+        vertices[name] = rng.uniform(-10, 10, count)
+    for name in ("red", "green", "blue"):
+        vertices[name] = rng.integers(0, 255, count)
+    return vertices
+
+
+def _header(ply_format: str, count: int) -> bytes:
+    lines = ["ply", f"format {ply_format} 1.0", f"element vertex {count}"]
+    lines += [f"property {TYPE_NAMES[ply_type]} {name}" for name, ply_type in PROPERTIES]
+    lines.append("end_header")
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+
+def _write_binary(path: str, vertices: np.ndarray) -> None:
+    with open(path, "wb") as f:
+        f.write(_header("binary_little_endian", len(vertices)))
+        f.write(vertices.tobytes())
+
+
+def _write_ascii(path: str, vertices: np.ndarray) -> None:
+    with open(path, "wb") as f:
+        f.write(_header("ascii", len(vertices)))
+        for vertex in vertices:
+            f.write((" ".join(f"{value}" for value in vertex.tolist()) + "\n").encode("ascii"))
+
+
+def _read(path: str) -> tuple[str, np.ndarray]:
+    with open(path, "rb") as f:
+        ply_format, vertex_count, properties, header_size = read_ply_header(f)
+    vertices = np.fromfile(
+        path,
+        dtype=[(name, "<" + ply_type) for name, ply_type in properties],
+        offset=header_size,
+    )
+    assert len(vertices) == vertex_count
+    assert properties == PROPERTIES
+    return ply_format, vertices
+
+
+def _inside(vertices: np.ndarray, min_bound: list, max_bound: list) -> np.ndarray:
+    inside = np.ones(len(vertices), dtype=bool)
+    for axis, name in enumerate(("x", "y", "z")):
+        inside &= (vertices[name] >= min_bound[axis]) & (vertices[name] <= max_bound[axis])
+    return vertices[inside]
+
+
+def test_crop_binary_in_place(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    path = str(tmp_path / "cloud.ply")
+    vertices = _vertices()
+    _write_binary(path, vertices)
+    min_bound, max_bound = [-5, -5, -10], [5, 2, 10]
+
+    kept = crop_ply(path, path, min_bound, max_bound, block_size=128)
+
+    expected = _inside(vertices, min_bound, max_bound)
+    ply_format, cropped = _read(path)
+    assert ply_format == "binary_little_endian"
+    assert kept == len(expected)
+    assert np.array_equal(cropped, expected)
+    assert not os.path.exists(f"{path}.crop.tmp")
+
+
+def test_crop_ascii_to_binary(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    input_path = str(tmp_path / "cloud.ply")
+    output_path = str(tmp_path / "cropped.ply")
+    vertices = _vertices(300)
+    _write_ascii(input_path, vertices)
+    min_bound, max_bound = [-10, -10, 0], [10, 10, 10]
+
+    kept = crop_ply(input_path, output_path, min_bound, max_bound, block_size=64)
+
+    expected = _inside(vertices, min_bound, max_bound)
+    ply_format, cropped = _read(output_path)
+    assert ply_format == "binary_little_endian"
+    assert kept == len(expected)
+    for name in ("red", "green", "blue"):
+        assert np.array_equal(cropped[name], expected[name])
+    for name in ("x", "y", "z"):
+        np.testing.assert_allclose(cropped[name], expected[name], rtol=1e-6)
+
+
+def test_crop_with_infinite_bounds_keeps_every_vertex(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    path = str(tmp_path / "cloud.ply")
+    vertices = _vertices(200)
+    _write_binary(path, vertices)
+
+    kept = crop_ply(path, path, [-np.inf] * 3, [np.inf] * 3)
+
+    assert kept == len(vertices)
+    assert np.array_equal(_read(path)[1], vertices)
+
+
+def test_crop_removes_the_temporary_file_on_error(tmp_path) -> None:  # type: ignore[no-untyped-def]
+    path = str(tmp_path / "cloud.ply")
+    with open(path, "wb") as f:
+        f.write(_header("binary_little_endian", 10))
+        f.write(b"\x00" * 7)  # truncated vertices
+
+    with pytest.raises(ValueError):
+        crop_ply(path, str(tmp_path / "cropped.ply"), [-1] * 3, [1] * 3)
+
+    assert not os.path.exists(str(tmp_path / "cropped.ply"))
+    assert not os.path.exists(str(tmp_path / "cropped.ply.crop.tmp"))
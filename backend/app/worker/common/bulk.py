@@ -0,0 +1,97 @@
+from app.core.config import settings
+from app.core.db import engine_tasks
+
+
+def quote_identifier(name):
+    return '"' + f"{name}".replace('"', '""') + '"'
+
+
+class CopyWriter:
+    """Stream rows into table_name with psycopg COPY ... FROM STDIN.
+
+    Rows are buffered and sent in batches of batch_size, all in one transaction.
+    Geometry values are expected as hex (E)WKB strings, which PostGIS parses without a
+    WKT round trip. Use as a context manager: the rows are committed on a clean exit
+    and rolled back if the block raises.
+
+    COPY cannot skip conflicting rows: with on_conflict_do_nothing each batch is copied into a
+    temporary table and moved with INSERT ... ON CONFLICT DO NOTHING, so rows whose unique key
+    is already in table_name are dropped.
+    """
+
+    def __init__(self, table_name, columns, batch_size=None, engine=engine_tasks, on_conflict_do_nothing=False):
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.batch_size = batch_size or settings.DTT_BULK_COPY_BATCH_SIZE
+        self.engine = engine
+        self.on_conflict_do_nothing = on_conflict_do_nothing
+        self.staging_table_name = None
+        self.connection = None
+        self.rows = []
+        self.count = 0
+
+    def __enter__(self):
+        self.connection = self.engine.raw_connection()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+                self.connection.driver_connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.connection.close()
+            self.connection = None
+        return False
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = ", ".join(quote_identifier(c) for c in self.columns)
+        driver_connection = self.connection.driver_connection
+        with driver_connection.cursor() as cursor:
+            target = quote_identifier(self.table_name)
+            if self.on_conflict_do_nothing:
+                if self.staging_table_name is None:
+                    self.staging_table_name = f"{self.table_name}_copy_staging"
+                    cursor.execute(
+                        f"CREATE TEMPORARY TABLE {quote_identifier(self.staging_table_name)} "
+                        f"(LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP"
+                    )
+                target = quote_identifier(self.staging_table_name)
+            with cursor.copy(f"COPY {target} ({columns}) FROM STDIN") as copy:
+                for row in self.rows:
+                    copy.write_row(row)
+            if self.on_conflict_do_nothing:
+                cursor.execute(
+                    f"INSERT INTO {quote_identifier(self.table_name)} ({columns}) "
+                    f"SELECT {columns} FROM {target} ON CONFLICT DO NOTHING"
+                )
+                cursor.execute(f"TRUNCATE {target}")
+        self.count += len(self.rows)
+        self.rows = []
+
+
+def cluster_table(table_name, key_expression, indexes=(), engine=engine_tasks):
+    """Rewrite table_name in key_expression order (e.g. a GeoHash), build indexes and refresh statistics.
+
+    Exporters query the table tile by tile; once it is clustered the rows of a tile sit on
+    neighbouring pages instead of wherever the loading chunk happened to land. indexes are
+    CREATE INDEX definitions ("USING gist(...)") built after the rewrite, so only once.
+    """
+    table = quote_identifier(table_name)
+    index = quote_identifier(f"{table_name}_cluster_idx")
+    with engine.connect() as connection:
+        connection.exec_driver_sql(f"CREATE INDEX {index} ON {table} ({key_expression})")
+        connection.exec_driver_sql(f"CLUSTER {table} USING {index}")
+        for definition in indexes:
+            connection.exec_driver_sql(f"CREATE INDEX ON {table} {definition}")
+        connection.exec_driver_sql(f"ANALYZE {table}")
+        connection.commit()
@@ -0,0 +1,67 @@
+import struct
+
+import numpy as np
+
+# EWKB (PostGIS extended WKB) type flags
+EWKB_Z = 0x80000000
+EWKB_SRID = 0x20000000
+
+WKB_POINT = 1
+WKB_POLYGON = 3
+WKB_POLYHEDRALSURFACE = 15
+
+# one POLYHEDRALSURFACE Z member: a single closed ring triangle, little endian
+TRIANGLE_DTYPE = np.dtype([
+    ('byte_order', 'u1'),
+    ('geometry_type', '<u4'),
+    ('rings', '<u4'),
+    ('points', '<u4'),
+    ('coordinates', '<f8', (4, 3)),
+])
+
+
+def _header(geometry_type, srid=None):
+    if srid is None:
+        return struct.pack('<BI', 1, geometry_type | EWKB_Z)
+    return struct.pack('<BII', 1, geometry_type | EWKB_Z | EWKB_SRID, srid)
+
+
+def point_z_to_ewkb(coordinates, srid=4326):
+    z = coordinates[2] if len(coordinates) > 2 and coordinates[2] else 0
+    return _header(WKB_POINT, srid) + struct.pack('<3d', coordinates[0], coordinates[1], z)
+
+
+def _triangle_records(vertices, triangles):
+    records = np.empty(len(triangles), dtype=TRIANGLE_DTYPE)
+    records['byte_order'] = 1
+    records['geometry_type'] = WKB_POLYGON | EWKB_Z
+    records['rings'] = 1
+    records['points'] = 4
+    corners = vertices[triangles]
+    records['coordinates'][:, :3] = corners
+    records['coordinates'][:, 3] = corners[:, 0]
+    return records
+
+
+def triangles_to_ewkb(vertices, triangles, srid=4326):
+    """POLYHEDRALSURFACE Z of the triangles (T, 3) indexing vertices (N, 3)."""
+    body = _triangle_records(vertices, triangles).tobytes()
+    return _header(WKB_POLYHEDRALSURFACE, srid) + struct.pack('<I', len(triangles)) + body
+
+
+def extrusion_to_ewkb(result, srid=4326):
+    """One POLYHEDRALSURFACE Z per feature of an extrusion.extrude_polygons result, None when it has no triangles.
+
+    All triangles are encoded with a single array write; each feature is a slice of that buffer.
+    """
+    offsets = result['triangle_offsets']
+    body = memoryview(_triangle_records(result['vertices'], result['triangles']).tobytes())
+    header = _header(WKB_POLYHEDRALSURFACE, srid)
+    size = TRIANGLE_DTYPE.itemsize
+    geometries = []
+    for start, end in zip(offsets[:-1], offsets[1:], strict=True):
+        if end == start:
+            geometries.append(None)
+            continue
+        geometries.append(header + struct.pack('<I', end - start) + body[start * size:end * size])
+    return geometries
@@ -1,4 +1,21 @@
+import functools
+import json
 import math
+import operator as operators
+
+import numpy as np
+
+# errors an expression can raise on bad input (wrong types, missing keys, division by zero...)
+EXPRESSION_ERRORS = (TypeError, ValueError, ArithmeticError, KeyError, IndexError, AttributeError)
+
+ARITHMETIC_OPERATORS = {
+    '+': operators.add,
+    '-': operators.sub,
+    '*': operators.mul,
+    '/': operators.truediv,
+}
+
+Z_FUNCTIONS = ['$maxZ', '$minZ']
 
 
 def get_geometry(feature):
@@ -14,7 +31,7 @@ def get_z(coordinates):
 
 
 def get_func(name, feature):
-    if name in ['$maxZ', '$minZ']:
+    if name in Z_FUNCTIONS:
         geometry = get_geometry(feature)
         if geometry['type'] == 'Point':
             return get_z(geometry['coordinates'])
@@ -34,51 +51,291 @@ def get_func(name, feature):
     return None
 
 
+def _constant(type, value):
+    if value is None:
+        return None
+    if type == 'string':
+        return f"{value}"
+    if type == 'number':
+        return float(value)
+    return value
+
+
+def _expression_parts(type, value):
+    """operator, operand type and the (up to two) operand expressions of a list expression"""
+    operator = value[0]
+    _type = '' if operator in ['property', 'func'] else type
+    a = value[1] if len(value) > 1 else None
+    b = value[2] if len(value) > 2 else None
+    return operator, _type, a, b
+
+
+# compiled (row by row) evaluation
+
+def _compile_node(type, value):
+    if not isinstance(value, list):
+        try:
+            constant = _constant(type, value)
+        except EXPRESSION_ERRORS as e:
+            error = e
+
+            def fail(_feature):
+                raise error
+            return fail
+        return lambda feature: constant
+
+    if not value:
+        def empty(_feature):
+            raise IndexError('empty expression')
+        return empty
+
+    operator, _type, a, b = _expression_parts(type, value)
+    a = _compile_operand(_type, a)
+    b = _compile_operand(_type, b)
+
+    if operator in ARITHMETIC_OPERATORS:
+        operation = ARITHMETIC_OPERATORS[operator]
+        return lambda feature: operation(float(a(feature)), float(b(feature)))
+    if operator == 'concat':
+        return lambda feature: f"{a(feature)}{b(feature)}"
+    if operator == 'lowercase':
+        return lambda feature: f"{a(feature)}".lower()
+    if operator == 'uppercase':
+        return lambda feature: f"{a(feature)}".upper()
+    if operator == 'property':
+        def get_property(feature):
+            name = a(feature)
+            properties = feature['properties']
+            if name in properties:
+                return properties[name]
+            return None
+        return get_property
+    if operator == 'func':
+        return lambda feature: get_func(a(feature), feature)
+    return lambda feature: None
+
+
+def _compile_operand(type, value):
+    # a failing operand evaluates to None and lets its parent decide, as parse_expression does
+    if value is None:
+        return lambda feature: None
+    node = _compile_node(type, value)
+
+    def evaluate(feature):
+        try:
+            return node(feature)
+        except EXPRESSION_ERRORS:
+            return None
+    return evaluate
+
+
+def compile_expression(type, value, default_value=None):
+    """Compile a pipeline expression once into a function of the feature.
+
+    The function returns the same result as parse_expression(type, value, feature, default_value)
+    without walking the expression tree again for every feature.
+    """
+    node = _compile_node(type, value)
+
+    def evaluate(feature):
+        try:
+            return node(feature)
+        except EXPRESSION_ERRORS:
+            return default_value
+    return evaluate
+
+
+@functools.lru_cache(maxsize=256, typed=True)
+def _cached_expression(type, value_json, default_value):
+    return compile_expression(type, json.loads(value_json), default_value)
+
+
 def parse_expression(type, value, feature, default_value=None):
+    # compiled once per expression, not once per call
+    return _cached_expression(type, json.dumps(value), default_value)(feature)
+
+
+# columnar evaluation
+
+def _as_floats(values, failed):
+    if isinstance(values, np.ndarray) and values.dtype == np.float64:
+        return values, failed
+    failed = failed | np.fromiter((v is None for v in values), dtype=bool, count=len(values))
     try:
-        if not isinstance(value, list):
-            if value is None:
-                return None
-            if type == 'string':
-                return f"{value}"
-            if type == 'number':
-                return float(value)
-            return value
-        operator = value[0]
-
-        _type = type
-        if operator in ['property', 'func']:
-            _type = ''
-
-        value_length = len(value)
-
-        a = None
-        if value_length > 1:
-            a = parse_expression(_type, value[1], feature)
-
-        b = None
-        if value_length > 2:
-            b = parse_expression(_type, value[2], feature)
-
-        if operator == '+':
-            return float(a) + float(b)
-        if operator == "-":
-            return float(a) - float(b)
-        if operator == "*":
-            return float(a) * float(b)
-        if operator == "/":
-            return float(a) / float(b)
-        if operator == "concat":
-            return f"{a}{b}"
-        if operator == "lowercase":
-            return f"{a}".lower()
-        if operator == "uppercase":
-            return f"{a}".upper()
-        if operator == "property":
-            if a in feature['properties']:
-                return feature['properties'][a]
-        if operator == "func":
-            return get_func(a, feature)
+        return np.array([0.0 if f else v for v, f in zip(values, failed, strict=True)], dtype=np.float64), failed
+    except EXPRESSION_ERRORS:
+        pass
+    floats = np.zeros(len(values), dtype=np.float64)
+    failed = failed.copy()
+    for index, v in enumerate(values):
+        if failed[index]:
+            continue
+        try:
+            floats[index] = float(v)
+        except EXPRESSION_ERRORS:
+            failed[index] = True
+    return floats, failed
+
+
+def _as_objects(values, failed):
+    if isinstance(values, np.ndarray):
+        values = values.tolist()
+    return [None if f else v for v, f in zip(values, failed, strict=True)]
+
+
+def _column_node(type, value, properties, count, functions):
+    """(values, failed) of an expression over count rows; values is a float64 array or a list."""
+    no_failure = np.zeros(count, dtype=bool)
+    if not isinstance(value, list):
+        try:
+            return [_constant(type, value)] * count, no_failure
+        except EXPRESSION_ERRORS:
+            return [None] * count, ~no_failure
+    if not value:
+        return [None] * count, ~no_failure
+
+    operator, _type, a, b = _expression_parts(type, value)
+    a, a_failed = _column_node(_type, a, properties, count, functions) if a is not None else ([None] * count, no_failure)
+    b, b_failed = _column_node(_type, b, properties, count, functions) if b is not None else ([None] * count, no_failure)
+
+    if operator in ARITHMETIC_OPERATORS:
+        a, a_failed = _as_floats(a, a_failed)
+        b, b_failed = _as_floats(b, b_failed)
+        failed = a_failed | b_failed
+        if operator == '/':
+            failed = failed | (b == 0)
+        with np.errstate(all='ignore'):
+            return ARITHMETIC_OPERATORS[operator](a, b), failed
+    if operator == 'concat':
+        return [f"{x}{y}" for x, y in zip(_as_objects(a, a_failed), _as_objects(b, b_failed), strict=True)], no_failure
+    if operator in ['lowercase', 'uppercase']:
+        convert = str.lower if operator == 'lowercase' else str.upper
+        return [convert(f"{x}") for x in _as_objects(a, a_failed)], no_failure
+    if operator in ['property', 'func']:
+        columns = properties if operator == 'property' else (functions or {})
+        names = _as_objects(a, a_failed)
+        values = []
+        failed = no_failure.copy()
+        for index, name in enumerate(names):
+            try:
+                column = columns[name] if name in columns else None
+            except EXPRESSION_ERRORS:
+                column = None
+                failed[index] = True
+            values.append(column[index] if column is not None else None)
+        return values, failed
+    return [None] * count, no_failure
+
+
+def evaluate_expression_columns(type, value, properties, count, functions=None, default_value=None):
+    """Evaluate an expression for a whole chunk at once.
+
+    properties maps every property name to its column (a sequence of count values) and functions
+    maps '$minZ' / '$maxZ' to the per-row values, as the geometry is not available here. Returns
+    the list parse_expression would give row by row.
+    """
+    values, failed = _column_node(type, value, properties, count, functions)
+    values = values.tolist() if isinstance(values, np.ndarray) else values
+    return [default_value if f else v for v, f in zip(values, failed, strict=True)]
+
+
+# SQL pushdown
+
+def _sql_literal(value):
+    if value is None:
+        return 'NULL', None
+    if isinstance(value, bool):
+        return None, None
+    if isinstance(value, int | float):
+        if not math.isfinite(value):
+            return None, None
+        return f"CAST({float(value)!r} AS double precision)", 'number'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'", 'string'
+    return None, None
+
+
+def _sql_text(sql, kind):
+    # f"{value}" of the row by row evaluation: None becomes 'None', numbers would format differently
+    if kind == 'number':
+        return None
+    if sql == 'NULL':
+        return "'None'"
+    return f"COALESCE(CAST({sql} AS text), 'None')"
+
+
+def _sql_node(type, value, columns, functions):
+    """(sql, kind) of an expression, kind being 'number', 'string' or None (NULL); sql is None if not supported."""
+    if not isinstance(value, list):
+        try:
+            constant = _constant(type, value)
+        except EXPRESSION_ERRORS:
+            return None, None
+        return _sql_literal(constant)
+    if not value:
+        return None, None
+
+    operator, _type, a, b = _expression_parts(type, value)
+    if operator not in ARITHMETIC_OPERATORS and operator not in ['concat', 'lowercase', 'uppercase', 'property', 'func']:
+        return 'NULL', None
+
+    if operator in ['property', 'func']:
+        if isinstance(a, list):
+            return None, None
+        name = _constant(_type, a)
+        if operator == 'property':
+            if name not in columns:
+                return 'NULL', None
+            # a property with no SQL counterpart (e.g. dates) keeps the expression client side
+            if columns[name] is None:
+                return None, None
+            column_sql, kind = columns[name]
+            return column_sql, kind
+        if functions and name in functions:
+            return functions[name], 'number'
+        return None, None
+
+    a_sql, a_kind = _sql_node(_type, a, columns, functions) if a is not None else ('NULL', None)
+    b_sql, b_kind = _sql_node(_type, b, columns, functions) if b is not None else ('NULL', None)
+    if a_sql is None or b_sql is None:
+        return None, None
+
+    if operator in ARITHMETIC_OPERATORS:
+        if 'string' in [a_kind, b_kind]:
+            return None, None
+        a_sql = f"CAST({a_sql} AS double precision)"
+        b_sql = f"CAST({b_sql} AS double precision)"
+        if operator == '/':
+            b_sql = f"NULLIF({b_sql}, 0)"
+        return f"({a_sql} {operator} {b_sql})", 'number'
+    if operator == 'concat':
+        a_text, b_text = _sql_text(a_sql, a_kind), _sql_text(b_sql, b_kind)
+        if a_text is None or b_text is None:
+            return None, None
+        return f"({a_text} || {b_text})", 'string'
+    if operator in ['lowercase', 'uppercase']:
+        a_text = _sql_text(a_sql, a_kind)
+        if a_text is None:
+            return None, None
+        return f"{'lower' if operator == 'lowercase' else 'upper'}({a_text})", 'string'
+
+
+def expression_to_sql(type, value, columns, functions=None, default_value=None):
+    """SQL equivalent of the expression, or None when some part has no exact PostGIS counterpart.
+
+    columns maps property names to (sql, kind) with kind 'number' or 'string', or to None when
+    the property exists but cannot be used in SQL; functions maps '$minZ' / '$maxZ' to SQL
+    (e.g. ST_ZMin(geom)). The result must have the requested type, and rows where the row by
+    row evaluation would fail fall back to default_value.
+    """
+    sql, kind = _sql_node(type, value, columns, functions)
+    if sql is None:
+        return None
+    if kind is not None and type in ['number', 'string'] and kind != type:
         return None
-    except Exception:
-        return default_value
+    if isinstance(value, list) and value and value[0] in ARITHMETIC_OPERATORS:
+        default_sql, default_kind = _sql_literal(default_value)
+        if default_sql is None or (default_kind is not None and default_kind != kind):
+            return None
+        return f"COALESCE({sql}, {default_sql})"
+    return sql
@@ -8,14 +8,18 @@ from datetime import date, datetime
 class GeometryType(types.UserDefinedType):
     cache_ok = True
 
-    def __init__(self, geometry_type="POLYHEDRALSURFACEZ", epsg_code=4326):
+    def __init__(self, geometry_type="POLYHEDRALSURFACEZ", epsg_code=4326, binary=False):
         self.geometry_type = geometry_type
         self.epsg_code = epsg_code
+        # bind (E)WKB bytes instead of WKT text
+        self.binary = binary
 
     def get_col_spec(self, **kw):
         return f"geometry({self.geometry_type}, {self.epsg_code})"
 
     def bind_expression(self, bindvalue):
+        if self.binary:
+            return func.ST_GeomFromEWKB(bindvalue, type_=self)
         return func.ST_GeomFromText(bindvalue, type_=self)
 
     def column_expression(self, col):
@@ -23,6 +27,8 @@ class GeometryType(types.UserDefinedType):
 
     def bind_processor(self, dialect):
         def process(value):
+            if self.binary and isinstance(value, str):
+                return bytes.fromhex(value)
             return value
         return process
 
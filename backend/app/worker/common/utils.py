@@ -60,6 +60,24 @@ def run_subprocess(cmd, check=False, capture_output=False, text=False):
     return subprocess.CompletedProcess(cmd, proc.returncode, stdout=out, stderr=err)
 
 
+def get_worker_concurrency():
+    return max(1, int(os.environ.get("CELERY_WORKER_CONCURRENCY", 1)))
+
+
+def get_available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_total_memory_mb():
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 / 1024)
+    except (ValueError, OSError, AttributeError):
+        return 4096
+
+
 def get_asset_upload_path(pathname):
     return os.path.join(settings.ASSETS_DATA, "upload", pathname)
 
@@ -69,6 +87,10 @@ def get_asset_table_name(asset_id):
     return f'asset_{id}'
 
 
+def get_asset_triangulation_table_name(asset_id):
+    return f'{get_asset_table_name(asset_id)}_triangulation'
+
+
 def get_pipeline_table_name(pipeline_id):
     id = f"{pipeline_id}".replace('-', '_')
     return f'pipeline_{id}'
@@ -17,11 +17,14 @@ def run(pipeline_extended):
     include_mesh = stage in ('all', 'point_cloud_to_mesh')
     include_tile = stage in ('all', 'mesh_to_3dtile')
 
+    # split mode fans the submodels out as chords and merges the dense clouds before denoise
+    split = data.get('split', False)
+
     steps = []  # (task_name, extra_kwargs)
     if stage in ('all', 'images_to_sparse_reconstruction'):
-        steps.append(('photogrammetry_images_to_sparse', {}))     # photogrammetry
+        steps.append(('photogrammetry_split_images_to_sparse' if split else 'photogrammetry_images_to_sparse', {}))  # photogrammetry
     if stage in ('all', 'sparse_reconstruction_to_dense_point_cloud'):
-        steps.append(('photogrammetry_sparse_to_dense', {}))      # photogrammetry
+        steps.append(('photogrammetry_split_sparse_to_dense' if split else 'photogrammetry_sparse_to_dense', {}))  # photogrammetry
     if include_mesh:
         steps.append(('denoise_point_cloud', {'input_file': dense_ply, 'output_file': merged_xyz}))  # point-cloud
         steps.append(('photogrammetry_create_mesh', {}))          # photogrammetry
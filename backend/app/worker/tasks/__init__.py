@@ -12,6 +12,7 @@ CAPABILITIES = {
         'extensions': {
             '.laz': 'inspect_pointcloud',
             '.las': 'inspect_pointcloud',
+            '.las.zip': 'inspect_pointcloud_collection',
         },
     },
     'mesh': {
@@ -39,6 +40,7 @@ CAPABILITIES = {
 TASK_QUEUES = {
     'inspect_vector': 'vector',
     'inspect_pointcloud': 'point-cloud',
+    'inspect_pointcloud_collection': 'point-cloud',
     'inspect_raster': 'vector',
     'inspect_photogrammetry': 'photogrammetry',
     'inspect_glb': 'common',
@@ -52,6 +54,12 @@ TASK_QUEUES = {
     'tile_obj_3dtiles': 'mesh',
     'photogrammetry_images_to_sparse': 'photogrammetry',
     'photogrammetry_sparse_to_dense': 'photogrammetry',
+    'photogrammetry_split_images_to_sparse': 'photogrammetry',
+    'photogrammetry_reconstruct_submodel': 'photogrammetry',
+    'photogrammetry_align_submodels': 'photogrammetry',
+    'photogrammetry_split_sparse_to_dense': 'photogrammetry',
+    'photogrammetry_submodel_to_dense': 'photogrammetry',
+    'photogrammetry_merge_dense': 'photogrammetry',
     'photogrammetry_create_mesh': 'photogrammetry',
     'photogrammetry_create_texture': 'photogrammetry',
     'photogrammetry_resolve_tile_input': 'photogrammetry',
@@ -5,7 +5,8 @@ from sqlmodel import Session, text
 from app.core.db import engine_tasks
 from app.worker.main import celery, AssetDatabaseTask
 from app.worker.common.utils import (
-    get_asset_upload_path, get_asset_table_name, get_pipeline_table_name, setup_output_directory
+    get_asset_upload_path, get_asset_table_name, get_pipeline_table_name, setup_output_directory,
+    get_asset_triangulation_table_name
 )
 
 
@@ -22,9 +23,11 @@ def inspect_glb(options):
 def complete_asset_remove_process(options):
     asset = options['asset']
     table_name = get_asset_table_name(asset['id'])
+    triangulation_table_name = get_asset_triangulation_table_name(asset['id'])
 
     with Session(engine_tasks) as session:
         session.exec(text(f"DROP TABLE IF EXISTS {table_name};"))
+        session.exec(text(f"DROP TABLE IF EXISTS {triangulation_table_name};"))
         session.commit()
 
     try:
@@ -1,16 +1,190 @@
 import logging
+import math
 import os
 import numpy as np
 import open3d as o3d
+from billiard.pool import Pool
+from app.worker.tasks.photogrammetry.utils import get_cpu_count
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+REMOVE_VERTICES_THRESHOLD = 0.002
+SMOOTH_ITERATIONS = 10
+
+
+def _target_number_of_triangles(params):
+    # the tiles of the last depth level of the mesh tiling: 2^depth * 2^depth tiles of tile_faces_target faces
+    depth = params.get('depth', 4)
+    tile_faces_target = params.get('tile_faces_target', 10000)
+    return int(pow(4, depth) * tile_faces_target)
+
+
+def _poisson(points, normals, depth, n_threads):
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points)
+    pcd.normals = o3d.utility.Vector3dVector(normals)
+    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
+        pcd,
+        depth=depth,
+        n_threads=n_threads,
+        linear_fit=True
+    )
+    densities = np.asarray(densities)
+    vertices_to_remove = densities < np.quantile(densities, REMOVE_VERTICES_THRESHOLD)
+    mesh.remove_vertices_by_mask(vertices_to_remove)
+    return mesh
+
+
+def _mesh_block(points, normals, core_min, core_max, margin, depth, n_threads, target_number_of_triangles):
+    """Mesh one overlapping block and keep the triangles whose centroid falls in its core (XY).
+
+    The block is selected here, from the shared arrays, so the caller never holds all the
+    block copies at once. Returns the vertices, the triangles and the octree cell size.
+    """
+    block = np.all((points[:, :2] >= core_min - margin) & (points[:, :2] < core_max + margin), axis=1)
+    block_points = points[block]
+    # triangle budget shared by point count; the overlap is trimmed afterwards
+    target_number_of_triangles = max(1000, int(target_number_of_triangles * len(block_points) / len(points)))
+    mesh = _poisson(block_points, normals[block], depth, n_threads)
+    # Poisson works in a cube 1.1 times the block extent, split 2^depth times
+    cell_size = float(np.ptp(block_points, axis=0).max()) * 1.1 / pow(2, depth)
+    del block_points
+    mesh = mesh.filter_smooth_taubin(number_of_iterations=SMOOTH_ITERATIONS)
+    if len(mesh.triangles) > target_number_of_triangles:
+        mesh = mesh.simplify_quadric_decimation(target_number_of_triangles=target_number_of_triangles)
+
+    vertices = np.asarray(mesh.vertices)
+    triangles = np.asarray(mesh.triangles)
+    centroids = vertices[triangles].mean(axis=1)
+    # half open core: a triangle on a shared edge belongs to one block only
+    inside = np.all((centroids[:, :2] >= core_min) & (centroids[:, :2] < core_max), axis=1)
+    triangles = triangles[inside]
+    used = np.unique(triangles)
+    remap = np.full(len(vertices), -1, dtype=np.int64)
+    remap[used] = np.arange(len(used))
+    return vertices[used], remap[triangles], cell_size
+
+
+# the cloud of the tiled mesh in the block pool processes (set by _init_block_process)
+_block_cloud = {}
+
+
+def _init_block_process(points, normals):
+    # inherited through fork, never pickled
+    _block_cloud['points'] = points
+    _block_cloud['normals'] = normals
+
+
+def _mesh_cloud_block(args):
+    return _mesh_block(_block_cloud['points'], _block_cloud['normals'], *args)
+
+
+def _block_ranges(minimum, maximum, tiles):
+    edges = np.linspace(minimum, maximum, tiles + 1)
+    # the last core is closed on the max side
+    edges[-1] = np.nextafter(maximum, np.inf)
+    return list(zip(edges[:-1], edges[1:], strict=True))
+
+
+def _weld_seams(vertices, triangles, seams, distance):
+    """Merge the vertices closer than distance, only within distance of the internal block edges.
+
+    seams holds the x and the y edges. Every other vertex comes from a single block and is left
+    alone. Merged vertices move to the mean of their group; triangles may become degenerate.
+    """
+    band = np.zeros(len(vertices), dtype=bool)
+    for axis, edges in enumerate(seams):
+        for edge in edges:
+            band |= np.abs(vertices[:, axis] - edge) <= distance
+    seam_indices = np.flatnonzero(band)
+    remap = np.arange(len(vertices))
+    if len(seam_indices) == 0:
+        return vertices, triangles
+
+    seam_vertices = vertices[seam_indices]
+    seam_cloud = o3d.geometry.PointCloud()
+    seam_cloud.points = o3d.utility.Vector3dVector(seam_vertices)
+    tree = o3d.geometry.KDTreeFlann(seam_cloud)
+    merged = np.zeros(len(seam_indices), dtype=bool)
+    for index in range(len(seam_indices)):
+        if merged[index]:
+            continue
+        _, neighbours, _ = tree.search_radius_vector_3d(seam_vertices[index], distance)
+        neighbours = np.asarray(neighbours, dtype=np.int64)
+        neighbours = neighbours[~merged[neighbours]]
+        merged[neighbours] = True
+        remap[seam_indices[neighbours]] = seam_indices[index]
+        vertices[seam_indices[index]] = seam_vertices[neighbours].mean(axis=0)
+    return vertices, remap[triangles]
+
+
+def _tiled_mesh(points, normals, params, target_number_of_triangles):
+    """Poisson mesh of tiles x tiles overlapping XY blocks, then stitched.
+
+    Blocks run in a billiard process pool (open3d holds the GIL, and only billiard can start
+    children from a daemonic Celery prefork worker); each Poisson solve is parallel itself over
+    mesh_threads OpenMP threads.
+    """
+    tiles = int(params.get('mesh_tiles'))
+    overlap = float(params.get('mesh_tiles_overlap', 0.1))
+    n_threads = int(params.get('mesh_threads', 1))
+    max_workers = params.get('mesh_workers') or max(1, get_cpu_count() // n_threads)
+    # each block spans 1 / tiles of the extent: a lower octree depth keeps the same resolution
+    depth = max(6, int(params.get('poisson_depth', 11)) - int(math.floor(math.log2(tiles))))
+
+    xy_min = points[:, :2].min(axis=0)
+    xy_max = points[:, :2].max(axis=0)
+    x_ranges = _block_ranges(xy_min[0], xy_max[0], tiles)
+    y_ranges = _block_ranges(xy_min[1], xy_max[1], tiles)
+    margin = (xy_max - xy_min) / tiles * overlap
+
+    cores = []
+    for x_range in x_ranges:
+        for y_range in y_ranges:
+            core_min = np.array([x_range[0], y_range[0]])
+            core_max = np.array([x_range[1], y_range[1]])
+            if np.any(np.all((points[:, :2] >= core_min) & (points[:, :2] < core_max), axis=1)):
+                cores.append((core_min, core_max))
+
+    workers = max(1, min(int(max_workers), len(cores)))
+    logger.info(f"Poisson reconstruction of {len(cores)} blocks (depth {depth}) with {workers} processes")
+    vertices = []
+    triangles = []
+    offset = 0
+    weld_distance = 0.0
+    jobs = [(core_min, core_max, margin, depth, n_threads, target_number_of_triangles) for core_min, core_max in cores]
+    # no open3d call in this process before the fork, so the children start with a clean OpenMP runtime
+    pool = Pool(processes=workers, initializer=_init_block_process, initargs=(points, normals))
+    try:
+        for block_vertices, block_triangles, cell_size in pool.imap(_mesh_cloud_block, jobs):
+            vertices.append(block_vertices)
+            triangles.append(block_triangles + offset)
+            offset += len(block_vertices)
+            weld_distance = max(weld_distance, cell_size)
+        pool.close()
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    # stitch: the seam vertices of neighbour blocks come from different octrees, up to a cell apart
+    seams = ([x_range[0] for x_range in x_ranges[1:]], [y_range[0] for y_range in y_ranges[1:]])
+    vertices, triangles = _weld_seams(np.concatenate(vertices), np.concatenate(triangles), seams, weld_distance)
+    mesh = o3d.geometry.TriangleMesh()
+    mesh.vertices = o3d.utility.Vector3dVector(vertices)
+    mesh.triangles = o3d.utility.Vector3iVector(triangles.astype(np.int32))
+    mesh.remove_duplicated_triangles()
+    mesh.remove_degenerate_triangles()
+    mesh.remove_unreferenced_vertices()
+    mesh.compute_vertex_normals()
+    return mesh
+
 
 def run(params):
     """Poisson-reconstruct a mesh from the denoised dense point cloud (open3d)."""
-    depth = 11
-    remove_vertices_threshold = 0.002
+    depth = int(params.get('poisson_depth', 11))
     input_xyz = params.get('output_xyz')
     output_ply = params.get('output_ply')
 
@@ -18,35 +192,28 @@ def run(params):
         os.remove(output_ply)
 
     logger.info("Start conversion of dense point cloud to mesh")
-    pcd = o3d.geometry.PointCloud()
+    # X,Y,Z,NormalX,NormalY,NormalZ; the only copy of the cloud in memory
+    point_cloud = np.loadtxt(input_xyz, skiprows=1, delimiter=',', usecols=range(6))
 
-    point_cloud = np.loadtxt(input_xyz,skiprows=1,delimiter=',')
+    target_number_of_triangles = _target_number_of_triangles(params)
 
-    pcd.points = o3d.utility.Vector3dVector(point_cloud[:,:3])
-    pcd.normals = o3d.utility.Vector3dVector(point_cloud[:,3:6])
+    if int(params.get('mesh_tiles', 1)) > 1:
+        mesh = _tiled_mesh(point_cloud[:, :3], point_cloud[:, 3:6], params, target_number_of_triangles)
+        logger.info(f"Tiled poisson reconstruction completed, {len(mesh.triangles)} triangles")
+    else:
+        logger.info("Initialize poisson reconstruction")
+        mesh = _poisson(point_cloud[:, :3], point_cloud[:, 3:6], depth, int(params.get('mesh_threads', 1)))
+        logger.info("Poisson reconstruction completed")
 
-    logger.info("Initialize poisson reconstruction")
-    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
-        pcd,
-        depth=depth,
-        n_threads=1,
-        linear_fit=True
-    )
-    vertices_to_remove = densities < np.quantile(densities, remove_vertices_threshold)
-    mesh.remove_vertices_by_mask(vertices_to_remove)
-    logger.info("Poisson reconstruction completed")
-
-    number_of_iterations = 10
-    logger.info(f"Smooth surface with Taubin, number of iterations {number_of_iterations}")
-    mesh = mesh.filter_smooth_taubin(number_of_iterations=number_of_iterations)
-    mesh.compute_vertex_normals()
+        logger.info(f"Smooth surface with Taubin, number of iterations {SMOOTH_ITERATIONS}")
+        mesh = mesh.filter_smooth_taubin(number_of_iterations=SMOOTH_ITERATIONS)
+        mesh.compute_vertex_normals()
 
-    target_number_of_triangles = 2560000 # 2^4 * 2^4 * 10000 -> 4 depth and 10000 faces tiles
-    logger.info(f"Simplify mesh, target number of triangles {target_number_of_triangles}")
-    mesh = mesh.simplify_quadric_decimation(target_number_of_triangles=target_number_of_triangles)
+        logger.info(f"Simplify mesh, target number of triangles {target_number_of_triangles}")
+        mesh = mesh.simplify_quadric_decimation(target_number_of_triangles=target_number_of_triangles)
 
     logger.info("Cropping mesh")
-    bbox = pcd.get_axis_aligned_bounding_box()
+    bbox = o3d.geometry.AxisAlignedBoundingBox(point_cloud[:, :3].min(axis=0), point_cloud[:, :3].max(axis=0))
     cropped_mesh = mesh.crop(bbox)
 
     logger.info("Exporting mesh")
@@ -2,9 +2,13 @@ import logging
 import os
 import subprocess
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from app.worker.tasks.photogrammetry.utils import (
-    get_OpenSfM_bin, run_step, create_config_for_stage
+    get_OpenSfM_bin, run_step, create_config_for_stage, get_cpu_count, remove_if_exists
 )
+from app.worker.tasks.photogrammetry.image_metadata import read_image_size
+from app.worker.tasks.photogrammetry.image_pyramid import select_image_level
 from app.worker.common.utils import run_subprocess
 
 logging.basicConfig(level=logging.INFO)
@@ -15,6 +19,199 @@ def get_tex_recon_bin():
     return ['/mvs-texturing/build/apps/texrecon/texrecon']
 
 
+def _texrecon(nvm_path, mesh_path, output_prefix, num_threads=1):
+    run_subprocess(get_tex_recon_bin() + [
+        nvm_path,
+        mesh_path,
+        output_prefix,
+        '-d', 'gmi',
+        '-o', 'gauss_clamping',
+        '-t', 'none',
+        '--no_intermediate_results',
+        '--keep_unseen_faces',
+        f'--num_threads={num_threads}'
+    ])
+
+
+# chunked texturing: the mesh is split in a grid of XY chunks, each chunk is textured by its
+# own texrecon run with only the views that see it, and the outputs are merged in textured/
+
+def _read_nvm_cameras(nvm_path):
+    """(header lines, camera lines, cameras as (image, focal, rotation world to camera, center))"""
+    with open(nvm_path, 'r') as f:
+        lines = [line.rstrip('\n') for line in f]
+    index = 0
+    header = []
+    while not lines[index].strip().isdigit():
+        header.append(lines[index])
+        index += 1
+    count = int(lines[index].strip())
+    camera_lines = lines[index + 1:index + 1 + count]
+    cameras = []
+    for line in camera_lines:
+        words = line.split()
+        focal = float(words[1])
+        qw, qx, qy, qz = (float(v) for v in words[2:6])
+        rotation = np.array([
+            [1 - 2 * (qy * qy + qz * qz), 2 * (qx * qy - qz * qw), 2 * (qx * qz + qy * qw)],
+            [2 * (qx * qy + qz * qw), 1 - 2 * (qx * qx + qz * qz), 2 * (qy * qz - qx * qw)],
+            [2 * (qx * qz - qy * qw), 2 * (qy * qz + qx * qw), 1 - 2 * (qx * qx + qy * qy)],
+        ])
+        center = np.array([float(v) for v in words[6:9]])
+        cameras.append((words[0], focal, rotation, center))
+    return header, camera_lines, cameras
+
+
+def _sees_box(camera, image_size, box_min, box_max):
+    """Whether the box (8 corners) projects inside the image of a pinhole camera, principal point at the center."""
+    _, focal, rotation, center = camera
+    width, height = image_size
+    corners = np.array([
+        [x, y, z] for x in (box_min[0], box_max[0]) for y in (box_min[1], box_max[1]) for z in (box_min[2], box_max[2])
+    ])
+    camera_points = (corners - center) @ rotation.T
+    in_front = camera_points[:, 2] > 0
+    if not in_front.any():
+        return False
+    if not in_front.all():
+        # the box spans the camera plane: keep the view
+        return True
+    u = focal * camera_points[:, 0] / camera_points[:, 2] + width / 2
+    v = focal * camera_points[:, 1] / camera_points[:, 2] + height / 2
+    return bool(u.max() >= 0 and u.min() <= width and v.max() >= 0 and v.min() <= height)
+
+
+def _split_mesh(mesh_path, chunks_dir, chunks):
+    """Write the triangles of every XY grid chunk (by centroid) to chunks_dir/chunk_<i>.ply; returns [(path, min, max)]."""
+    import open3d as o3d
+    mesh = o3d.io.read_triangle_mesh(mesh_path)
+    vertices = np.asarray(mesh.vertices)
+    triangles = np.asarray(mesh.triangles)
+    normals = np.asarray(mesh.vertex_normals) if mesh.has_vertex_normals() else None
+    colors = np.asarray(mesh.vertex_colors) if mesh.has_vertex_colors() else None
+
+    centroids = vertices[triangles].mean(axis=1)
+    xy_min = centroids[:, :2].min(axis=0)
+    xy_max = centroids[:, :2].max(axis=0)
+    cells = np.floor((centroids[:, :2] - xy_min) / np.maximum(xy_max - xy_min, 1e-9) * chunks).astype(np.int64)
+    cells = np.clip(cells, 0, chunks - 1)
+    cell_ids = cells[:, 0] * chunks + cells[:, 1]
+
+    outputs = []
+    for cell_id in np.unique(cell_ids):
+        chunk_triangles = triangles[cell_ids == cell_id]
+        used = np.unique(chunk_triangles)
+        remap = np.full(len(vertices), -1, dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        chunk = o3d.geometry.TriangleMesh()
+        chunk.vertices = o3d.utility.Vector3dVector(vertices[used])
+        chunk.triangles = o3d.utility.Vector3iVector(remap[chunk_triangles].astype(np.int32))
+        if normals is not None:
+            chunk.vertex_normals = o3d.utility.Vector3dVector(normals[used])
+        if colors is not None:
+            chunk.vertex_colors = o3d.utility.Vector3dVector(colors[used])
+        chunk_path = os.path.join(chunks_dir, f"chunk_{cell_id}.ply")
+        o3d.io.write_triangle_mesh(chunk_path, chunk)
+        outputs.append((chunk_path, vertices[used].min(axis=0), vertices[used].max(axis=0)))
+    return outputs
+
+
+def _merge_obj(chunk_prefixes, output_textured_dir):
+    """Merge the texrecon outputs (<prefix>.obj/.mtl/texture maps) into output_textured_dir/mesh.obj and mesh.mtl."""
+    obj_lines = ['mtllib mesh.mtl']
+    mtl_lines = []
+    offsets = {'v': 0, 'vt': 0, 'vn': 0}
+    for index, prefix in enumerate(chunk_prefixes):
+        if not os.path.exists(f"{prefix}.obj"):
+            logger.warning(f"Missing textured chunk {prefix}.obj")
+            continue
+        chunk_dir = os.path.dirname(prefix)
+        name = f"chunk{index}_"
+        with open(f"{prefix}.mtl", 'r') as f:
+            for line in f:
+                words = line.split()
+                if words and words[0] == 'newmtl':
+                    line = f"newmtl {name}{words[1]}\n"
+                elif words and words[0].startswith('map_'):
+                    texture = words[-1]
+                    shutil.move(os.path.join(chunk_dir, texture), os.path.join(output_textured_dir, f"{name}{texture}"))
+                    line = ' '.join(words[:-1] + [f"{name}{texture}"]) + '\n'
+                mtl_lines.append(line.rstrip('\n'))
+        counts = {'v': 0, 'vt': 0, 'vn': 0}
+        with open(f"{prefix}.obj", 'r') as f:
+            for line in f:
+                words = line.split()
+                if not words or words[0] in ('mtllib', '#'):
+                    continue
+                if words[0] in counts:
+                    counts[words[0]] += 1
+                elif words[0] == 'usemtl':
+                    line = f"usemtl {name}{words[1]}"
+                elif words[0] == 'f':
+                    vertices = []
+                    for vertex in words[1:]:
+                        parts = vertex.split('/')
+                        for part_index, key in enumerate(('v', 'vt', 'vn')):
+                            if part_index < len(parts) and parts[part_index]:
+                                parts[part_index] = str(int(parts[part_index]) + offsets[key])
+                        vertices.append('/'.join(parts))
+                    line = 'f ' + ' '.join(vertices)
+                obj_lines.append(line.rstrip('\n'))
+        for key in offsets:
+            offsets[key] += counts[key]
+
+    with open(os.path.join(output_textured_dir, 'mesh.obj'), 'w') as f:
+        f.write('\n'.join(obj_lines) + '\n')
+    with open(os.path.join(output_textured_dir, 'mesh.mtl'), 'w') as f:
+        f.write('\n'.join(mtl_lines) + '\n')
+
+
+def _texture_chunks(reconstruction_nvm, mesh_path, output_textured_dir, chunks, params):
+    """Texture chunks x chunks parts of the mesh in parallel texrecon runs and merge them in output_textured_dir."""
+    undistorted_dir = os.path.dirname(reconstruction_nvm)
+    chunks_dir = os.path.join(undistorted_dir, 'texture_chunks')
+    if os.path.exists(chunks_dir):
+        shutil.rmtree(chunks_dir)
+    os.makedirs(chunks_dir)
+
+    header, camera_lines, cameras = _read_nvm_cameras(reconstruction_nvm)
+    image_sizes = {}
+    for image, _, _, _ in cameras:
+        image_sizes[image] = read_image_size(os.path.join(undistorted_dir, image))
+
+    jobs = []
+    for chunk_path, box_min, box_max in _split_mesh(mesh_path, chunks_dir, chunks):
+        selected = [
+            line for line, camera in zip(camera_lines, cameras, strict=True)
+            # without a readable size keep the view
+            if image_sizes[camera[0]] is None or _sees_box(camera, image_sizes[camera[0]], box_min, box_max)
+        ]
+        if not selected:
+            selected = camera_lines
+        # next to reconstruction.nvm, so the relative image paths still resolve
+        chunk_name = os.path.splitext(os.path.basename(chunk_path))[0]
+        nvm_path = os.path.join(undistorted_dir, f"texture_{chunk_name}.nvm")
+        with open(nvm_path, 'w') as f:
+            f.write('\n'.join(header + [str(len(selected))] + selected + ['', '0', '']) + '\n')
+        jobs.append((nvm_path, chunk_path, os.path.join(chunks_dir, chunk_name, 'mesh')))
+        logger.info(f"Texture {chunk_name}: {len(selected)} of {len(cameras)} views")
+
+    for _, _, prefix in jobs:
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    texture_threads = int(params.get('texture_threads', 1))
+    max_workers = params.get('texture_workers') or max(1, get_cpu_count() // texture_threads)
+    # texrecon runs are subprocesses: a thread per run is enough to keep them in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_texrecon, nvm_path, chunk_path, prefix, texture_threads) for nvm_path, chunk_path, prefix in jobs]
+        for future in futures:
+            future.result()
+
+    _merge_obj([prefix for _, _, prefix in jobs], output_textured_dir)
+    for nvm_path, _, _ in jobs:
+        remove_if_exists(nvm_path)
+    shutil.rmtree(chunks_dir, ignore_errors=True)
+
+
 def run(params):
     """Texture the mesh (OpenSfM undistort/export + mvs-texturing texrecon)."""
 
@@ -24,7 +221,9 @@ def run(params):
     texture_image_resolution = params.get('texture_image_resolution')
     texture_image_processes = params.get('texture_image_processes', 1)
     cmd = get_OpenSfM_bin()
-    if depthmap_resolution != texture_image_resolution:
+    # split surveys are undistorted per submodel: undistort the merged reconstruction here
+    undistorted = os.path.exists(os.path.join(process_dir, 'undistorted', 'reconstruction.json'))
+    if depthmap_resolution != texture_image_resolution or not undistorted:
         config_yaml = {
             'undistorted_image_max_size': texture_image_resolution,
             'undistorted_image_format': 'jpg',
@@ -35,6 +234,7 @@ def run(params):
         undistorted_images_dir = os.path.join(process_dir, 'undistorted', 'images')
         if os.path.exists(undistorted_images_dir):
             shutil.rmtree(undistorted_images_dir)
+        select_image_level(process_dir, texture_image_resolution)
         run_step('undistort', cmd + ['undistort', process_dir], process_dir, skip_check=True)
 
     visual_sfm_path = os.path.join(process_dir, 'undistorted', 'reconstruction.nvm')
@@ -58,17 +258,11 @@ def run(params):
 
     output_textured_mesh = os.path.join(output_textured_dir, 'mesh')
 
-    run_subprocess(get_tex_recon_bin() + [
-        reconstruction_nvm,
-        output_ply,
-        output_textured_mesh,
-        '-d', 'gmi',
-        '-o', 'gauss_clamping',
-        '-t', 'none',
-        '--no_intermediate_results',
-        '--keep_unseen_faces',
-        '--num_threads=1'
-    ])
+    texture_chunks = int(params.get('texture_chunks', 1))
+    if texture_chunks > 1:
+        _texture_chunks(reconstruction_nvm, output_ply, output_textured_dir, texture_chunks, params)
+    else:
+        _texrecon(reconstruction_nvm, output_ply, output_textured_mesh, params.get('texture_threads', 1))
 
     if os.path.exists(output_textured_dir_zip):
         os.remove(output_textured_dir_zip)
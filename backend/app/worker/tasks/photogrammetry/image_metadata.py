@@ -0,0 +1,169 @@
+"""Image sizes from file headers only (JPEG, PNG, TIFF), without decoding the pixels.
+
+Sizes are reported as cv2.imread would see them, so JPEG/TIFF EXIF orientations 5 to 8
+(rotated by 90 degrees) swap width and height.
+"""
+import logging
+import os
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+# process_dir/<IMAGE_SIZES_CACHE>, keyed by image name
+IMAGE_SIZES_CACHE = 'image_sizes.json'
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG start of frame markers (baseline, progressive, lossless...), not DHT/JPG/DAC
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+_TIFF_IMAGE_WIDTH = 256
+_TIFF_IMAGE_LENGTH = 257
+_TIFF_ORIENTATION = 274
+_TIFF_TYPE_SIZES = {1: 1, 3: 2, 4: 4}
+
+
+def _tiff_tags(data, tags):
+    """Values of the requested integer tags of the first IFD of a TIFF (or EXIF) block."""
+    if data[:2] == b'II':
+        endian = '<'
+    elif data[:2] == b'MM':
+        endian = '>'
+    else:
+        return {}
+    ifd_offset = struct.unpack(endian + 'I', data[4:8])[0]
+    count = struct.unpack(endian + 'H', data[ifd_offset:ifd_offset + 2])[0]
+    values = {}
+    for index in range(count):
+        entry = ifd_offset + 2 + index * 12
+        tag, field_type = struct.unpack(endian + 'HH', data[entry:entry + 4])
+        if tag not in tags or field_type not in _TIFF_TYPE_SIZES:
+            continue
+        value = data[entry + 8:entry + 8 + _TIFF_TYPE_SIZES[field_type]]
+        values[tag] = struct.unpack(endian + {1: 'B', 3: 'H', 4: 'I'}[field_type], value)[0]
+    return values
+
+
+def _oriented(width, height, orientation):
+    if orientation in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def _jpeg_size(f):
+    orientation = None
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        while marker[:1] == b'\xff' and marker[1:2] == b'\xff':
+            # fill bytes
+            marker = marker[1:] + f.read(1)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        if code in (0xD9, 0xDA):
+            # end of image / start of scan before any frame header
+            return None
+        length = struct.unpack('>H', f.read(2))[0]
+        if code == 0xE1 and orientation is None:
+            segment = f.read(length - 2)
+            if segment[:6] == b'Exif\x00\x00':
+                orientation = _tiff_tags(segment[6:], {_TIFF_ORIENTATION}).get(_TIFF_ORIENTATION)
+            continue
+        if code in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>xHH', f.read(5))
+            return _oriented(width, height, orientation)
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _tiff_size(f):
+    # the first IFD is usually right after the header; read enough to cover it
+    data = f.read(65536)
+    ifd_offset = struct.unpack(('<' if data[:2] == b'II' else '>') + 'I', data[4:8])[0]
+    if ifd_offset + 2 > len(data):
+        f.seek(0)
+        data = f.read(ifd_offset + 65536)
+    values = _tiff_tags(data, {_TIFF_IMAGE_WIDTH, _TIFF_IMAGE_LENGTH, _TIFF_ORIENTATION})
+    if _TIFF_IMAGE_WIDTH not in values or _TIFF_IMAGE_LENGTH not in values:
+        return None
+    return _oriented(values[_TIFF_IMAGE_WIDTH], values[_TIFF_IMAGE_LENGTH], values.get(_TIFF_ORIENTATION))
+
+
+def read_image_size(path):
+    """(width, height) read from the image header, None if the format is not recognized."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(24)
+            if head[:2] == b'\xff\xd8':
+                return _jpeg_size(f)
+            if head[:8] == _PNG_SIGNATURE and head[12:16] == b'IHDR':
+                return struct.unpack('>II', head[16:24])
+            if head[:4] in (b'II*\x00', b'MM\x00*'):
+                f.seek(0)
+                return _tiff_size(f)
+    except (OSError, struct.error) as e:
+        logger.warning(f"Error reading image header of {path}: {e}")
+    return None
+
+
+def _probe(path):
+    size = read_image_size(path)
+    if size is None:
+        # unusual encodings (e.g. a TIFF with the IFD at the end of a large file): decode
+        import cv2
+        img = cv2.imread(path)
+        if img is not None:
+            size = (img.shape[1], img.shape[0])
+    return size
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def probe_image_sizes(images_dir, cache_dir=None, max_workers=8):
+    """{image name: [width, height]} of the images in images_dir, read on a thread pool.
+
+    With cache_dir the result is stored in cache_dir/image_sizes.json and reused for the
+    images whose size and modification time did not change.
+    """
+    names = sorted(
+        name for name in os.listdir(images_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    cache = {}
+    cache_path = os.path.join(cache_dir, IMAGE_SIZES_CACHE) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except (ValueError, OSError):
+            cache = {}
+
+    keys = {name: _file_key(os.path.join(images_dir, name)) for name in names}
+    sizes = {}
+    missing = []
+    for name in names:
+        cached = cache.get(name)
+        if cached and cached.get('key') == keys[name]:
+            sizes[name] = cached['size']
+        else:
+            missing.append(name)
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            probed = executor.map(lambda name: _probe(os.path.join(images_dir, name)), missing)
+            for name, size in zip(missing, probed, strict=True):
+                sizes[name] = list(size) if size else None
+        if cache_path:
+            with open(cache_path, 'w') as f:
+                json.dump({name: {'key': keys[name], 'size': sizes[name]} for name in names}, f)
+
+    return sizes
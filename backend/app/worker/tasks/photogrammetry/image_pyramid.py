@@ -0,0 +1,132 @@
+"""Downscaled copies of the survey images, decoded once, for the stages that read smaller images.
+
+images/pyramid/<size>/<image> holds the image with its long side reduced to size (only when the
+original is larger, and only for JPEG images: other formats are read from the originals). Before an OpenSfM step that reads images, select_image_level writes the
+dataset image_list.txt so that OpenSfM reads the smallest copy that still covers the resolution
+the step needs (features, depth maps, texture), or the originals.
+"""
+import logging
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from app.worker.tasks.photogrammetry.image_metadata import IMAGE_EXTENSIONS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PYRAMID_DIR = 'pyramid'
+JPEG_QUALITY = 95
+
+
+def _jpeg_exif_segments(path):
+    """Raw APP1 Exif segments (marker included) of a JPEG file."""
+    segments = []
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return segments
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+                return segments
+            length = struct.unpack('>H', f.read(2))[0]
+            data = f.read(length - 2)
+            if marker[1] == 0xE1 and data[:6] == b'Exif\x00\x00':
+                segments.append(marker + struct.pack('>H', length) + data)
+
+
+def _is_jpeg(name):
+    return name.lower().endswith(('.jpg', '.jpeg'))
+
+
+def _write_level(path, image, exif_segments):
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise OSError(f"Cannot encode {path}")
+    encoded = encoded.tobytes()
+    # keep the EXIF (orientation included): the pixels are stored unrotated, as in the original
+    with open(path, 'wb') as f:
+        f.write(encoded[:2] + b''.join(exif_segments) + encoded[2:])
+
+
+def _build_levels(images_dir, name, sizes):
+    path = os.path.join(images_dir, name)
+    # raw pixel order, like the original file; readers apply the EXIF orientation of the copy
+    image = cv2.imread(path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        logger.warning(f"Cannot read {path}, no pyramid levels")
+        return
+    exif_segments = _jpeg_exif_segments(path)
+    for size in sorted(sizes, reverse=True):
+        height, width = image.shape[:2]
+        if max(height, width) <= size:
+            continue
+        scale = size / max(height, width)
+        # each level is resized from the previous (larger) one
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        _write_level(os.path.join(images_dir, PYRAMID_DIR, str(size), name), image, exif_segments)
+
+
+def _image_names(images_dir):
+    return sorted(
+        name for name in os.listdir(images_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(images_dir, name))
+    )
+
+
+def build_image_pyramid(images_dir, sizes, max_workers=None):
+    """Write the pyramid levels of every image in images_dir, decoding each image once, on a thread pool."""
+    sizes = sorted({int(size) for size in sizes if size})
+    if not sizes:
+        return
+    for size in sizes:
+        os.makedirs(os.path.join(images_dir, PYRAMID_DIR, str(size)), exist_ok=True)
+    # the EXIF orientation is only carried over into JPEG copies: PNG/TIFF images keep the originals
+    names = [name for name in _image_names(images_dir) if _is_jpeg(name)]
+    logger.info(f"Building image pyramid {sizes} for {len(names)} images")
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_build_levels, images_dir, name, sizes) for name in names]
+        for future in futures:
+            future.result()
+
+
+def _survey_dir(dataset_dir):
+    # OpenSfM submodels live in <survey>/submodels/submodel_XXXX and share the survey images
+    parent = os.path.dirname(os.path.normpath(dataset_dir))
+    if os.path.basename(parent) == 'submodels':
+        return os.path.dirname(parent)
+    return dataset_dir
+
+
+def select_image_level(dataset_dir, size=None):
+    """Point the OpenSfM dataset image_list.txt at the smallest pyramid level covering size (None: originals)."""
+    images_dir = os.path.join(_survey_dir(dataset_dir), 'images')
+    image_list_path = os.path.join(dataset_dir, 'image_list.txt')
+    if os.path.exists(image_list_path) and dataset_dir != _survey_dir(dataset_dir):
+        # a submodel only uses its own images
+        with open(image_list_path, 'r') as f:
+            names = [os.path.basename(line.strip()) for line in f if line.strip()]
+    else:
+        names = _image_names(images_dir)
+
+    pyramid_dir = os.path.join(images_dir, PYRAMID_DIR)
+    levels = []
+    if size and os.path.isdir(pyramid_dir):
+        levels = sorted(int(level) for level in os.listdir(pyramid_dir) if level.isdigit() and int(level) >= size)
+
+    paths = []
+    for name in names:
+        path = os.path.join(images_dir, name)
+        for level in levels:
+            level_path = os.path.join(pyramid_dir, str(level), name)
+            if os.path.exists(level_path):
+                path = level_path
+                break
+        paths.append(os.path.abspath(path))
+
+    if os.path.islink(image_list_path):
+        os.remove(image_list_path)
+    with open(image_list_path, 'w') as f:
+        f.write('\n'.join(paths) + '\n')
+    if levels:
+        logger.info(f"Reading images from pyramid levels >= {size}")
@@ -8,19 +8,19 @@ import numpy as np
 from app.worker.tasks.photogrammetry.utils import (
     get_OpenSfM_bin, remove_if_exists, memory_available,
     create_config_for_stage, run_step, calculate_resource_allocation,
-    survey_preset, sfm_config_yaml, SFM_PRESET_AERIAL, SFM_PRESET_HANDHELD
+    list_submodels, survey_preset, sfm_config_yaml, SFM_PRESET_AERIAL, SFM_PRESET_HANDHELD
 )
+from app.worker.tasks.photogrammetry.matching_pairs import gps_matching_limits
+from app.worker.tasks.photogrammetry.image_pyramid import select_image_level
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def run(process_dir, config):
-    start = time.time()
-    logger.info("Start OpenSfM process")
+def _extract_and_match(process_dir, config, extra_config_yaml=None):
+    """extract_metadata, detect_features and match_features on the whole survey; returns (cmd, preset, config_yaml)"""
     force_delete = config.get('force_delete', False)
     auto_resolutions_computation = config.get('auto_resolutions_computation', True)
-    create_statisitcs = config.get('create_statisitcs', False)
 
     if  force_delete:
         logger.info("Starting fresh run - cleaning directory")
@@ -75,6 +75,8 @@ def run(process_dir, config):
 
     cmd = get_OpenSfM_bin()
 
+    # metadata from the original images, features from the pyramid level of feature_process_size
+    select_image_level(process_dir)
     if run_step('extract_metadata', cmd + ['extract_metadata', process_dir], process_dir):
         remove_if_exists(camera_models_overrides)
         remove_if_exists(exif_overrides)
@@ -83,10 +85,36 @@ def run(process_dir, config):
     preset = survey_preset(process_dir, override=aerial)
     is_aerial = preset is SFM_PRESET_AERIAL
     logger.info(f"Survey type: {'aerial (OPK detected)' if is_aerial else 'handheld'}")
-    create_config_for_stage(process_dir, sfm_config_yaml(preset, resources))
-
+    config_yaml = sfm_config_yaml(preset, resources)
+    # aerial surveys with GPS: only match images whose footprints can overlap
+    if is_aerial and config.get('gps_pair_selection', True):
+        gps_limits = gps_matching_limits(process_dir, config)
+        if gps_limits:
+            config_yaml.update(gps_limits)
+    config_yaml.update(extra_config_yaml or {})
+    create_config_for_stage(process_dir, config_yaml)
+
+    select_image_level(process_dir, resources['feature_process_size'])
     run_step('detect_features', cmd + ['detect_features', process_dir], process_dir)
     run_step('match_features', cmd + ['match_features', process_dir], process_dir)
+    return cmd, preset, config_yaml
+
+
+def _write_camera_models(process_dir, reconstruction):
+    cameras_path = os.path.join(process_dir, 'camera_models.json')
+    remove_if_exists(cameras_path)
+
+    cameras = reconstruction[0].get('cameras')
+    with open(cameras_path, 'w') as f:
+        json.dump(cameras, f, indent=4)
+
+
+def run(process_dir, config):
+    start = time.time()
+    logger.info("Start OpenSfM process")
+    create_statisitcs = config.get('create_statisitcs', False)
+
+    cmd, preset, _ = _extract_and_match(process_dir, config)
     run_step('create_tracks', cmd + ['create_tracks', process_dir], process_dir)
     run_step('reconstruct', cmd + ['reconstruct', '--algorithm', preset['reconstruct_algorithm'], process_dir], process_dir)
 
@@ -111,13 +139,84 @@ def run(process_dir, config):
             "detect_features and match_features logs for feature and match counts."
         )
 
-    cameras_path = os.path.join(process_dir, 'camera_models.json')
-    remove_if_exists(cameras_path)
-
-    cameras = reconstruction[0].get('cameras')
-    with open(cameras_path, 'w') as f:
-        json.dump(cameras, f, indent=4)
+    _write_camera_models(process_dir, reconstruction)
 
     end = time.time()
     elapsed_time = end - start
-    logger.info(f"End of sparse reconstruction process in {elapsed_time} seconds")
\ No newline at end of file
+    logger.info(f"End of sparse reconstruction process in {elapsed_time} seconds")
+
+
+# split mode: OpenSfM submodels (create_submodels -> reconstruct each submodel -> align_submodels)
+
+def create_submodels(process_dir, config):
+    """Match the whole survey once, then split it into overlapping submodels; returns their directories."""
+    start = time.time()
+    logger.info("Start OpenSfM process (split in submodels)")
+    cmd, _, _ = _extract_and_match(process_dir, config, {
+        'submodel_size': int(config.get('submodel_size')),
+        'submodel_overlap': float(config.get('submodel_overlap')),
+    })
+    run_step('create_submodels', cmd + ['create_submodels', process_dir], process_dir)
+    submodel_dirs = list_submodels(process_dir)
+    logger.info(f"Created {len(submodel_dirs)} submodels in {time.time() - start} seconds")
+    return submodel_dirs
+
+
+def reconstruct_submodel(process_dir, submodel_dir, config):
+    """Tracks and reconstruction of one submodel, with the config of the whole survey."""
+    start = time.time()
+    preset = survey_preset(process_dir, override=config.get('aerial'))
+    with open(os.path.join(process_dir, 'config.yaml'), 'r') as f:
+        config_yaml = f.read()
+    # create_submodels links the config of the survey: write a real copy
+    remove_if_exists(os.path.join(submodel_dir, 'config.yaml'))
+    with open(os.path.join(submodel_dir, 'config.yaml'), 'w') as f:
+        f.write(config_yaml)
+
+    cmd = get_OpenSfM_bin()
+    run_step('create_tracks', cmd + ['create_tracks', submodel_dir], submodel_dir)
+    run_step('reconstruct', cmd + ['reconstruct', '--algorithm', preset['reconstruct_algorithm'], submodel_dir], submodel_dir)
+    logger.info(f"Reconstructed submodel {submodel_dir} in {time.time() - start} seconds")
+
+
+def align_submodels(process_dir):
+    """Align the submodel reconstructions and merge them into process_dir/reconstruction.json.
+
+    The aligned reconstructions share the survey reference frame; shots seen by more than one
+    submodel keep the pose of the first one, so the later stages see a single reconstruction.
+    """
+    cmd = get_OpenSfM_bin()
+    run_step('align_submodels', cmd + ['align_submodels', process_dir], process_dir)
+
+    merged = {'cameras': {}, 'shots': {}, 'points': {}}
+    reference_lla = None
+    for index, submodel_dir in enumerate(list_submodels(process_dir)):
+        aligned_path = os.path.join(submodel_dir, 'reconstruction.aligned.json')
+        if not os.path.exists(aligned_path):
+            logger.warning(f"Submodel {submodel_dir} has no aligned reconstruction")
+            continue
+        with open(aligned_path, 'r') as f:
+            reconstructions = json.load(f)
+        for reconstruction in reconstructions:
+            if reference_lla is None and reconstruction.get('reference_lla'):
+                reference_lla = reconstruction['reference_lla']
+            for key, camera in reconstruction.get('cameras', {}).items():
+                merged['cameras'].setdefault(key, camera)
+            for key, shot in reconstruction.get('shots', {}).items():
+                merged['shots'].setdefault(key, shot)
+            for key, point in reconstruction.get('points', {}).items():
+                merged['points'][f"{index}_{key}"] = point
+
+    if not merged['shots']:
+        raise RuntimeError("OpenSfM produced no aligned submodel reconstruction.")
+    if reference_lla is not None:
+        merged['reference_lla'] = reference_lla
+
+    reference_lla_path = os.path.join(process_dir, 'reference_lla.json')
+    if reference_lla is not None and not os.path.exists(reference_lla_path):
+        with open(reference_lla_path, 'w') as f:
+            json.dump(reference_lla, f)
+
+    with open(os.path.join(process_dir, 'reconstruction.json'), 'w') as f:
+        json.dump([merged], f)
+    _write_camera_models(process_dir, [merged])
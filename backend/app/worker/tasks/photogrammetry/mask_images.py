@@ -4,12 +4,79 @@ import json
 import cv2
 import numpy as np
 from app.worker.tasks.photogrammetry.geo import transform_extent_to_local
+from app.worker.tasks.photogrammetry.image_metadata import probe_image_sizes
+from app.worker.tasks.photogrammetry.utils import get_cpu_count
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def run(process_dir):
+def _undistorted_image_sizes(process_dir, shots):
+    """(width, height) of the undistorted images, read from the files in undistorted/images.
+
+    The undistorted cameras are only a fallback for images that cannot be read: their size is
+    the nominal camera size, not necessarily the one of the written image.
+    """
+    sizes = {}
+    images_dir = os.path.join(process_dir, 'undistorted', 'images')
+    probed = probe_image_sizes(images_dir) if os.path.isdir(images_dir) else {}
+    for name, size in probed.items():
+        # named after the shot, possibly with the undistorted image format appended
+        key = name if name in shots else os.path.splitext(name)[0]
+        if size and key in shots and (key == name or key not in sizes):
+            sizes[key] = tuple(size)
+
+    undistorted_reconstruction_path = os.path.join(process_dir, 'undistorted', 'reconstruction.json')
+    if any(key not in sizes for key in shots) and os.path.exists(undistorted_reconstruction_path):
+        with open(undistorted_reconstruction_path, 'r') as f:
+            undistorted = json.load(f)
+        for reconstruction in undistorted:
+            cameras = reconstruction.get('cameras', {})
+            for key, shot in reconstruction.get('shots', {}).items():
+                camera = cameras.get(shot.get('camera'), {})
+                if key not in sizes and camera.get('width') and camera.get('height'):
+                    logger.warning(f"Cannot read the undistorted image of {key}, using the camera size")
+                    sizes[key] = (int(camera['width']), int(camera['height']))
+    return sizes
+
+
+def _write_mask(mask_path, points, shot, camera, size):
+    camera_matrix = np.array([
+        [camera.get('focal_x'), 0, camera.get('c_x', 0)],
+        [0, camera.get('focal_y'), camera.get('c_y', 0)],
+        [0, 0, 1]], np.float32)
+    rvec = np.array(shot.get('rotation'), np.float32)
+    tvec = np.array(shot.get('translation'), np.float32)
+    dist_coeffs = np.array([
+        camera.get('k1', 0),
+        camera.get('k2', 0),
+        camera.get('p1', 0),
+        camera.get('p2', 0),
+        camera.get('k3', 0)
+    ], np.float32)
+
+    points_2d, _ = cv2.projectPoints(points,
+        rvec, tvec,
+        camera_matrix,
+        dist_coeffs)
+    hull = cv2.convexHull(points_2d)
+
+    width, height = size
+    resolution = max(height, width)
+    # single channel, written as a 1 bit png: OpenSfM reads masks as grayscale
+    mask_img = np.zeros((height, width), np.uint8)
+    poly = []
+    for point in hull:
+        poly.append([
+            point[0][0] * resolution + width / 2,
+            point[0][1] * resolution + height / 2
+        ])
+    cv2.fillPoly(mask_img, np.array([poly], dtype=np.int32), 255)
+    cv2.imwrite(mask_path, mask_img, [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 9])
+
+
+def run(process_dir, max_workers=None):
 
     if not os.path.exists(os.path.join(process_dir, 'masks')):
         # masking is extent-based; nothing to mask without a geo reference
@@ -60,43 +127,17 @@ def run(process_dir):
                     [local_extent[2], local_extent[1], zmax]
                 ], np.float32)
                 logger.info("Creating masks based on extent volume")
-                for key in shots:
-
-                    shot = shots.get(key)
-                    camera = cameras.get(shot.get('camera'))
-
-                    camera_matrix = np.array([
-                        [camera.get('focal_x'), 0, camera.get('c_x', 0)],
-                        [0, camera.get('focal_y'), camera.get('c_y', 0)],
-                        [0, 0, 1]], np.float32)
-                    rvec = np.array(shot.get('rotation'), np.float32)
-                    tvec = np.array(shot.get('translation'), np.float32)
-                    dist_coeffs = np.array([
-                        camera.get('k1', 0),
-                        camera.get('k2', 0),
-                        camera.get('p1', 0),
-                        camera.get('p2', 0),
-                        camera.get('k3', 0)
-                    ], np.float32)
-
-                    points_2d, _ = cv2.projectPoints(points,
-                        rvec, tvec,
-                        camera_matrix,
-                        dist_coeffs)
-                    hull = cv2.convexHull(points_2d)
-
-                    img = cv2.imread(os.path.join(process_dir, 'undistorted', 'images', key))
-                    height, width = img.shape[:2]
-                    resolution = max(height, width)
-                    mask_img = np.zeros((height, width, 3), np.uint8)
-                    poly = []
-                    for point in hull:
-                        poly.append([
-                            point[0][0] * resolution + width / 2,
-                            point[0][1] * resolution + height / 2
-                        ])
-                    cv2.fillPoly(mask_img, np.array([poly], dtype=np.int32), (255, 255, 255))
-                    cv2.imwrite(os.path.join(masks_dir, f"{key}.png"), mask_img)
+                image_sizes = _undistorted_image_sizes(process_dir, shots)
+                with ThreadPoolExecutor(max_workers=max_workers or get_cpu_count()) as executor:
+                    futures = [
+                        executor.submit(
+                            _write_mask, os.path.join(masks_dir, f"{key}.png"), points,
+                            shots.get(key), cameras.get(shots.get(key).get('camera')), image_sizes[key]
+                        )
+                        for key in shots
+                    ]
+                    for future in futures:
+                        future.result()
         else:
             logger.info("Extent volume not available skipping masks creation")
     else:
@@ -0,0 +1,142 @@
+"""GPS based pair preselection for feature matching.
+
+OpenSfM only matches the images closer than matching_gps_distance, up to matching_gps_neighbors
+per image, when those are set. Both are zero in the presets: the aerial preset then matches the
+pairs of matching_graph_rounds (a triangulation graph of the image positions), and matching is
+exhaustive only when every pair selection limit is zero. The candidates of all the limits are
+merged, so the GPS limits are derived here from the image positions extracted by
+extract_metadata and replace the graph rounds instead of adding to them.
+"""
+import logging
+import os
+import json
+import numpy as np
+from app.worker.tasks.photogrammetry.geo import topocentric_from_lla
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MIN_GPS_NEIGHBORS = 8
+MAX_GPS_NEIGHBORS = 50
+
+
+def gps_positions(process_dir):
+    """{image: (exif, [x, y, z])} topocentric positions (meters) of the images with GPS."""
+    exif_dir = os.path.join(process_dir, 'exif')
+    if not os.path.isdir(exif_dir):
+        return {}
+    exifs = {}
+    for name in sorted(os.listdir(exif_dir)):
+        if not name.endswith('.exif'):
+            continue
+        try:
+            with open(os.path.join(exif_dir, name)) as f:
+                exif = json.load(f)
+        except (ValueError, OSError):
+            continue
+        gps = exif.get('gps') if isinstance(exif, dict) else None
+        if gps and 'latitude' in gps and 'longitude' in gps:
+            exifs[name[:-len('.exif')]] = exif
+    if not exifs:
+        return {}
+
+    lla = np.array([
+        [exif['gps']['latitude'], exif['gps']['longitude'], exif['gps'].get('altitude', 0) or 0]
+        for exif in exifs.values()
+    ], dtype=np.float64)
+    reference = lla.mean(axis=0)
+    x, y, z = topocentric_from_lla(lla[:, 0], lla[:, 1], lla[:, 2], *reference)
+    return {
+        name: (exif, [x[index], y[index], z[index]])
+        for index, (name, exif) in enumerate(exifs.items())
+    }
+
+
+def _neighbour_pairs(positions, radius):
+    """(i, j) pairs, i < j, of the XY positions closer than radius (grid bucketed, no N^2 scan)."""
+    cells = np.floor(positions / radius).astype(np.int64)
+    buckets = {}
+    for index, cell in enumerate(map(tuple, cells)):
+        buckets.setdefault(cell, []).append(index)
+    pairs = []
+    for (cx, cy), indices in buckets.items():
+        indices = np.array(indices)
+        candidates = np.concatenate([
+            buckets.get((cx + dx, cy + dy), [])
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+        ]).astype(np.int64)
+        distances = np.linalg.norm(positions[indices][:, None, :] - positions[candidates][None, :, :], axis=2)
+        i, j = np.nonzero(distances < radius)
+        i, j = indices[i], candidates[j]
+        keep = i < j
+        pairs.append(np.stack([i[keep], j[keep]], axis=1))
+    return np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+
+
+def _nearest_spacing(positions):
+    """Median distance between an image and its nearest neighbour."""
+    extent = np.ptp(positions, axis=0).max()
+    radius = max(extent / np.sqrt(len(positions)), 1e-3)
+    # grow the search radius until most images found a neighbour
+    for _ in range(20):
+        pairs = _neighbour_pairs(positions, radius)
+        nearest = np.full(len(positions), np.inf)
+        if len(pairs):
+            distances = np.linalg.norm(positions[pairs[:, 0]] - positions[pairs[:, 1]], axis=1)
+            np.minimum.at(nearest, pairs[:, 0], distances)
+            np.minimum.at(nearest, pairs[:, 1], distances)
+        if np.isfinite(nearest).mean() > 0.9:
+            return float(np.median(nearest[np.isfinite(nearest)]))
+        radius *= 2
+    return None
+
+
+def _footprint(exifs, config):
+    """Ground footprint (meters, long side of the image) of an average image."""
+    flight_height = config.get('flight_height')
+    focal_ratios = [exif.get('focal_ratio') for exif in exifs if exif.get('focal_ratio')]
+    if flight_height and focal_ratios:
+        # focal_ratio is the focal length over the long side of the sensor
+        return float(flight_height) / float(np.median(focal_ratios))
+    return None
+
+
+def gps_matching_limits(process_dir, config):
+    """matching_gps_distance / matching_gps_neighbors (graph rounds off) for this survey, None without enough GPS.
+
+    Two images can overlap when their centres are closer than one footprint. The footprint comes
+    from the flight height (config flight_height, meters above ground) and the focal ratio, or
+    else from the spacing between neighbour images and the expected overlap (config
+    image_overlap, 0.75 by default).
+    """
+    images = gps_positions(process_dir)
+    image_count = len([name for name in os.listdir(os.path.join(process_dir, 'exif')) if name.endswith('.exif')]) if images else 0
+    if len(images) < 2 * MIN_GPS_NEIGHBORS or len(images) < 0.9 * image_count:
+        logger.info(f"GPS pair preselection skipped: {len(images)} of {image_count} images with GPS")
+        return None
+
+    exifs = [exif for exif, _ in images.values()]
+    positions = np.array([position for _, position in images.values()], dtype=np.float64)
+
+    footprint = _footprint(exifs, config)
+    if footprint is None:
+        spacing = _nearest_spacing(positions[:, :2])
+        if not spacing:
+            return None
+        overlap = min(max(float(config.get('image_overlap', 0.75)), 0.0), 0.95)
+        footprint = spacing / (1 - overlap)
+
+    pairs = _neighbour_pairs(positions[:, :2], footprint)
+    counts = np.bincount(pairs.ravel(), minlength=len(positions))
+    neighbors = int(np.clip(np.ceil(np.percentile(counts, 95)), MIN_GPS_NEIGHBORS, MAX_GPS_NEIGHBORS))
+
+    logger.info(
+        f"GPS pair preselection: footprint {footprint:.1f}m, {len(pairs)} candidate pairs "
+        f"(exhaustive {len(positions) * (len(positions) - 1) // 2}), up to {neighbors} neighbours per image"
+    )
+    return {
+        'matching_gps_distance': round(footprint, 3),
+        'matching_gps_neighbors': neighbors,
+        # graph pairs are added to the GPS ones, not intersected with them
+        'matching_graph_rounds': 0,
+    }
@@ -0,0 +1,167 @@
+"""Streaming PLY point cloud crop and merge (numpy only).
+
+Vertices are read in blocks, from a memmap for binary files or chunk by chunk for ASCII files,
+filtered with a vectorized mask and written as binary little endian PLY, so clouds larger
+than the memory can be cropped or merged.
+"""
+import logging
+import os
+import itertools
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+# room for any vertex count, so the header can be rewritten in place once the count is known
+_COUNT_WIDTH = 20
+
+
+def read_ply_header(f):
+    """(format, vertex count, vertex property names and types, header size in bytes) of an open PLY file."""
+    if f.readline().strip() != b'ply':
+        raise ValueError('Not a PLY file')
+    ply_format = None
+    vertex_count = None
+    properties = []
+    element = None
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError('PLY header without end_header')
+        words = line.decode('ascii').split()
+        if not words:
+            continue
+        if words[0] == 'format':
+            ply_format = words[1]
+        elif words[0] == 'element':
+            element = words[1]
+            if element == 'vertex':
+                if properties or vertex_count is not None:
+                    raise ValueError('Duplicated vertex element')
+                vertex_count = int(words[2])
+            elif vertex_count is None:
+                raise ValueError('PLY files with elements before the vertices are not supported')
+        elif words[0] == 'property' and element == 'vertex':
+            if words[1] == 'list':
+                raise ValueError('List properties are not supported on vertices')
+            properties.append((words[2], _PLY_TYPES[words[1]]))
+        elif words[0] == 'end_header':
+            return ply_format, vertex_count, properties, f.tell()
+
+
+def _vertex_dtype(properties, endian='<'):
+    return np.dtype([(name, endian + ply_type) for name, ply_type in properties])
+
+
+def _binary_blocks(path, ply_format, vertex_count, properties, header_size, block_size):
+    endian = '<' if ply_format == 'binary_little_endian' else '>'
+    vertices = np.memmap(path, dtype=_vertex_dtype(properties, endian), mode='r', offset=header_size, shape=(vertex_count,))
+    for start in range(0, vertex_count, block_size):
+        yield vertices[start:start + block_size]
+
+
+def _ascii_blocks(f, vertex_count, properties, block_size):
+    dtype = _vertex_dtype(properties)
+    remaining = vertex_count
+    while remaining > 0:
+        lines = [line.decode('ascii') for line in itertools.islice(f, min(block_size, remaining))]
+        if not lines:
+            break
+        remaining -= len(lines)
+        values = np.loadtxt(lines, dtype=np.float64, ndmin=2)
+        block = np.empty(len(values), dtype=dtype)
+        for index, (name, _) in enumerate(properties):
+            block[name] = values[:, index]
+        yield block
+
+
+def _write_header(f, vertex_count, properties):
+    lines = ['ply', 'format binary_little_endian 1.0', f"element vertex {vertex_count:<{_COUNT_WIDTH}}"]
+    lines += [f"property {_ply_type_name(ply_type)} {name}" for name, ply_type in properties]
+    lines.append('end_header')
+    f.write(('\n'.join(lines) + '\n').encode('ascii'))
+
+
+def _ply_type_name(ply_type):
+    return {'i1': 'char', 'u1': 'uchar', 'i2': 'short', 'u2': 'ushort', 'i4': 'int', 'u4': 'uint', 'f4': 'float', 'f8': 'double'}[ply_type]
+
+
+def _write_vertices(input_paths, output_path, keep=None, block_size=1000000):
+    """Stream the vertices of input_paths, filtered by keep(input index, block) -> mask, into output_path.
+
+    Returns (vertices written, vertices read).
+    """
+    temporary_path = f"{output_path}.crop.tmp"
+    properties = None
+    kept = 0
+    total = 0
+    try:
+        with open(temporary_path, 'wb') as target:
+            for index, input_path in enumerate(input_paths):
+                with open(input_path, 'rb') as source:
+                    ply_format, vertex_count, input_properties, header_size = read_ply_header(source)
+                    if properties is None:
+                        properties = input_properties
+                        output_dtype = _vertex_dtype(properties)
+                        _write_header(target, 0, properties)
+                    elif input_properties != properties:
+                        raise ValueError(f"{input_path} has other vertex properties than {input_paths[0]}")
+                    if ply_format == 'ascii':
+                        blocks = _ascii_blocks(source, vertex_count, properties, block_size)
+                    else:
+                        blocks = _binary_blocks(input_path, ply_format, vertex_count, properties, header_size, block_size)
+                    for block in blocks:
+                        if keep is not None:
+                            block = block[keep(index, block)]
+                        block = block.astype(output_dtype, copy=False)
+                        target.write(block.tobytes())
+                        kept += len(block)
+                    total += vertex_count
+            target.seek(0)
+            _write_header(target, kept, properties)
+        os.replace(temporary_path, output_path)
+    finally:
+        # an interrupted write must not leave a partial copy next to the cloud
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return kept, total
+
+
+def crop_ply(input_path, output_path, min_bound, max_bound, block_size=1000000):
+    """Write the vertices of input_path inside [min_bound, max_bound] (x, y, z, bounds included) to output_path.
+
+    The output is binary little endian with the input vertex properties; input_path and
+    output_path may be the same file. Returns the number of vertices written.
+    """
+    min_bound = np.asarray(min_bound, dtype=np.float64)
+    max_bound = np.asarray(max_bound, dtype=np.float64)
+
+    def inside(_index, block):
+        mask = np.ones(len(block), dtype=bool)
+        for axis, name in enumerate(('x', 'y', 'z')):
+            mask &= (block[name] >= min_bound[axis]) & (block[name] <= max_bound[axis])
+        return mask
+
+    kept, vertex_count = _write_vertices([input_path], output_path, inside, block_size)
+    logger.info(f"Cropped point cloud: {kept} of {vertex_count} points kept")
+    return kept
+
+
+def merge_ply(input_paths, output_path, keep=None, block_size=1000000):
+    """Concatenate the vertices of input_paths (same vertex properties) into output_path, block by block.
+
+    keep(input index, block) optionally returns the mask of the block vertices to write. The
+    output is binary little endian. Returns the number of vertices written.
+    """
+    if not input_paths:
+        raise ValueError('No PLY file to merge')
+    kept, vertex_count = _write_vertices(list(input_paths), output_path, keep, block_size)
+    logger.info(f"Merged point clouds: {kept} of {vertex_count} points kept")
+    return kept
@@ -2,10 +2,13 @@ import logging
 import os
 import json
 import time
+import shutil
+from functools import partial
 import numpy as np
-import open3d as o3d
 import app.worker.tasks.photogrammetry.mask_images as mask_images
 from app.worker.tasks.photogrammetry.geo import transform_extent_to_local
+from app.worker.tasks.photogrammetry.ply import crop_ply, merge_ply
+from app.worker.tasks.photogrammetry.image_pyramid import select_image_level
 from app.worker.tasks.photogrammetry.utils import (
     get_OpenSfM_bin, run_step, create_config_for_stage,
     calculate_depthmap_resources, survey_preset
@@ -15,14 +18,12 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def crop_dense_point_cloud(params):
-    """Crop a dense point cloud using geographic bounds"""
-    process_dir = params.get('process_dir')
-
+def _crop_bbox(process_dir):
+    """Local XY crop box of the survey extent, None when it is not available."""
     reference_lla_path = os.path.join(process_dir, 'reference_lla.json')
     if not os.path.exists(reference_lla_path):
         logger.info("Skip point cloud cropping (no reference_lla.json)")
-        return
+        return None
     with open(reference_lla_path, 'r') as f:
         reference_lla = json.load(f)
 
@@ -33,24 +34,34 @@ def crop_dense_point_cloud(params):
             config = json.load(f)
     if not config:
         logger.info("Skip point cloud cropping (no config.json)")
-        return
+        return None
     extent = config.get('extent')
     projection = config.get('projection')
     bbox = transform_extent_to_local(reference_lla, extent, projection)
+    if not bbox:
+        logger.info("Skip point cloud cropping")
+    return bbox
+
+
+def crop_dense_point_cloud(params):
+    """Crop a dense point cloud using geographic bounds.
 
+    The cloud is rewritten as binary PLY in any case, so the next readers don't parse text.
+    """
+    process_dir = params.get('process_dir')
+    dense_ply = os.path.join(process_dir, 'undistorted', 'depthmaps', 'merged.ply')
+    bbox = _crop_bbox(process_dir)
     if bbox:
         logger.info("Cropping dense point cloud")
-        dense_ply = os.path.join(process_dir, 'undistorted', 'depthmaps', 'merged.ply')
-        pcd = o3d.io.read_point_cloud(dense_ply)
         min_bound = np.array([bbox[0], bbox[1], float('-inf')])
         max_bound = np.array([bbox[2], bbox[3], float('inf')])
-        bbox = o3d.geometry.AxisAlignedBoundingBox(min_bound=min_bound, max_bound=max_bound)
-        cropped_pcd = pcd.crop(bbox)
-        o3d.io.write_point_cloud(dense_ply, cropped_pcd, write_ascii=True, compressed=False, print_progress=True)
     else:
-        logger.info("Skip point cloud cropping")
+        min_bound = np.full(3, float('-inf'))
+        max_bound = np.full(3, float('inf'))
+    # streamed in blocks
+    crop_ply(dense_ply, dense_ply, min_bound, max_bound)
 
-def run(process_dir, config):
+def run(process_dir, config, crop=True):
     start = time.time()
     logger.info("Start dense point cloud reconstruction process")
 
@@ -85,13 +96,115 @@ def run(process_dir, config):
     
     cmd = get_OpenSfM_bin()
 
+    select_image_level(process_dir, depthmap_resolution)
     run_step('undistort', cmd + ['undistort', process_dir], process_dir)
     mask_images.run(process_dir)
     run_step('compute_depthmaps', cmd + ['compute_depthmaps', process_dir], process_dir)
     
-    crop_dense_point_cloud({'process_dir': process_dir})
+    if crop:
+        crop_dense_point_cloud({'process_dir': process_dir})
     
     end = time.time()
     elapsed_time = end - start
     logger.info(f"End of dense point cloud reconstruction process in {elapsed_time} seconds")
-    return True
\ No newline at end of file
+    return True
+
+
+def submodel_to_dense(submodel_dir, config):
+    """Dense point cloud of one submodel, from its aligned (survey frame) reconstruction."""
+    aligned_path = os.path.join(submodel_dir, 'reconstruction.aligned.json')
+    if not os.path.exists(aligned_path):
+        logger.warning(f"Skip submodel {submodel_dir} (no aligned reconstruction)")
+        return False
+    shutil.copyfile(aligned_path, os.path.join(submodel_dir, 'reconstruction.json'))
+    # cropped once, after the merge
+    return run(submodel_dir, config, crop=False)
+
+
+def _camera_centers(shots):
+    """Optical centres (-R^T t, R from the axis-angle rotation) of OpenSfM shots."""
+    centers = []
+    for shot in shots:
+        rotation = np.asarray(shot['rotation'], dtype=np.float64)
+        angle = np.linalg.norm(rotation)
+        matrix = np.eye(3)
+        if angle > 0:
+            axis = rotation / angle
+            cross = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+            matrix = matrix + np.sin(angle) * cross + (1 - np.cos(angle)) * cross @ cross
+        centers.append(-matrix.T @ np.asarray(shot['translation'], dtype=np.float64))
+    return np.array(centers).reshape(-1, 3)
+
+
+def _submodel_centroids(process_dir, submodel_dirs):
+    """XY centre (survey frame) of the cameras each submodel owns, without the overlap images.
+
+    The owned images are the OpenSfM clusters of create_submodels (submodels/clusters.npz: the
+    cluster label of every image, submodel_<label> being built from that cluster); without them
+    every image of the aligned submodel is used.
+    """
+    with open(os.path.join(process_dir, 'reconstruction.json'), 'r') as f:
+        shots = json.load(f)[0]['shots']
+    cluster_images = cluster_labels = None
+    clusters_path = os.path.join(process_dir, 'submodels', 'clusters.npz')
+    if os.path.exists(clusters_path):
+        with np.load(clusters_path, allow_pickle=True) as clusters:
+            cluster_images = clusters['images']
+            cluster_labels = clusters['labels']
+
+    centroids = []
+    for submodel_dir in submodel_dirs:
+        index = int(os.path.basename(os.path.normpath(submodel_dir)).split('_')[-1])
+        images = []
+        if cluster_labels is not None:
+            images = [str(image) for image in cluster_images[cluster_labels == index]]
+        if not images:
+            with open(os.path.join(submodel_dir, 'reconstruction.aligned.json'), 'r') as f:
+                images = [image for reconstruction in json.load(f) for image in reconstruction.get('shots', {})]
+        centers = _camera_centers([shots[image] for image in images if image in shots])
+        if len(centers) == 0:
+            raise RuntimeError(f"No aligned camera for submodel {submodel_dir}")
+        centroids.append(centers[:, :2].mean(axis=0))
+    return np.array(centroids)
+
+
+def _owned_points(centroids, index, block):
+    """Mask of the block points whose nearest (XY) submodel centroid is centroids[index]."""
+    x = block['x'].astype(np.float64)
+    y = block['y'].astype(np.float64)
+    own = (x - centroids[index, 0]) ** 2 + (y - centroids[index, 1]) ** 2
+    mask = np.ones(len(block), dtype=bool)
+    for other, centroid in enumerate(centroids):
+        if other != index:
+            # ties go to the lower index, so a point is never kept twice
+            distance = (x - centroid[0]) ** 2 + (y - centroid[1]) ** 2
+            mask &= (own < distance) | ((own == distance) & (index < other))
+    return mask
+
+
+def merge_dense_point_clouds(process_dir, submodel_dirs):
+    """Merge the submodel dense clouds into process_dir/undistorted/depthmaps/merged.ply and crop it.
+
+    Submodels overlap, so the same surface is reconstructed more than once: every point is kept
+    only by the submodel whose camera centroid is the nearest (XY), which splits the survey as
+    the submodel clustering did. The clouds are streamed block by block, never loaded whole.
+    """
+    depthmaps_dir = os.path.join(process_dir, 'undistorted', 'depthmaps')
+    os.makedirs(depthmaps_dir, exist_ok=True)
+    dense_plys = []
+    dense_submodel_dirs = []
+    for submodel_dir in submodel_dirs:
+        dense_ply = os.path.join(submodel_dir, 'undistorted', 'depthmaps', 'merged.ply')
+        if os.path.exists(dense_ply):
+            dense_plys.append(dense_ply)
+            dense_submodel_dirs.append(submodel_dir)
+    if not dense_plys:
+        raise RuntimeError("No submodel produced a dense point cloud.")
+
+    # a submodel without a cloud leaves its area to the neighbours that overlap it
+    centroids = _submodel_centroids(process_dir, dense_submodel_dirs)
+
+    dense_ply = os.path.join(depthmaps_dir, 'merged.ply')
+    points = merge_ply(dense_plys, dense_ply, partial(_owned_points, centroids))
+    logger.info(f"Merged {points} points from {len(dense_plys)} submodels")
+    crop_dense_point_cloud({'process_dir': process_dir})
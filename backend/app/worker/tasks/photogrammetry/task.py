@@ -4,6 +4,7 @@ import errno
 import shutil
 import zipfile
 
+from celery import chord, group
 from celery.exceptions import Reject
 from app.worker.main import celery, AssetDatabaseTask
 from app.worker.common.utils import get_asset_upload_path, setup_output_directory
@@ -11,8 +12,9 @@ import app.worker.tasks.photogrammetry.images_to_sparse_reconstruction as images
 import app.worker.tasks.photogrammetry.sparse_reconstruction_to_dense_point_cloud as sparse_reconstruction_to_dense_point_cloud
 import app.worker.tasks.photogrammetry.create_mesh as create_mesh
 import app.worker.tasks.photogrammetry.create_texture as create_texture
-from app.worker.tasks.photogrammetry.utils import build_params
+from app.worker.tasks.photogrammetry.utils import build_params, list_submodels
 from app.worker.tasks.photogrammetry.geo import transform_extent_to_local
+from app.worker.tasks.photogrammetry.image_pyramid import build_image_pyramid
 # Tiling (bpy) and denoise (pdal) run on their own workers; chained in pipelines/photogrammetry.py.
 
 
@@ -27,6 +29,27 @@ DEFAULT_CONFIG = {
     "depthmap_processes": 1,
     'texture_image_resolution': 4096,
     'texture_image_processes': 1,
+    # images/pyramid/<size>: images downscaled once to the feature, depth map and texture resolutions
+    'image_pyramid': True,
+    # texture: texture_chunks > 1 textures texture_chunks x texture_chunks parts of the mesh in parallel
+    'texture_chunks': 1,
+    'texture_threads': 1,
+    'texture_workers': None,
+    # mesh: mesh_tiles > 1 meshes mesh_tiles x mesh_tiles overlapping blocks in parallel processes
+    'poisson_depth': 11,
+    'mesh_tiles': 1,
+    'mesh_tiles_overlap': 0.1,
+    'mesh_threads': 1,
+    'mesh_workers': None,
+    # aerial surveys: limit matching to GPS neighbours whose footprints overlap;
+    # footprint from flight_height (meters above ground) or from image spacing and image_overlap
+    'gps_pair_selection': True,
+    'flight_height': None,
+    'image_overlap': 0.75,
+    # split large surveys in OpenSfM submodels processed in parallel (needs GPS)
+    'split': False,
+    'submodel_size': 80,
+    'submodel_overlap': 30,
 }
 
 
@@ -60,6 +83,13 @@ def _prepare_process_dir(pipeline_extended):
             zip_ref.extractall(images_dir)
         with open(os.path.join(images_dir, "asset_info.txt"), "w") as f:
             f.write(f"{asset.get('filename')}")
+        if config.get('image_pyramid'):
+            # decode once: downscaled copies at the resolutions the stages will read
+            build_image_pyramid(images_dir, [
+                config.get('feature_process_size'),
+                config.get('depthmap_resolution'),
+                config.get('texture_image_resolution'),
+            ], config.get('read_processes'))
 
     return process_dir, config
 
@@ -99,6 +129,57 @@ def photogrammetry_sparse_to_dense(self, payload):
     return _run_stage(self, payload, sparse_reconstruction_to_dense_point_cloud.run)
 
 
+# Split mode: the survey is split in OpenSfM submodels, reconstructed and densified as
+# chords on the photogrammetry queue; each head task replaces itself with its chord so the
+# rest of the pipeline chain continues from the merge step.
+@celery.task(name="photogrammetry_split_images_to_sparse", bind=True, acks_late=True, max_retries=1)
+def photogrammetry_split_images_to_sparse(self, payload):
+    submodel_dirs = []
+
+    def run(process_dir, config):
+        submodel_dirs.extend(images_to_sparse_reconstruction.create_submodels(process_dir, config))
+    ctx = _run_stage(self, payload, run)
+    if not submodel_dirs:
+        raise RuntimeError("OpenSfM created no submodels (create_submodels needs GPS positions).")
+    raise self.replace(chord(
+        group(celery.signature('photogrammetry_reconstruct_submodel', args=(ctx, submodel_dir)) for submodel_dir in submodel_dirs),
+        celery.signature('photogrammetry_align_submodels')
+    ))
+
+
+@celery.task(name="photogrammetry_reconstruct_submodel", bind=True, acks_late=True, max_retries=1)
+def photogrammetry_reconstruct_submodel(self, payload, submodel_dir):
+    return _run_stage(self, payload, lambda process_dir, config: images_to_sparse_reconstruction.reconstruct_submodel(process_dir, submodel_dir, config))
+
+
+@celery.task(name="photogrammetry_align_submodels", bind=True, acks_late=True, max_retries=1)
+def photogrammetry_align_submodels(self, results):
+    # chord callback: every header task forwards the same context
+    return _run_stage(self, results[0], lambda process_dir, config: images_to_sparse_reconstruction.align_submodels(process_dir))
+
+
+@celery.task(name="photogrammetry_split_sparse_to_dense", bind=True, acks_late=True, max_retries=1)
+def photogrammetry_split_sparse_to_dense(self, payload):
+    ctx = _ensure_context(payload)
+    submodel_dirs = list_submodels(ctx['process_dir'])
+    if not submodel_dirs:
+        raise RuntimeError("No submodels found, run the split sparse reconstruction first.")
+    raise self.replace(chord(
+        group(celery.signature('photogrammetry_submodel_to_dense', args=(ctx, submodel_dir)) for submodel_dir in submodel_dirs),
+        celery.signature('photogrammetry_merge_dense')
+    ))
+
+
+@celery.task(name="photogrammetry_submodel_to_dense", bind=True, acks_late=True, max_retries=1)
+def photogrammetry_submodel_to_dense(self, payload, submodel_dir):
+    return _run_stage(self, payload, lambda process_dir, config: sparse_reconstruction_to_dense_point_cloud.submodel_to_dense(submodel_dir, config))
+
+
+@celery.task(name="photogrammetry_merge_dense", bind=True, acks_late=True, max_retries=1)
+def photogrammetry_merge_dense(self, results):
+    return _run_stage(self, results[0], lambda process_dir, config: sparse_reconstruction_to_dense_point_cloud.merge_dense_point_clouds(process_dir, list_submodels(process_dir)))
+
+
 @celery.task(name="photogrammetry_create_mesh", bind=True, acks_late=True, max_retries=1)
 def photogrammetry_create_mesh(self, payload):
     def run(process_dir, config):
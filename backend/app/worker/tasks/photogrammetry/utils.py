@@ -4,8 +4,8 @@ import os
 import sys
 import json
 import psutil
-import cv2
 from app.worker.common.utils import run_subprocess
+from app.worker.tasks.photogrammetry.image_metadata import probe_image_sizes
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -112,6 +112,16 @@ def build_params(process_dir, config):
         'output_textured_dir_zip': os.path.join(process_dir, 'textured.zip'),
     }
 
+def list_submodels(process_dir):
+    """Submodel directories created by OpenSfM create_submodels (submodels/submodel_XXXX)."""
+    submodels_dir = os.path.join(process_dir, 'submodels')
+    if not os.path.isdir(submodels_dir):
+        return []
+    return [
+        os.path.join(submodels_dir, name) for name in sorted(os.listdir(submodels_dir))
+        if name.startswith('submodel_') and os.path.isdir(os.path.join(submodels_dir, name))
+    ]
+
 def remove_if_exists(path):
     """Remove file if it exists"""
     if os.path.exists(path):
@@ -155,17 +165,16 @@ def get_cpu_count() -> int:
     return psutil.cpu_count(logical=False) or 1
 
 def get_max_image_resolution(images_dir: str):
-    """Get the maximum resolution of images in the directory"""
+    """Get the maximum resolution of images in the directory (read from the image headers)"""
     max_width, max_height = 0, 0
     try:
-        for filename in os.listdir(images_dir):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.tif', '.tiff')):
-                img_path = os.path.join(images_dir, filename)
-                img = cv2.imread(img_path)
-                if img is not None:
-                    height, width = img.shape[:2]
-                    max_width = max(max_width, width)
-                    max_height = max(max_height, height)
+        # cached next to the images dir, in the process dir
+        sizes = probe_image_sizes(images_dir, cache_dir=os.path.dirname(os.path.normpath(images_dir)))
+        for size in sizes.values():
+            if size:
+                width, height = size
+                max_width = max(max_width, width)
+                max_height = max(max_height, height)
     except Exception as e:
         logger.warning(f"Error reading image dimensions: {e}")
         return (1920, 1080)
@@ -0,0 +1,113 @@
+import os
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from app.worker.common.utils import get_asset_upload_path
+from app.worker.tasks.pointcloud.crs import resolve_epsg_codes_from_pdal_metadata
+from app.worker.tasks.pointcloud.pdal.processes import pdal_metadata, pdal_stats
+
+COLLECTION_EXTENSION = '.las.zip'
+COLLECTION_FILE_EXTENSIONS = ('.las', '.laz')
+
+
+def is_point_cloud_collection(asset):
+    return asset.get('extension') == COLLECTION_EXTENSION
+
+
+def get_collection_dir(asset_id):
+    return get_asset_upload_path(f"{asset_id}/files")
+
+
+def get_collection_files(asset_id):
+    collection_dir = get_collection_dir(asset_id)
+    return sorted(
+        os.path.join(collection_dir, filename) for filename in os.listdir(collection_dir)
+        if filename.lower().endswith(COLLECTION_FILE_EXTENSIONS) and not filename.lower().endswith('.copc.laz')
+    )
+
+
+def extract_collection(asset_id, archive_path):
+    """Extract the LAS/LAZ members of the uploaded zip (flattened) into the collection dir."""
+    collection_dir = get_collection_dir(asset_id)
+    shutil.rmtree(collection_dir, ignore_errors=True)
+    os.makedirs(collection_dir)
+
+    with zipfile.ZipFile(archive_path, 'r') as archive:
+        for member in archive.infolist():
+            filename = os.path.basename(member.filename)
+            if member.is_dir() or not filename.lower().endswith(COLLECTION_FILE_EXTENSIONS):
+                continue
+            if os.path.exists(os.path.join(collection_dir, filename)):
+                raise Exception(f"Duplicated point cloud file name in collection: {filename}")
+            with archive.open(member) as source, open(os.path.join(collection_dir, filename), 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+
+    files = get_collection_files(asset_id)
+    if not files:
+        raise Exception("No LAS/LAZ files found in the point cloud collection")
+    return files
+
+
+def _inspect_file(file_path):
+    return pdal_metadata(file_path), pdal_stats(file_path)
+
+
+def inspect_collection_files(file_paths, max_workers=None):
+    """pdal metadata and stats of every file, concurrently; returns [(metadata_json, stats_json)]."""
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        return list(executor.map(_inspect_file, file_paths))
+
+
+def merge_collection_metadata(file_paths, metadata_jsons):
+    """One pdal-like metadata document for the collection: CRS of the files, summed count, union bounds."""
+    horizontal_epsgs = set()
+    for metadata_json in metadata_jsons:
+        crs_codes = resolve_epsg_codes_from_pdal_metadata(metadata_json['metadata'])
+        horizontal_epsgs.add(crs_codes['horizontal_epsg'] or crs_codes['epsg'])
+    if len(horizontal_epsgs) > 1:
+        raise Exception(f"Point cloud collection files use different CRS: {sorted(str(epsg) for epsg in horizontal_epsgs)}")
+
+    metadata_list = [metadata_json['metadata'] for metadata_json in metadata_jsons]
+    merged = {
+        **metadata_list[0],
+        'count': sum(metadata['count'] for metadata in metadata_list),
+    }
+    for key, reduce in (('minx', min), ('miny', min), ('minz', min), ('maxx', max), ('maxy', max), ('maxz', max)):
+        values = [metadata[key] for metadata in metadata_list if key in metadata]
+        if values:
+            merged[key] = reduce(values)
+
+    return {
+        'metadata': merged,
+        'files': [
+            {'filename': os.path.basename(file_path), 'count': metadata['count']}
+            for file_path, metadata in zip(file_paths, metadata_list, strict=True)
+        ],
+    }
+
+
+def merge_collection_stats(stats_jsons):
+    """Combine per-file pdal stats: min/max over files, count summed, average weighted by count."""
+    merged = {}
+    for stats_json in stats_jsons:
+        for value in stats_json['stats']['statistic']:
+            name = value['name']
+            if name not in merged:
+                merged[name] = {**value}
+                continue
+            current = merged[name]
+            count = current.get('count', 0) + value.get('count', 0)
+            if count and 'average' in current and 'average' in value:
+                current['average'] = (current['average'] * current.get('count', 0) + value['average'] * value.get('count', 0)) / count
+            current['count'] = count
+            current['minimum'] = min(current['minimum'], value['minimum'])
+            current['maximum'] = max(current['maximum'], value['maximum'])
+            # not combinable across files
+            for key in ('stddev', 'variance'):
+                current.pop(key, None)
+
+    statistic = []
+    for position, value in enumerate(merged.values()):
+        statistic.append({**value, 'position': position})
+    return {'stats': {'statistic': statistic}}
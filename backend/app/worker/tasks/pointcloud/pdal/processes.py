@@ -2,9 +2,86 @@ import subprocess
 import json
 import os
 import math
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pyproj import CRS
 from app.worker.tasks.pointcloud.crs import resolve_epsg_codes_from_pdal_metadata
-from app.worker.common.utils import get_asset_upload_path, run_subprocess
+from app.worker.common.utils import get_asset_upload_path, run_subprocess, get_available_cpus, get_worker_concurrency
+
+
+PREVIEW_POINTS = 500000
+
+# filters.smrf maximum window size (its default); tile buffers must be wider than this
+SMRF_WINDOW = 18.0
+# filters.elm cell size (its default)
+ELM_CELL = 10.0
+# tile edges and buffers on multiples of the filters.elm cell and of the filters.smrf window (1m
+# cells), so neighbour tiles classify on the same grids
+TILE_ALIGNMENT = math.lcm(int(ELM_CELL), int(SMRF_WINDOW))
+
+
+def get_point_cloud_copc_path(asset_id):
+    return get_asset_upload_path(f"{asset_id}/index.copc.laz")
+
+
+def get_copc_path(file_path):
+    """COPC sibling of a LAS/LAZ file (index.laz -> index.copc.laz)."""
+    return f"{os.path.splitext(file_path)[0]}.copc.laz"
+
+
+def is_copc(file_path):
+    return file_path.lower().endswith('.copc.laz')
+
+
+def resolve_asset_point_cloud_file(asset):
+    """COPC copy of the asset when available, otherwise the uploaded LAS/LAZ."""
+    copc_path = get_point_cloud_copc_path(asset['id'])
+    if os.path.isfile(copc_path):
+        return copc_path
+    return get_asset_upload_path(f"{asset['id']}/index{asset['extension']}")
+
+
+def point_cloud_reader(file_path, bounds=None, resolution=None):
+    """Reader stages for file_path. COPC reads only the octree nodes inside bounds and down to resolution,
+    plain LAS/LAZ is streamed and cropped afterwards. bounds is [minx, miny, maxx, maxy] in the file CRS."""
+    pdal_bounds = None
+    if bounds:
+        pdal_bounds = f"([{bounds[0]}, {bounds[2]}], [{bounds[1]}, {bounds[3]}])"
+
+    if is_copc(file_path):
+        reader = {"type": "readers.copc", "filename": file_path}
+        if pdal_bounds:
+            reader["bounds"] = pdal_bounds
+        if resolution:
+            reader["resolution"] = resolution
+        return [reader]
+
+    stages = [{"type": "readers.las", "filename": file_path}]
+    if pdal_bounds:
+        stages += [{"type": "filters.crop", "bounds": pdal_bounds}]
+    return stages
+
+
+def pdal_to_copc(input_file_path, output_file_path):
+    tmp_output_file_path = f"{output_file_path}.tmp.copc.laz"
+    pipeline = [
+        {"type": "readers.las", "filename": input_file_path},
+        {"type": "writers.copc", "filename": tmp_output_file_path, "forward": "all", "extra_dims": "all"},
+    ]
+
+    pipeline_copc_path = f"{output_file_path}.pipeline.json"
+    with open(pipeline_copc_path, "w") as f:
+        json.dump(pipeline, f)
+
+    res = run_subprocess(['pdal', 'pipeline', pipeline_copc_path], capture_output=True, text=True)
+    os.remove(pipeline_copc_path)
+
+    if not os.path.isfile(tmp_output_file_path):
+        print(res.stderr)
+        raise Exception("COPC not created")
+
+    os.replace(tmp_output_file_path, output_file_path)
+    return output_file_path
 
 
 def pdal_metadata(file_path):
@@ -23,14 +100,9 @@ def pdal_stats(file_path):
     return json.loads(result.stdout.decode("utf-8"))
 
 
-def point_cloud_preview(input_file_path, output_file_path, metadata, stats):
-    pipeline = [{"filename": input_file_path, "type": 'readers.las'}]
-
-    count = metadata['metadata']['count']
-    if count > 500000:
-        step = int(math.ceil(count / 500000))
-        pipeline += [{"type": 'filters.decimation', "step": step}]
-
+def point_cloud_preview(input_file_path, output_file_path, metadata, stats, output_sample_path=None):
+    """Centered xyz preview of ~PREVIEW_POINTS points; the same decimated points (not centered)
+    are also written to output_sample_path as LAZ when given."""
     statistic = stats['stats']['statistic']
     x = y = z = red = None
     for value in statistic:
@@ -46,7 +118,35 @@ def point_cloud_preview(input_file_path, output_file_path, metadata, stats):
     size = [x['maximum'] - x['minimum'], y['maximum'] - y['minimum'], z['maximum'] - z['minimum']]
     center = [x['minimum'] + (size[0] / 2), y['minimum'] + (size[1] / 2), z['minimum'] + (size[2] / 2)]
 
-    pipeline += [{"type": "filters.transformation", "matrix": f"1  0  0  {-center[0]}  0  1  0  {-center[1]}  0  0  1  {-center[2]}  0  0  0  1"}]
+    count = metadata['metadata']['count']
+    if isinstance(input_file_path, list):
+        # collection: merge every file, then decimate the merged view
+        pipeline = list(input_file_path) + [{"type": "filters.merge"}]
+        if count > PREVIEW_POINTS:
+            step = int(math.ceil(count / PREVIEW_POINTS))
+            pipeline += [{"type": 'filters.decimation', "step": step}]
+    elif is_copc(input_file_path):
+        # read only the octree levels needed for ~PREVIEW_POINTS points over the cloud footprint
+        resolution = None
+        if count > PREVIEW_POINTS and size[0] > 0 and size[1] > 0:
+            resolution = math.sqrt((size[0] * size[1]) / PREVIEW_POINTS)
+        pipeline = point_cloud_reader(input_file_path, resolution=resolution)
+    else:
+        pipeline = point_cloud_reader(input_file_path)
+        if count > PREVIEW_POINTS:
+            step = int(math.ceil(count / PREVIEW_POINTS))
+            pipeline += [{"type": 'filters.decimation', "step": step}]
+
+    transformation = {"type": "filters.transformation", "matrix": f"1  0  0  {-center[0]}  0  1  0  {-center[1]}  0  0  1  {-center[2]}  0  0  0  1"}
+    if output_sample_path:
+        # branch the decimated points: georeferenced LAZ sample + centered xyz preview
+        pipeline[-1] = {**pipeline[-1], "tag": "sample"}
+        pipeline += [
+            {"type": 'writers.las', "filename": output_sample_path, "compression": True, "forward": "all", "inputs": ["sample"]},
+            {**transformation, "inputs": ["sample"]}
+        ]
+    else:
+        pipeline += [transformation]
 
     if red:
         pipeline += [{"type": 'writers.text', "format": 'csv', "order": 'X,Y,Z,Red:0,Green:0,Blue:0', "keep_unspecified": False, "filename": output_file_path}]
@@ -84,8 +184,97 @@ def resolve_asset_crs(asset):
     return horizontal_epsg, vertical_epsg
 
 
-def process_las(pipeline_id, asset, sample_radius=None, to_ellipsoidal_height=False, colorization_image='', ground_classification=False):
-    asset_upload_path = get_asset_upload_path(f"{asset['id']}/index{asset['extension']}")
+def _align(value):
+    return math.ceil(value / TILE_ALIGNMENT) * TILE_ALIGNMENT
+
+
+def _default_workers():
+    # the worker share of the host, as the other per-task pools
+    return max(1, get_available_cpus() // get_worker_concurrency())
+
+
+def _tile_grid(bounds, tile_size):
+    """Core XY cells covering bounds; inner edges lie on the TILE_ALIGNMENT lattice (tile_size is
+    rounded up to a multiple of it), outer cells are widened so edge points fall inside a core."""
+    minx, miny, maxx, maxy = bounds
+    tile_size = max(TILE_ALIGNMENT, _align(tile_size))
+    origin_x = math.floor(minx / TILE_ALIGNMENT) * TILE_ALIGNMENT
+    origin_y = math.floor(miny / TILE_ALIGNMENT) * TILE_ALIGNMENT
+    columns = max(1, int(math.ceil((maxx - origin_x) / tile_size)))
+    rows = max(1, int(math.ceil((maxy - origin_y) / tile_size)))
+    tiles = []
+    for column in range(columns):
+        for row in range(rows):
+            tile_minx = origin_x + column * tile_size if column > 0 else minx - 1
+            tile_maxx = origin_x + (column + 1) * tile_size if column < columns - 1 else maxx + 1
+            tile_miny = origin_y + row * tile_size if row > 0 else miny - 1
+            tile_maxy = origin_y + (row + 1) * tile_size if row < rows - 1 else maxy + 1
+            tiles.append([tile_minx, tile_miny, tile_maxx, tile_maxy])
+    return tiles
+
+
+def _process_tile(input_file_path, stages, core, buffer, output_file_path):
+    buffered = [core[0] - buffer, core[1] - buffer, core[2] + buffer, core[3] + buffer]
+    # classify with the neighbourhood of the buffer, keep only the core (half-open, no duplicates)
+    pipeline = point_cloud_reader(input_file_path, bounds=buffered) + stages + [
+        {"type": "filters.expression", "expression": f"X >= {core[0]} && X < {core[2]} && Y >= {core[1]} && Y < {core[3]}"},
+        {"type": 'writers.las', "filename": output_file_path, "compression": True, "forward": "all", "extra_dims": "all"}
+    ]
+
+    pipeline_tile_path = f"{output_file_path}.pipeline.json"
+    with open(pipeline_tile_path, "w") as f:
+        json.dump(pipeline, f)
+
+    res = run_subprocess(['pdal', 'pipeline', pipeline_tile_path], capture_output=True, text=True)
+
+    if not os.path.isfile(output_file_path):
+        print(res.stderr)
+        raise Exception(f"Processed LAS tile not created {core}")
+
+    return output_file_path
+
+
+def process_tiled(input_file_path, stages, output_file_path, tile_size, buffer=None, max_workers=None):
+    """Run stages over buffered XY tiles concurrently and merge the tile cores into output_file_path.
+    The buffer is rounded up to a multiple of TILE_ALIGNMENT, so the buffered reads start on the lattice too."""
+    buffer = buffer if buffer is not None else SMRF_WINDOW * 2
+    if buffer <= SMRF_WINDOW:
+        raise ValueError(f"Tile buffer ({buffer}) must be wider than the SMRF window ({SMRF_WINDOW})")
+    buffer = _align(buffer)
+
+    metadata = pdal_metadata(input_file_path)['metadata']
+    bounds = [metadata['minx'], metadata['miny'], metadata['maxx'], metadata['maxy']]
+    tiles = _tile_grid(bounds, float(tile_size))
+
+    work_dir = f"{output_file_path}.tiles"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    with ThreadPoolExecutor(max_workers=max_workers or _default_workers()) as executor:
+        futures = [
+            executor.submit(_process_tile, input_file_path, stages, core, buffer, os.path.join(work_dir, f"tile_{idx}.laz"))
+            for idx, core in enumerate(tiles)
+        ]
+        processed = [future.result() for future in futures]
+
+    pipeline_merge_path = os.path.join(work_dir, "merge.pipeline.json")
+    with open(pipeline_merge_path, "w") as f:
+        json.dump(processed + [
+            {"type": "filters.merge"},
+            {"type": 'writers.las', "filename": output_file_path, "compression": True, "forward": "all", "extra_dims": "all"}
+        ], f)
+
+    res = run_subprocess(['pdal', 'pipeline', pipeline_merge_path], capture_output=True, text=True)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not os.path.isfile(output_file_path):
+        print(res.stderr)
+        raise Exception("Merged LAS not created")
+
+    return output_file_path
+
+
+def _process_las_stages(asset, sample_radius=None, to_ellipsoidal_height=False, colorization_image='', ground_classification=False):
     pipeline = []
 
     if sample_radius:
@@ -107,24 +296,77 @@ def process_las(pipeline_id, asset, sample_radius=None, to_ellipsoidal_height=Fa
             {"type": "filters.assign", "assignment": "Classification[:]=0"},
             {"type": "filters.elm"},
             {"type": "filters.outlier"},
-            {"type": "filters.smrf", "ignore": "Classification[7:7]"}
+            {"type": "filters.smrf", "window": SMRF_WINDOW, "ignore": "Classification[7:7]"}
         ]
 
-    if len(pipeline) == 0:
-        return asset_upload_path
+    return pipeline
+
 
-    output_processed_laz_path = get_asset_upload_path(f"{asset['id']}/{pipeline_id}.laz")
-    pipeline_process_path = get_asset_upload_path(f"{asset['id']}/{pipeline_id}.pipeline.json")
+def _process_las_file(input_file_path, output_file_path, stages, tile_size=None, tile_buffer=None, workers=None):
+    if tile_size:
+        # every tile reads its buffered window, so make sure those are indexed reads
+        if not is_copc(input_file_path):
+            copc_path = get_copc_path(input_file_path)
+            if not os.path.isfile(copc_path):
+                pdal_to_copc(input_file_path, copc_path)
+            input_file_path = copc_path
+        return process_tiled(input_file_path, stages, output_file_path, tile_size, tile_buffer, workers)
 
-    pipeline = [{"filename": asset_upload_path, "type": 'readers.las'}] + pipeline + [{"type": 'writers.las', "filename": output_processed_laz_path, "compression": True}]
+    pipeline_process_path = f"{output_file_path}.pipeline.json"
+    pipeline = point_cloud_reader(input_file_path) + stages + [{"type": 'writers.las', "filename": output_file_path, "compression": True}]
 
     with open(pipeline_process_path, "w") as f:
         json.dump(pipeline, f)
 
     res = run_subprocess(['pdal', 'pipeline', pipeline_process_path], capture_output=True, text=True)
 
-    if not os.path.isfile(output_processed_laz_path):
+    if not os.path.isfile(output_file_path):
         print(res.stderr)
         raise Exception("Processed LAS not created")
 
-    return output_processed_laz_path
+    return output_file_path
+
+
+def process_las(pipeline_id, asset, sample_radius=None, to_ellipsoidal_height=False, colorization_image='', ground_classification=False,
+                ground_classification_tile_size=None, ground_classification_tile_buffer=None, ground_classification_workers=None):
+    asset_upload_path = get_asset_upload_path(f"{asset['id']}/index{asset['extension']}")
+    stages = _process_las_stages(asset, sample_radius, to_ellipsoidal_height, colorization_image, ground_classification)
+
+    if len(stages) == 0:
+        return asset_upload_path
+
+    tile_size = ground_classification_tile_size if ground_classification else None
+    return _process_las_file(
+        resolve_asset_point_cloud_file(asset), get_asset_upload_path(f"{asset['id']}/{pipeline_id}.laz"), stages,
+        tile_size, ground_classification_tile_buffer, ground_classification_workers
+    )
+
+
+def process_las_collection(pipeline_id, asset, input_file_paths, sample_radius=None, to_ellipsoidal_height=False, colorization_image='', ground_classification=False,
+                           ground_classification_tile_size=None, ground_classification_tile_buffer=None, ground_classification_workers=None, max_workers=None):
+    """process_las for every file of a point cloud collection, files filtered concurrently."""
+    stages = _process_las_stages(asset, sample_radius, to_ellipsoidal_height, colorization_image, ground_classification)
+
+    if len(stages) == 0:
+        return input_file_paths
+
+    output_dir = get_asset_upload_path(f"{asset['id']}/{pipeline_id}")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+
+    tile_size = ground_classification_tile_size if ground_classification else None
+    # tiled files already fan out over tiles, keep the file level sequential to avoid oversubscription
+    file_workers = 1 if tile_size else (max_workers or _default_workers())
+    # keep the source extension in the name: tile.las and tile.laz must not overwrite each other
+    output_names = [f"{os.path.basename(input_file_path)}.laz" for input_file_path in input_file_paths]
+    if len(set(output_names)) != len(output_names):
+        raise Exception("Duplicated point cloud file name in collection")
+    with ThreadPoolExecutor(max_workers=file_workers) as executor:
+        futures = [
+            executor.submit(
+                _process_las_file, input_file_path, os.path.join(output_dir, output_name), stages,
+                tile_size, ground_classification_tile_buffer, ground_classification_workers
+            )
+            for input_file_path, output_name in zip(input_file_paths, output_names, strict=True)
+        ]
+        return [future.result() for future in futures]
@@ -1,7 +1,12 @@
 import subprocess
 import json
 import os
-from app.worker.common.utils import run_subprocess
+import time
+from app.core.config import settings
+from app.worker.common.utils import run_subprocess, get_worker_concurrency, get_available_cpus, get_total_memory_mb
+
+# share of the memory budget given to the py3dtiles node cache, the rest is left to the worker processes
+CACHE_MEMORY_RATIO = 0.5
 
 
 def _as_float(value, name):
@@ -18,18 +23,40 @@ def scale_geometric_error(leaf, scale=1):
     return scaled_leaf
 
 
-def py3dtiles_convert(input_path, output_path, srs_in, geometric_error_scale_factor=1):
+def resolve_conversion_budget(cpu_budget=None, memory_budget_mb=None):
+    """Jobs and cache size (MB) for one conversion: the pipeline budget if given, otherwise
+    the worker budget (settings, or the whole host) split across the Celery concurrency."""
+    concurrency = get_worker_concurrency()
+    if cpu_budget is None:
+        cpu_budget = (settings.DTT_POINT_CLOUD_CPU_BUDGET or get_available_cpus()) / concurrency
+    if memory_budget_mb is None:
+        memory_budget_mb = (settings.DTT_POINT_CLOUD_MEMORY_BUDGET_MB or get_total_memory_mb()) / concurrency
+    return {
+        'jobs': max(1, int(cpu_budget)),
+        'cache_size': max(128, int(memory_budget_mb * CACHE_MEMORY_RATIO)),
+    }
+
+
+def py3dtiles_convert(input_path, output_path, srs_in, geometric_error_scale_factor=1, budget=None, points_count=None):
     scale = _as_float(geometric_error_scale_factor, 'geometric_error_scale_factor')
+    budget = budget or resolve_conversion_budget()
 
+    # several input files are converted into one merged tileset
+    input_paths = input_path if isinstance(input_path, list) else [input_path]
+
+    start = time.time()
     res = run_subprocess([
-        'py3dtiles', 'convert', input_path,
+        'py3dtiles', 'convert', *input_paths,
         '--overwrite', '--classification', '--force-srs-in',
         '--color_scale', "255",
         '--out', output_path,
         '--srs_in', srs_in,
         '--srs_out', '4978',
-        '--intensity'
+        '--intensity',
+        '--jobs', f"{budget['jobs']}",
+        '--cache_size', f"{budget['cache_size']}",
     ], capture_output=True, text=True)
+    elapsed = time.time() - start
 
     try:
         tileset_json_path = os.path.join(output_path, 'tileset.json')
@@ -48,3 +75,10 @@ def py3dtiles_convert(input_path, output_path, srs_in, geometric_error_scale_fac
     except Exception as e:
         print(res.stderr)
         raise e
+
+    return {
+        **budget,
+        'points': points_count,
+        'elapsed': elapsed,
+        'points_per_second': (points_count / elapsed) if points_count and elapsed > 0 else None,
+    }
@@ -1,16 +1,56 @@
+import os
 import json
 import shutil
 
 from sqlmodel import Session, select
 from app.core.db import engine
+from app.core.config import settings
 from app.models.task import Asset
 from app.worker.main import celery, PipelineDatabaseTask, AssetDatabaseTask
 from app.worker.common.utils import get_asset_upload_path, setup_output_directory
 from app.worker.tasks.pointcloud.crs import resolve_epsg_codes_from_pdal_metadata
 from app.worker.tasks.pointcloud.pdal.processes import (
-    pdal_metadata, pdal_stats, point_cloud_preview, process_las, resolve_asset_crs
+    pdal_metadata, pdal_stats, point_cloud_preview, process_las, resolve_asset_crs,
+    pdal_to_copc, get_point_cloud_copc_path, process_las_collection
 )
-from app.worker.tasks.pointcloud.py3dtiles.processes import py3dtiles_convert
+from app.worker.tasks.pointcloud.pdal.collection import (
+    is_point_cloud_collection, extract_collection, get_collection_files, inspect_collection_files,
+    merge_collection_metadata, merge_collection_stats
+)
+from app.worker.tasks.pointcloud.py3dtiles.processes import py3dtiles_convert, resolve_conversion_budget
+
+
+# the quick-look sample is ~500k points: a couple of processes are enough to convert it in seconds
+QUICKLOOK_BUDGET = {'jobs': 2, 'cache_size': 256}
+
+
+def _as_optional_float(value):
+    if value in (None, ''):
+        return None
+    return float(value)
+
+
+def _as_optional_int(value):
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def _quicklook_payload(asset_id, horizontal_epsg):
+    """Tiny 3D Tiles tileset from the inspection sample so the asset can be shown before a full conversion."""
+    sample_path = get_asset_upload_path(f"{asset_id}/sample.laz")
+    if not horizontal_epsg or not os.path.isfile(sample_path):
+        return {'quicklook': False}
+    try:
+        py3dtiles_convert(sample_path, get_asset_upload_path(f"{asset_id}/quicklook"), f'{horizontal_epsg}', budget=QUICKLOOK_BUDGET)
+    except Exception as e:
+        # the quick-look is a convenience, the asset stays usable without it
+        print('Quick-look tileset not created', e)
+        return {'quicklook': False}
+    return {
+        'quicklook': True,
+        'quicklook_tileset': os.path.join(settings.API_V1_STR, 'assets', f'{asset_id}', 'quicklook', 'tileset.json'),
+    }
 
 
 @celery.task(name="inspect_pointcloud", base=AssetDatabaseTask)
@@ -34,7 +74,15 @@ def inspect_pointcloud(options):
     horizontal_epsg = crs_codes['horizontal_epsg']
     vertical_epsg = crs_codes['vertical_epsg']
 
-    point_cloud_preview(asset_file_path, get_asset_upload_path(f"{asset_id}/sample.xyz"), metadata_json, stats_json)
+    copc = options.get('copc', settings.DTT_POINT_CLOUD_COPC)
+    preview_file_path = asset_file_path
+    if copc:
+        preview_file_path = pdal_to_copc(asset_file_path, get_point_cloud_copc_path(asset_id))
+
+    point_cloud_preview(
+        preview_file_path, get_asset_upload_path(f"{asset_id}/sample.xyz"), metadata_json, stats_json,
+        output_sample_path=get_asset_upload_path(f"{asset_id}/sample.laz")
+    )
 
     return {
         'asset_type': 'LAS',
@@ -43,9 +91,51 @@ def inspect_pointcloud(options):
             'metadata': True,
             'stats': True,
             'sample': True,
+            'copc': bool(copc),
             'epsg': epsg,
             'horizontal_epsg': horizontal_epsg,
             'vertical_epsg': vertical_epsg,
+            **_quicklook_payload(asset_id, horizontal_epsg or epsg),
+        }
+    }
+
+
+@celery.task(name="inspect_pointcloud_collection", base=AssetDatabaseTask)
+def inspect_pointcloud_collection(options):
+    asset = options['asset']
+    asset_id = asset['id']
+    extension = asset['extension']
+
+    file_paths = extract_collection(asset_id, get_asset_upload_path(f"{asset_id}/index{extension}"))
+    inspections = inspect_collection_files(file_paths)
+
+    metadata_json = merge_collection_metadata(file_paths, [metadata for metadata, _stats in inspections])
+    with open(get_asset_upload_path(f"{asset_id}/metadata.json"), 'w') as f:
+        json.dump(metadata_json, f)
+
+    stats_json = merge_collection_stats([stats for _metadata, stats in inspections])
+    with open(get_asset_upload_path(f"{asset_id}/stats.json"), 'w') as f:
+        json.dump(stats_json, f)
+
+    crs_codes = resolve_epsg_codes_from_pdal_metadata(metadata_json['metadata'])
+
+    point_cloud_preview(
+        file_paths, get_asset_upload_path(f"{asset_id}/sample.xyz"), metadata_json, stats_json,
+        output_sample_path=get_asset_upload_path(f"{asset_id}/sample.laz")
+    )
+
+    return {
+        'asset_type': 'LAS',
+        'geometry_type': 'PointCloud',
+        'payload': {
+            'metadata': True,
+            'stats': True,
+            'sample': True,
+            'files': len(file_paths),
+            'epsg': crs_codes['epsg'],
+            'horizontal_epsg': crs_codes['horizontal_epsg'],
+            'vertical_epsg': crs_codes['vertical_epsg'],
+            **_quicklook_payload(asset_id, crs_codes['horizontal_epsg'] or crs_codes['epsg']),
         }
     }
 
@@ -59,7 +149,14 @@ def create_point_cloud_3dtiles(pipeline_extended):
         "sample_radius": None,
         "to_ellipsoidal_height": False,
         "ground_classification": False,
+        # classify in buffered XY tiles of this size (CRS units) in parallel instead of one pass
+        "ground_classification_tile_size": None,
+        "ground_classification_tile_buffer": None,
+        "ground_classification_workers": None,
         "geometric_error_scale_factor": 1,
+        # per-run core / memory (MB) budget for the conversion, defaults to the worker share
+        "cpu_budget": None,
+        "memory_budget_mb": None,
     }
 
     config = {**default_config, **pipeline_config}
@@ -79,26 +176,48 @@ def create_point_cloud_3dtiles(pipeline_extended):
             image_asset = session.exec(statement).first()
             colorization_image_path = get_asset_upload_path(f"{image_asset.id}/index{image_asset.extension}")
 
-    input_file = process_las(
-        pipeline_id, asset,
+    budget = resolve_conversion_budget(
+        _as_optional_float(config['cpu_budget']),
+        _as_optional_float(config['memory_budget_mb'])
+    )
+
+    process_options = dict(
         sample_radius=config['sample_radius'],
         to_ellipsoidal_height=config['to_ellipsoidal_height'],
         colorization_image=colorization_image_path,
-        ground_classification=config['ground_classification']
+        ground_classification=config['ground_classification'],
+        ground_classification_tile_size=_as_optional_float(config['ground_classification_tile_size']),
+        ground_classification_tile_buffer=_as_optional_float(config['ground_classification_tile_buffer']),
+        # tiles are classified within the conversion core budget
+        ground_classification_workers=_as_optional_int(config['ground_classification_workers']) or budget['jobs']
     )
 
+    if is_point_cloud_collection(asset):
+        # files are filtered concurrently and converted together into a single tileset
+        input_file = process_las_collection(
+            pipeline_id, asset, get_collection_files(asset['id']), **process_options, max_workers=budget['jobs']
+        )
+        points_count = sum(pdal_metadata(f)['metadata'].get('count', 0) for f in input_file)
+    else:
+        input_file = process_las(pipeline_id, asset, **process_options)
+        points_count = pdal_metadata(input_file)['metadata'].get('count')
+
     horizontal_epsg, _vertical_epsg = resolve_asset_crs(asset)
     crs_in = horizontal_epsg
 
     if not crs_in:
         raise Exception('Not recognized Point Cloud CRS')
 
-    py3dtiles_convert(input_file, output_paths['output_path_3dtiles'], f'{crs_in}', config['geometric_error_scale_factor'])
+    conversion_stats = py3dtiles_convert(
+        input_file, output_paths['output_path_3dtiles'], f'{crs_in}', config['geometric_error_scale_factor'],
+        budget=budget, points_count=points_count
+    )
 
     shutil.make_archive(output_paths['output_path_3dtiles_zip'], 'zip', output_paths['output_path_3dtiles'])
 
     return {
         'output': output_paths['output_path'],
         'tileset': output_paths['output_tileset'],
-        'download': output_paths['output_tileset_zip']
+        'download': output_paths['output_tileset_zip'],
+        'stats': conversion_stats
     }
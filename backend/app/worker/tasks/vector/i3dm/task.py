@@ -2,18 +2,107 @@ import os
 import json
 import shutil
 
-from sqlmodel import Session, select, text, Table, MetaData
+import numpy as np
+from sqlalchemy import types
+from sqlmodel import Session, select, text, Table, MetaData, func
+from app.core.config import settings
 from app.core.db import engine_tasks, engine
 from app.models.task import Asset
 from app.worker.main import celery, PipelineDatabaseTask
 from app.worker.common.utils import (
     get_asset_table_name, get_pipeline_table_name, setup_output_directory, get_asset_upload_path
 )
-from app.worker.common.expression import parse_expression
+from app.worker.common.expression import parse_expression, evaluate_expression_columns, expression_to_sql
 from app.worker.common.types import JSONEncoder
+from app.worker.common.bulk import CopyWriter, cluster_table, quote_identifier
+from app.worker.common.ewkb import point_z_to_ewkb
 from app.worker.tasks.vector.i3dm.processes import i3dm_export
 
 
+def _sql_column_kind(column):
+    if isinstance(column.type, types.Integer | types.Numeric):
+        return 'number'
+    if isinstance(column.type, types.String):
+        return 'string'
+    return None
+
+
+def _instance_sql(table_name, property_columns, geometry_column_name, config, default_config):
+    """SELECT computing geometry, scale, rotation, model and tags in the database, None if an expression can't be pushed down."""
+    geometry = quote_identifier(geometry_column_name)
+    columns = {}
+    source_columns = {}
+    for c in property_columns:
+        kind = _sql_column_kind(c)
+        columns[c.name] = (quote_identifier(c.name), kind) if kind else None
+        source_columns[c.name] = (f"source.{quote_identifier(c.name)}", kind) if kind else None
+
+    translate_z = expression_to_sql(
+        'number', config['translate_z'], columns,
+        {'$minZ': f"COALESCE(ST_Z({geometry}), 0)", '$maxZ': f"COALESCE(ST_Z({geometry}), 0)"},
+        default_config['translate_z']
+    )
+    if translate_z is None:
+        return None
+
+    # scale, rotation and model see the translated point
+    translated_z = f"(COALESCE(ST_Z(source.{geometry}), 0) + source._translate_z)"
+    functions = {'$minZ': translated_z, '$maxZ': translated_z}
+    scale = expression_to_sql('number', config['scale'], source_columns, functions, default_config['scale'])
+    rotation = expression_to_sql('number', config['rotation'], source_columns, functions, default_config['rotation'])
+    model = expression_to_sql('string', config['model'], source_columns, functions, default_config['model'])
+    if scale is None or rotation is None or model is None:
+        return None
+
+    tags = ", ".join(
+        f"json_build_object('{c.name.replace(chr(39), chr(39) * 2)}', source.{quote_identifier(c.name)})"
+        for c in property_columns
+    )
+    return (
+        f"SELECT ST_SetSRID(ST_Translate(ST_Force3D(source.{geometry}), 0, 0, source._translate_z), 4326), "
+        f"{scale}, {rotation}, {model}, json_build_array({tags}) "
+        f"FROM (SELECT *, COALESCE({translate_z}, 0) AS _translate_z FROM {quote_identifier(table_name)}) AS source"
+    )
+
+
+def _insert_instances(table_task_name, geometry_column_name, instance_sql):
+    with Session(engine_tasks) as session:
+        session.exec(text(f"INSERT INTO {table_task_name}({geometry_column_name}, scale, rotation, model, tags) {instance_sql};"))
+        session.commit()
+
+
+def _copy_instances(table, table_task_name, property_columns, geometry_column_name, config, default_config):
+    """Evaluate the expressions per batch of rows (columnar) and COPY the instances."""
+    geometry_column = table.c[geometry_column_name]
+    statement = select(
+        *property_columns,
+        func.ST_X(geometry_column).label('_x'),
+        func.ST_Y(geometry_column).label('_y'),
+        func.coalesce(func.ST_Z(geometry_column), 0).label('_z')
+    ).execution_options(yield_per=settings.DTT_BULK_COPY_BATCH_SIZE)
+
+    copy_columns = [geometry_column_name, 'scale', 'rotation', 'model', 'tags']
+    with Session(engine_tasks) as session, CopyWriter(table_task_name, copy_columns) as writer:
+        for partition in session.execute(statement).partitions():
+            row_objs = [row._asdict() for row in partition]
+            count = len(row_objs)
+            properties = {c.name: [row_obj[c.name] for row_obj in row_objs] for c in property_columns}
+
+            z = np.array([row_obj['_z'] for row_obj in row_objs], dtype=np.float64)
+            translate_z = evaluate_expression_columns('number', config['translate_z'], properties, count, {'$minZ': z, '$maxZ': z}, default_config['translate_z'])
+            z = z + np.array([0 if value is None else value for value in translate_z], dtype=np.float64)
+
+            functions = {'$minZ': z, '$maxZ': z}
+            scales = evaluate_expression_columns('number', config['scale'], properties, count, functions, default_config['scale'])
+            rotations = evaluate_expression_columns('number', config['rotation'], properties, count, functions, default_config['rotation'])
+            models = evaluate_expression_columns('string', config['model'], properties, count, functions, default_config['model'])
+
+            for index, row_obj in enumerate(row_objs):
+                tags = json.dumps([{c.name: row_obj[c.name]} for c in property_columns], cls=JSONEncoder)
+                coordinates = [row_obj['_x'], row_obj['_y'], z[index]]
+                writer.write([point_z_to_ewkb(coordinates).hex(), scales[index], rotations[index], models[index], tags])
+
+
 @celery.task(name="create_point_instance_3dtiles", base=PipelineDatabaseTask)
 def create_point_instance_3dtiles(pipeline_extended):
     asset = pipeline_extended['asset']
@@ -38,53 +127,23 @@ def create_point_instance_3dtiles(pipeline_extended):
 
     table = Table(table_name, MetaData(), autoload_with=engine_tasks)
     table_task_name = get_pipeline_table_name(pipeline_id)
-    models = []
 
     with Session(engine_tasks) as session:
         session.exec(text(f"DROP TABLE IF EXISTS {table_task_name};"))
-        session.exec(text(f"CREATE TABLE {table_task_name}(id serial PRIMARY KEY,{geometry_column_name} geometry(POINTZ, 4326),scale double precision,scale_non_uniform double precision[3],rotation double precision,model varchar,tags json);"))
-        session.exec(text(f"CREATE INDEX {table_task_name}_geom_idx ON {table_task_name} USING GIST ({geometry_column_name});"))
+        session.exec(text(f"CREATE UNLOGGED TABLE {table_task_name}(id serial PRIMARY KEY,{geometry_column_name} geometry(POINTZ, 4326),scale double precision,scale_non_uniform double precision[3],rotation double precision,model varchar,tags json);"))
         session.commit()
 
-        statement = select(table).execution_options(yield_per=1000)
-        for partition in session.execute(statement).partitions():
-            for row in partition:
-                row_obj = row._asdict()
-                row_geometry = row_obj[geometry_column_name]
-                as_geojson = session.exec(text(f"SELECT ST_AsGeoJSON('{row_geometry}')"))
-
-                properties = []
-                feature_properties = {}
-                for key in row_obj:
-                    if key not in [geometry_column_name, fid_column_name]:
-                        properties.append({key: row_obj[key]})
-                        feature_properties[key] = row_obj[key]
-
-                geojson_string = as_geojson.first()[0]
-                geometry = json.loads(geojson_string)
-                coordinates = geometry['coordinates']
-                z = coordinates[2] if coordinates[2] else 0
-
-                feature = {'type': 'Feature', 'properties': feature_properties, 'geometry': geometry}
-                translate_z = parse_expression('number', config['translate_z'], feature, default_config['translate_z'])
-
-                coordinates = [coordinates[0], coordinates[1], z + translate_z]
-                updated_geometry = {**geometry, 'coordinates': coordinates}
-                updated_geometry_string = json.dumps(updated_geometry)
-                properties_string = json.dumps(properties, cls=JSONEncoder)
-
-                feature = {'type': 'Feature', 'properties': feature_properties, 'geometry': updated_geometry}
-                model_scale = parse_expression('number', config['scale'], feature, default_config['scale'])
-                model_rotation = parse_expression('number', config['rotation'], feature, default_config['rotation'])
-                model_name = parse_expression('string', config['model'], feature, default_config['model'])
-
-                if model_name not in models:
-                    models.append(model_name)
-
-                values = ",".join([f"ST_GeomFromGeoJSON('{updated_geometry_string}')", f"{model_scale}", f"{model_rotation}", f"'{model_name}'", f"'{properties_string}'"])
-                session.exec(text(f"INSERT INTO {table_task_name}({geometry_column_name}, scale, rotation, model, tags) VALUES ({values});"))
+    property_columns = [c for c in table.c if c.name not in [geometry_column_name, fid_column_name]]
+    instance_sql = _instance_sql(table_name, property_columns, geometry_column_name, config, default_config)
+    if instance_sql:
+        _insert_instances(table_task_name, geometry_column_name, instance_sql)
+    else:
+        _copy_instances(table, table_task_name, property_columns, geometry_column_name, config, default_config)
 
-        session.commit()
+    cluster_table(table_task_name, f"ST_GeoHash({geometry_column_name})", [f"USING GIST ({geometry_column_name})"])
+
+    with Session(engine_tasks) as session:
+        models = [row[0] for row in session.exec(text(f"SELECT DISTINCT model FROM {table_task_name} WHERE model IS NOT NULL;")).all()]
 
     output_paths = setup_output_directory(pipeline_id)
 
@@ -0,0 +1,196 @@
+"""Array based extrusion of polygons into triangulated roof, walls and floor.
+
+Same geometry as app.worker.tasks.vector.pg2b3dm.polyhedron, computed on a batch of features
+at once: rings are flattened into one vertex array (ring and polygon offsets describe the
+nesting), heights and walls are vectorized and only the earcut call runs per polygon.
+"""
+import numpy as np
+import mapbox_earcut
+
+EMPTY_TRIANGLES = np.empty((0, 3), dtype=np.int64)
+
+
+def geometries_to_batch(geometries):
+    """Flatten GeoJSON geometries into vertices (N, 3), ring_offsets (R + 1) and polygon_offsets (P + 1).
+
+    Every geometry gets a polygon slot so results stay aligned with the input; anything other
+    than a Polygon gets an empty one. Missing or null z values are 0.
+    """
+    vertices = []
+    ring_offsets = [0]
+    polygon_offsets = [0]
+    for geometry in geometries:
+        if geometry and geometry.get('type') == 'Polygon':
+            for ring in geometry['coordinates']:
+                vertices.extend((c[0], c[1], c[2] if len(c) > 2 and c[2] else 0) for c in ring)
+                ring_offsets.append(len(vertices))
+        polygon_offsets.append(len(ring_offsets) - 1)
+
+    return {
+        'vertices': np.array(vertices, dtype=np.float64).reshape(-1, 3),
+        'ring_offsets': np.array(ring_offsets, dtype=np.int64),
+        'polygon_offsets': np.array(polygon_offsets, dtype=np.int64),
+    }
+
+
+def polygon_z_range(batch):
+    """Per polygon minimum and maximum vertex z ($minZ / $maxZ of expressions), None for empty polygons."""
+    polygon_vertex_offsets = batch['ring_offsets'][batch['polygon_offsets']]
+    starts = polygon_vertex_offsets[:-1]
+    not_empty = polygon_vertex_offsets[1:] > starts
+    z = batch['vertices'][:, 2]
+    min_z = [None] * len(starts)
+    max_z = [None] * len(starts)
+    if len(z):
+        indices = np.nonzero(not_empty)[0]
+        for index, low, high in zip(indices.tolist(), np.minimum.reduceat(z, starts[not_empty]).tolist(), np.maximum.reduceat(z, starts[not_empty]).tolist(), strict=True):
+            min_z[index] = low
+            max_z[index] = high
+    return min_z, max_z
+
+
+def triangulate_polygon(xy, ring_ends):
+    """earcut (float64) of one polygon; xy is (n, 2), ring_ends the local end index of every ring."""
+    try:
+        indices = mapbox_earcut.triangulate_float64(
+            np.ascontiguousarray(xy, dtype=np.float64),
+            np.asarray(ring_ends, dtype=np.uint32)
+        )
+    except Exception as e:
+        print('Earcut error', e)
+        return EMPTY_TRIANGLES
+    return indices.astype(np.int64).reshape(-1, 3)
+
+
+def triangulate_batch(batch, triangulations=None):
+    """Local earcut triangles of every polygon of the batch (indices relative to the polygon's first vertex).
+
+    Entries already present in triangulations (e.g. from a cache) are kept, only None ones are computed.
+    """
+    ring_offsets = batch['ring_offsets']
+    polygon_offsets = batch['polygon_offsets']
+    vertices = batch['vertices']
+    triangulations = list(triangulations) if triangulations is not None else [None] * (len(polygon_offsets) - 1)
+    for polygon in range(len(polygon_offsets) - 1):
+        if triangulations[polygon] is not None:
+            continue
+        first_ring, last_ring = polygon_offsets[polygon], polygon_offsets[polygon + 1]
+        if first_ring == last_ring:
+            triangulations[polygon] = EMPTY_TRIANGLES
+            continue
+        start = ring_offsets[first_ring]
+        ring_ends = ring_offsets[first_ring + 1:last_ring + 1] - start
+        triangulations[polygon] = triangulate_polygon(vertices[start:ring_ends[-1] + start, :2], ring_ends)
+    return triangulations
+
+
+def _feature_values(values, count, default=np.nan):
+    if values is None or np.isscalar(values):
+        value = default if values is None else values
+        return np.full(count, value, dtype=np.float64)
+    return np.array([default if value is None else value for value in values], dtype=np.float64)
+
+
+def extrude_polygons(batch, lower_limits=None, upper_limits=None, translate_z=None, remove_bottom_surface=True, triangulations=None):
+    """Extrude a batch of polygons between per-feature lower and upper heights.
+
+    Limits and translate_z are scalars or one value per feature (None means not set). As in
+    polyhedron.polygon_to_polyhedral_surface a set, non-zero limit replaces the vertex z,
+    features without any limit are only triangulated, and lower/upper are swapped when the
+    lower side ends up above the upper one. triangulations optionally provides the result of
+    triangulate_batch so earcut is skipped.
+
+    Returns vertices (2N, 3) — the lower copy of the batch vertices followed by the upper copy —
+    triangles (T, 3) as global vertex indices grouped by feature (roof, walls, floor), and
+    triangle_offsets (P + 1) so feature p owns triangles[triangle_offsets[p]:triangle_offsets[p + 1]].
+    """
+    xyz = batch['vertices']
+    ring_offsets = batch['ring_offsets']
+    polygon_offsets = batch['polygon_offsets']
+    vertex_count = len(xyz)
+    polygon_count = len(polygon_offsets) - 1
+
+    lower_limits = _feature_values(lower_limits, polygon_count)
+    upper_limits = _feature_values(upper_limits, polygon_count)
+    translate_z = np.nan_to_num(_feature_values(translate_z, polygon_count, 0))
+    remove_bottom_surface = np.broadcast_to(np.asarray(remove_bottom_surface, dtype=bool), (polygon_count,))
+
+    polygon_vertex_offsets = ring_offsets[polygon_offsets]
+    vertex_polygon = np.repeat(np.arange(polygon_count), np.diff(polygon_vertex_offsets))
+    extruded = ~(np.isnan(lower_limits) & np.isnan(upper_limits))
+
+    def heights(limits):
+        limit = limits[vertex_polygon]
+        return np.where(np.isnan(limit) | (limit == 0), xyz[:, 2], limit) + translate_z[vertex_polygon]
+
+    lower_z = heights(lower_limits)
+    upper_z = heights(upper_limits)
+
+    # the first (outer) ring decides which side is the floor
+    has_rings = np.diff(polygon_offsets) > 0
+    first_ring_end = np.where(
+        has_rings,
+        ring_offsets[np.minimum(polygon_offsets[:-1] + 1, len(ring_offsets) - 1)],
+        polygon_vertex_offsets[:-1]
+    )
+    first_ring_size = np.maximum(first_ring_end - polygon_vertex_offsets[:-1], 1)
+
+    def first_ring_average(z):
+        cumulative = np.concatenate(([0.0], np.cumsum(z)))
+        return (cumulative[first_ring_end] - cumulative[polygon_vertex_offsets[:-1]]) / first_ring_size
+
+    swapped = (extruded & (first_ring_average(lower_z) > first_ring_average(upper_z)))[vertex_polygon]
+    lower_z, upper_z = np.where(swapped, upper_z, lower_z), np.where(swapped, lower_z, upper_z)
+
+    vertices = np.empty((vertex_count * 2, 3), dtype=np.float64)
+    vertices[:vertex_count, :2] = xyz[:, :2]
+    vertices[:vertex_count, 2] = lower_z
+    vertices[vertex_count:, :2] = xyz[:, :2]
+    vertices[vertex_count:, 2] = upper_z
+
+    if triangulations is None:
+        triangulations = triangulate_batch(batch)
+
+    triangulations = [np.asarray(local, dtype=np.int64).reshape(-1, 3) for local in triangulations]
+    triangle_counts = np.array([len(local) for local in triangulations], dtype=np.int64)
+    top_polygons = np.repeat(np.arange(polygon_count), triangle_counts)
+    flat = np.concatenate(triangulations) if triangulations else EMPTY_TRIANGLES
+    flat = flat + polygon_vertex_offsets[top_polygons][:, None]
+    # extruded features take the roof from the upper copy and (optionally) a reversed floor from the lower one
+    tops = flat + np.where(extruded[top_polygons], vertex_count, 0)[:, None]
+    with_floor = (extruded & ~remove_bottom_surface)[top_polygons]
+    floors = flat[with_floor][:, [0, 2, 1]]
+    floor_polygons = top_polygons[with_floor]
+
+    # one quad (two triangles) per ring segment, skipping the closing vertex of every ring
+    is_last = np.zeros(vertex_count, dtype=bool)
+    ring_last = ring_offsets[1:] - 1
+    is_last[ring_last[ring_last >= 0]] = True
+    bl = np.nonzero(~is_last & extruded[vertex_polygon])[0]
+    br = bl + 1
+    tl = bl + vertex_count
+    tr = br + vertex_count
+    walls = np.stack([bl, tl, br, br, tl, tr], axis=1).reshape(-1, 3)
+    wall_polygons = np.repeat(vertex_polygon[bl], 2)
+
+    triangles = np.concatenate([tops, walls, floors])
+    triangle_polygons = np.concatenate([top_polygons, wall_polygons, floor_polygons])
+    order = np.argsort(triangle_polygons, kind='stable')
+
+    return {
+        'vertices': vertices,
+        'triangles': triangles[order],
+        'triangle_offsets': np.concatenate(([0], np.cumsum(np.bincount(triangle_polygons, minlength=polygon_count)))),
+    }
+
+
+def to_polyhedrons(result):
+    """Per-feature list of closed triangle rings, the format of polyhedron.geometry_to_polyhedral_surface."""
+    vertices = result['vertices']
+    triangles = result['triangles']
+    offsets = result['triangle_offsets']
+    polyhedrons = []
+    for polygon in range(len(offsets) - 1):
+        points = vertices[triangles[offsets[polygon]:offsets[polygon + 1]]]
+        polyhedrons.append(np.concatenate([points, points[:, :1]], axis=1).tolist())
+    return polyhedrons
@@ -1,54 +1,23 @@
 import subprocess
 import json
 import os
+import shutil
 import sqlalchemy.types as types
-import mapbox_earcut
+from concurrent.futures import ThreadPoolExecutor
 from app.core.config import settings
 from app.worker.common.utils import run_subprocess
 
 
-def earcut_flatten(data):
-    vertices = []
-    altitudes = []
-    dimensions = len(data[0][0])
-    rings = []
-    ring_index = 0
-
-    for ring in data:
-        for p in ring:
-            vertices.append([p[0], p[1]])
-            altitudes.append(p[2])
-        prev_len = 0
-        if ring_index > 0:
-            prev_len = rings[ring_index - 1]
-        rings.append(prev_len + len(ring))
-        ring_index += 1
-
-    return {
-        'vertices': vertices,
-        'rings': rings,
-        'dimensions': dimensions,
-        'altitudes': altitudes
-    }
-
-
-def earcut(coordinates):
-    try:
-        data = earcut_flatten(coordinates)
-        return mapbox_earcut.triangulate_float32(data.get('vertices'), data.get('rings'))
-    except Exception as e:
-        print('Earcut error', e)
-        return []
-
-
-def pg2b3dm(table_task_name, output_3dtiles_path, attributes, geometric_error_factor, max_geometric_error, geometry_column_name, max_features_per_tile, double_sided, fid_column_name, table, lod_column_name, add_outline):
+def _pg2b3dm_command(table_task_name, output_3dtiles_path, attributes, geometric_error_factor, max_geometric_error, geometry_column_name, max_features_per_tile, double_sided, lod_column_name, add_outline, query=None):
     options = []
     if add_outline:
         options = options + ['--add_outlines', 'true']
     if lod_column_name:
         options = options + ['--lodcolumn', lod_column_name, '--refinement', 'REPLACE']
+    if query:
+        options = options + ['-q', query]
 
-    run_subprocess([
+    return [
         'pg2b3dm',
         '-h', settings.POSTGRES_SERVER,
         '-p', f"{settings.POSTGRES_PORT}",
@@ -63,23 +32,126 @@ def pg2b3dm(table_task_name, output_3dtiles_path, attributes, geometric_error_fa
         '--use_implicit_tiling', "false",
         '--max_features_per_tile', f"{int(max_features_per_tile)}",
         '--geometricerrorfactor', f"{int(geometric_error_factor)}",
-    ] + options)
-
-    try:
-        tileset_json_path = os.path.join(output_3dtiles_path, 'tileset.json')
-        with open(tileset_json_path, "r") as f:
-            data = json.load(f)
-
-        property_keys = {}
-        for c in table.c:
-            if c.name not in [geometry_column_name, fid_column_name]:
-                if type(c.type) is types.VARCHAR:
-                    property_keys[c.name] = {}
-                else:
-                    property_keys[c.name] = {'minimum': 1, 'maximum': 1}
-
-        data["properties"] = property_keys
-        with open(tileset_json_path, "w") as f:
-            json.dump(data, f)
-    except Exception as e:
-        raise e
+    ] + options
+
+
+def _tileset_properties(table, geometry_column_name, fid_column_name):
+    property_keys = {}
+    for c in table.c:
+        if c.name not in [geometry_column_name, fid_column_name]:
+            if type(c.type) is types.VARCHAR:
+                property_keys[c.name] = {}
+            else:
+                property_keys[c.name] = {'minimum': 1, 'maximum': 1}
+    return property_keys
+
+
+def pg2b3dm(table_task_name, output_3dtiles_path, attributes, geometric_error_factor, max_geometric_error, geometry_column_name, max_features_per_tile, double_sided, fid_column_name, table, lod_column_name, add_outline):
+    run_subprocess(_pg2b3dm_command(
+        table_task_name, output_3dtiles_path, attributes, geometric_error_factor, max_geometric_error,
+        geometry_column_name, max_features_per_tile, double_sided, lod_column_name, add_outline
+    ))
+
+    tileset_json_path = os.path.join(output_3dtiles_path, 'tileset.json')
+    with open(tileset_json_path, "r") as f:
+        data = json.load(f)
+
+    data["properties"] = _tileset_properties(table, geometry_column_name, fid_column_name)
+    with open(tileset_json_path, "w") as f:
+        json.dump(data, f)
+
+
+def _transform_point(matrix, point, w=1.0):
+    # 3D Tiles transforms are column-major 4x4 matrices
+    return [sum(matrix[column * 4 + row] * value for column, value in enumerate([*point, w])) for row in range(3)]
+
+
+def _box_bounds(box, transform=None):
+    """Axis aligned [min, max] of an oriented 3D Tiles box, after the tile transform."""
+    center = box[0:3]
+    axes = [box[3:6], box[6:9], box[9:12]]
+    if transform:
+        center = _transform_point(transform, center)
+        axes = [_transform_point(transform, axis, 0.0) for axis in axes]
+    half_size = [sum(abs(axis[i]) for axis in axes) for i in range(3)]
+    return [center[i] - half_size[i] for i in range(3)], [center[i] + half_size[i] for i in range(3)]
+
+
+def _merge_bounding_volumes(volumes):
+    """Union of the partition root volumes: a region if all are regions, otherwise an axis aligned box."""
+    if all('region' in volume for volume in volumes):
+        regions = [volume['region'] for volume in volumes]
+        return {'region': [
+            min(r[0] for r in regions), min(r[1] for r in regions),
+            max(r[2] for r in regions), max(r[3] for r in regions),
+            min(r[4] for r in regions), max(r[5] for r in regions),
+        ]}
+    if not all('box' in volume for volume in volumes):
+        raise Exception("Cannot merge tilesets with region and box bounding volumes")
+    bounds = [_box_bounds(volume['box']) for volume in volumes]
+    minimum = [min(b[0][i] for b in bounds) for i in range(3)]
+    maximum = [max(b[1][i] for b in bounds) for i in range(3)]
+    center = [(minimum[i] + maximum[i]) / 2 for i in range(3)]
+    half = [(maximum[i] - minimum[i]) / 2 for i in range(3)]
+    return {'box': center + [half[0], 0, 0, 0, half[1], 0, 0, 0, half[2]]}
+
+
+def merge_tilesets(output_3dtiles_path, partition_dirs, properties=None):
+    """Write output_3dtiles_path/tileset.json referencing every partition tileset as an external tileset."""
+    children = []
+    asset = None
+    for partition_dir in partition_dirs:
+        with open(os.path.join(output_3dtiles_path, partition_dir, 'tileset.json'), 'r') as f:
+            tileset = json.load(f)
+        asset = asset or tileset.get('asset')
+        root = tileset['root']
+        bounding_volume = root['boundingVolume']
+        if 'box' in bounding_volume and root.get('transform'):
+            minimum, maximum = _box_bounds(bounding_volume['box'], root['transform'])
+            center = [(minimum[i] + maximum[i]) / 2 for i in range(3)]
+            half = [(maximum[i] - minimum[i]) / 2 for i in range(3)]
+            bounding_volume = {'box': center + [half[0], 0, 0, 0, half[1], 0, 0, 0, half[2]]}
+        children.append({
+            'boundingVolume': bounding_volume,
+            'geometricError': tileset.get('geometricError', root.get('geometricError', 0)),
+            'content': {'uri': f"{partition_dir}/tileset.json"},
+        })
+
+    geometric_error = max(child['geometricError'] for child in children)
+    data = {
+        'asset': asset or {'version': '1.1'},
+        'geometricError': geometric_error,
+        'root': {
+            'boundingVolume': _merge_bounding_volumes([child['boundingVolume'] for child in children]),
+            'geometricError': geometric_error,
+            'refine': 'ADD',
+            'children': children,
+        },
+    }
+    if properties is not None:
+        data['properties'] = properties
+    with open(os.path.join(output_3dtiles_path, 'tileset.json'), 'w') as f:
+        json.dump(data, f)
+
+
+def pg2b3dm_partitioned(table_task_name, output_3dtiles_path, attributes, geometric_error_factor, max_geometric_error, geometry_column_name, max_features_per_tile, double_sided, fid_column_name, table, lod_column_name, add_outline, queries, max_workers=None):
+    """One pg2b3dm process per partition where clause, run concurrently into part_<i> sub-tilesets joined by a root tileset.json."""
+    os.makedirs(output_3dtiles_path, exist_ok=True)
+    partition_dirs = [f"part_{index}" for index in range(len(queries))]
+    # tiles left by a previous run with more partitions or another cell layout must not be merged
+    for name in os.listdir(output_3dtiles_path):
+        if name.startswith('part_'):
+            shutil.rmtree(os.path.join(output_3dtiles_path, name), ignore_errors=True)
+    with ThreadPoolExecutor(max_workers=max_workers or len(queries)) as executor:
+        futures = [
+            executor.submit(run_subprocess, _pg2b3dm_command(
+                table_task_name, os.path.join(output_3dtiles_path, partition_dir), attributes, geometric_error_factor,
+                max_geometric_error, geometry_column_name, max_features_per_tile, double_sided, lod_column_name,
+                add_outline, query
+            ), check=True)
+            for partition_dir, query in zip(partition_dirs, queries, strict=True)
+        ]
+        for future in futures:
+            future.result()
+
+    merge_tilesets(output_3dtiles_path, partition_dirs, _tileset_properties(table, geometry_column_name, fid_column_name))
@@ -1,23 +1,31 @@
 import os
 import json
+import math
 import shutil
 import time
-from concurrent.futures import ThreadPoolExecutor
 
-from sqlmodel import Session, select, text, Table, MetaData, Column, insert, Integer
+import numpy as np
+from billiard.pool import Pool
+from sqlalchemy import BigInteger, String, LargeBinary
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session, select, text, Table, MetaData, Column, Integer, func
+from app.core.config import settings
 from app.core.db import engine_tasks, engine
 from app.models.task import Asset
 from app.worker.main import celery, PipelineDatabaseTask, AssetDatabaseTask
 from app.worker.common.utils import (
-    get_asset_upload_path, get_asset_table_name, get_pipeline_table_name, setup_output_directory
+    get_asset_upload_path, get_asset_table_name, get_pipeline_table_name, setup_output_directory,
+    get_available_cpus, get_worker_concurrency, get_asset_triangulation_table_name
 )
 from app.worker.common.processes import (
     identify_projection, import_vector_to_postgres, export_geojson_from_postgres
 )
-from app.worker.common.expression import parse_expression
+from app.worker.common.expression import parse_expression, evaluate_expression_columns
 from app.worker.common.types import GeometryType, JSONEncoder
-from app.worker.tasks.vector.pg2b3dm.processes import pg2b3dm
-from app.worker.tasks.vector.pg2b3dm.polyhedron import geometry_to_polyhedral_surface, polyhedral_to_wkt
+from app.worker.common.bulk import CopyWriter, cluster_table
+from app.worker.common.ewkb import extrusion_to_ewkb
+from app.worker.tasks.vector.pg2b3dm.processes import pg2b3dm, pg2b3dm_partitioned
+from app.worker.tasks.vector.pg2b3dm.extrusion import geometries_to_batch, extrude_polygons, polygon_z_range, triangulate_batch
 from osgeo import gdal, ogr
 from pyproj import CRS
 
@@ -105,7 +113,7 @@ def inspect_vector(options):
         limit = (feature_count * 1000) / size_kb
 
     import_vector_to_postgres(asset_file_path, table_name, geometry_column_name, fid_column_name, epsg, to_ellipsoidal_height)
-    export_geojson_from_postgres(get_asset_upload_path(f"{asset_id}/sample.json"), table_name, limit)
+    export_geojson_from_postgres(get_asset_upload_path(f"{asset_id}/sample.json"), table_name, limit, feature_count)
 
     return {
         'asset_type': asset_type,
@@ -140,71 +148,279 @@ def inspect_raster(options):
 
 
 
-def _polygons_to_polyhedrons(table, table_tasks, offset, chunk_size, geometry_column_name, fid_column_name, config, default_config, lod_column_name):
-    with Session(engine_tasks) as session:
-        try:
-            rows = session.execute(select(table).offset(offset).limit(chunk_size)).all()
-            print(f"Start polyhedrons conversion - offset {offset}")
-            start = time.time()
-
-            lod = 2 if config.get('add_lod') else 1
-            meters_in_degrees = 111194.87428468118
-            lod_max_simplify_tolerance = parse_expression('number', config['lod_max_simplify_tolerance'], {}, default_config['lod_max_simplify_tolerance'])
-
-            for row in rows:
-                for level in range(lod):
-                    row_obj = row._asdict()
-                    row_geometry = row_obj[geometry_column_name]
-
-                    if level == (lod - 1):
-                        as_geojson = session.exec(text(f"SELECT ST_AsGeoJSON('{row_geometry}')"))
-                    else:
-                        tolerance = (lod_max_simplify_tolerance / pow(2, level) / meters_in_degrees)
-                        as_geojson = session.exec(text(f"SELECT ST_AsGeoJSON(ST_SimplifyPreserveTopology('{row_geometry}', {tolerance}))"))
-
-                    properties = []
-                    feature_properties = {}
-                    for key in row_obj:
-                        if key not in [geometry_column_name, fid_column_name]:
-                            properties.append({key: row_obj[key]})
-                            feature_properties[key] = row_obj[key]
-
-                    geojson_string = as_geojson.first()[0]
-                    geometry = json.loads(geojson_string)
-
-                    feature = {
-                        'type': 'Feature',
-                        'properties': json.loads(json.dumps(feature_properties, cls=JSONEncoder)),
-                        'geometry': geometry
-                    }
-
-                    lower_limit = parse_expression('number', config['lower_limit_height'], feature, default_config['lower_limit_height'])
-                    upper_limit = parse_expression('number', config['upper_limit_height'], feature, default_config['upper_limit_height'])
-                    translate_z = parse_expression('number', config['translate_z'], feature, default_config['translate_z'])
-                    geometry_options = {
-                        'lower_limit': lower_limit,
-                        'upper_limit': upper_limit,
-                        'translate_z': translate_z,
-                        'remove_bottom_surface': config['remove_bottom_surface']
-                    }
-
-                    polyhedron_wkt = polyhedral_to_wkt(geometry_to_polyhedral_surface(geometry, geometry_options))
-                    if polyhedron_wkt != 'POLYHEDRALSURFACE Z()':
-                        feature_properties[geometry_column_name] = polyhedron_wkt
-                        feature_properties[lod_column_name] = level
-                        session.exec(insert(table_tasks).values(feature_properties))
-                    else:
-                        print(f'Error creating polyhedron:', feature_properties)
+def _triangulation_table(table_name):
+    """Per-asset cache of footprint triangulations: earcut indices (uint32) by gid and geometry hash."""
+    return Table(
+        table_name, MetaData(),
+        Column('gid', BigInteger, primary_key=True, autoincrement=False),
+        Column('geom_hash', String, primary_key=True),
+        Column('indices', LargeBinary),
+    )
+
+
+def _create_triangulation_table(session, table_name):
+    # caches written before the (gid, geom_hash) key may hold duplicates: start them over
+    has_primary_key = session.exec(text(
+        f"SELECT EXISTS (SELECT 1 FROM pg_index WHERE indrelid = to_regclass('{table_name}') AND indisprimary);"
+    )).first()[0]
+    if not has_primary_key:
+        session.exec(text(f"DROP TABLE IF EXISTS {table_name};"))
+    _triangulation_table(table_name).create(session.connection(), checkfirst=True)
+
+
+def _has_coverage_simplify(session):
+    return bool(session.exec(text("SELECT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'st_coveragesimplify');")).first()[0])
 
+
+def _is_valid_coverage(session, table_name, geometry_column_name):
+    try:
+        invalid = session.exec(text(
+            f"SELECT EXISTS (SELECT 1 FROM ("
+            f"SELECT ST_CoverageInvalidEdges({geometry_column_name}) OVER () AS edges FROM {table_name} "
+            f"WHERE ST_GeometryType({geometry_column_name}) IN ('ST_Polygon', 'ST_MultiPolygon')"
+            f") AS coverage WHERE edges IS NOT NULL);"
+        )).first()[0]
+    except DBAPIError as e:
+        print('Coverage validation not available, simplifying polygons one by one', e)
+        session.rollback()
+        return False
+    if invalid:
+        print('Polygons are not a valid coverage, simplifying polygons one by one')
+    return not invalid
+
+
+def _lod_table_names(table_task_name, levels):
+    return [f"{table_task_name}_lod_{level}" for level in range(levels)]
+
+
+def _create_lod_tables(table_name, table_task_name, geometry_column_name, fid_column_name, tolerances, coverage=True):
+    """Simplify the whole layer once per LOD level into pipeline_<id>_lod_<level> (gid, geom) staging tables.
+
+    ST_CoverageSimplify (PostGIS 3.4 / GEOS 3.12) simplifies shared edges between neighbouring
+    polygons once, so they stay matched; otherwise every polygon is simplified on its own.
+    It is only used when ST_CoverageInvalidEdges reports no overlapping or mismatched edges,
+    as it can produce invalid polygons on anything else.
+    """
+    lod_table_names = _lod_table_names(table_task_name, len(tolerances))
+    with Session(engine_tasks) as session:
+        use_coverage = coverage and _has_coverage_simplify(session) and _is_valid_coverage(session, table_name, geometry_column_name)
+        for lod_table_name, tolerance in zip(lod_table_names, tolerances, strict=True):
+            session.exec(text(f"DROP TABLE IF EXISTS {lod_table_name};"))
             session.commit()
-            print(f"End polyhedrons conversion - offset {offset} elapsed time {time.time() - start}")
-        except Exception as e:
-            print(e)
-            raise Exception
+            select_simplified = f"SELECT {fid_column_name} AS gid, ST_SimplifyPreserveTopology({geometry_column_name}, {tolerance!r}) AS geom FROM {table_name}"
+            if use_coverage:
+                try:
+                    session.exec(text(
+                        f"CREATE UNLOGGED TABLE {lod_table_name} AS "
+                        f"SELECT {fid_column_name} AS gid, ST_CoverageSimplify({geometry_column_name}, {tolerance!r}) OVER () AS geom "
+                        f"FROM {table_name} WHERE ST_GeometryType({geometry_column_name}) IN ('ST_Polygon', 'ST_MultiPolygon') "
+                        f"UNION ALL {select_simplified} WHERE ST_GeometryType({geometry_column_name}) NOT IN ('ST_Polygon', 'ST_MultiPolygon');"
+                    ))
+                    session.commit()
+                except DBAPIError as e:
+                    # e.g. PostGIS built against GEOS < 3.12
+                    print('Coverage simplification not available, simplifying polygons one by one', e)
+                    session.rollback()
+                    use_coverage = False
+            if not use_coverage:
+                session.exec(text(f"CREATE UNLOGGED TABLE {lod_table_name} AS {select_simplified};"))
+                session.commit()
+            session.exec(text(f"CREATE INDEX ON {lod_table_name} (gid);"))
+            session.exec(text(f"ANALYZE {lod_table_name};"))
+            session.commit()
+    return lod_table_names
 
 
-@celery.task(name="create_polygon_3dtiles", base=PipelineDatabaseTask)
-def create_polygon_3dtiles(pipeline_extended):
+def _polygons_to_polyhedrons(table_name, table_task_name, triangulation_table_name, lod_table_names, gid_start, gid_end, geometry_column_name, fid_column_name, config, default_config, lod_column_name, partition_column_name):
+    """Convert the [gid_start, gid_end) chunk; takes names only so it can run in a worker process."""
+    table = Table(table_name, MetaData(), autoload_with=engine_tasks)
+    triangulation_table = _triangulation_table(triangulation_table_name)
+    lod_tables = [Table(name, MetaData(), Column('gid', BigInteger), Column('geom')) for name in lod_table_names]
+    property_columns = [c for c in table.c if c.name not in [geometry_column_name, fid_column_name]]
+    copy_columns = [c.name for c in property_columns] + [geometry_column_name, lod_column_name, partition_column_name]
+
+    with (
+        Session(engine_tasks) as session,
+        CopyWriter(table_task_name, copy_columns) as writer,
+        # the same footprint may come from several LOD levels or a concurrent pipeline of the asset
+        CopyWriter(triangulation_table_name, ['gid', 'geom_hash', 'indices'], on_conflict_do_nothing=True) as triangulation_writer
+    ):
+        print(f"Start polyhedrons conversion - gid {gid_start}")
+        start = time.time()
+
+        lod = len(lod_tables) + 1
+
+        # geometries of every LOD level come back with the chunk itself (one query per chunk),
+        # simplified levels from their staging tables
+        geometry_column = table.c[geometry_column_name]
+        fid_column = table.c[fid_column_name]
+        source = table
+        lod_columns = []
+        for level in range(lod):
+            if level == (lod - 1):
+                lod_geometry = geometry_column
+            else:
+                lod_table = lod_tables[level]
+                source = source.outerjoin(lod_table, lod_table.c.gid == fid_column)
+                lod_geometry = lod_table.c.geom
+            lod_columns.append(func.ST_AsGeoJSON(lod_geometry).label(f'_geojson_{level}'))
+            # earcut only depends on the footprint: reuse the triangulation of an unchanged geometry
+            geometry_hash = func.md5(func.ST_AsBinary(lod_geometry))
+            lod_columns.append(geometry_hash.label(f'_hash_{level}'))
+            lod_columns.append(
+                select(triangulation_table.c.indices)
+                .where(triangulation_table.c.gid == fid_column, triangulation_table.c.geom_hash == geometry_hash)
+                .limit(1)
+                .scalar_subquery()
+                .label(f'_indices_{level}')
+            )
+
+        # every LOD row of a feature shares the partition key of the source geometry, so partitions never split a feature
+        partition_key = func.encode(func.ST_AsEWKB(func.ST_Centroid(func.ST_Envelope(geometry_column))), 'hex').label('_partition_key')
+        statement = select(fid_column.label('_gid'), partition_key, *property_columns, *lod_columns).select_from(source).where(fid_column >= gid_start)
+        if gid_end is not None:
+            statement = statement.where(fid_column < gid_end)
+        rows = session.execute(statement.order_by(fid_column)).all()
+
+        row_objs = [row._asdict() for row in rows]
+        # property columns as the expressions see them (JSON types, as in a GeoJSON feature)
+        properties = {
+            c.name: json.loads(json.dumps([row_obj[c.name] for row_obj in row_objs], cls=JSONEncoder))
+            for c in property_columns
+        }
+        for level in range(lod):
+            geometries = []
+            for row_obj in row_objs:
+                geojson_string = row_obj[f'_geojson_{level}']
+                geometries.append(json.loads(geojson_string) if geojson_string is not None else None)
+
+            batch = geometries_to_batch(geometries)
+            functions = dict(zip(['$minZ', '$maxZ'], polygon_z_range(batch), strict=True))
+
+            cached = [
+                np.frombuffer(row_obj[f'_indices_{level}'], dtype='<u4').reshape(-1, 3) if row_obj[f'_indices_{level}'] is not None else None
+                for row_obj in row_objs
+            ]
+            triangulations = triangulate_batch(batch, cached)
+            for row_obj, geometry, cached_triangles, triangles in zip(row_objs, geometries, cached, triangulations, strict=True):
+                if cached_triangles is None and geometry is not None:
+                    triangulation_writer.write([row_obj['_gid'], row_obj[f'_hash_{level}'], triangles.astype('<u4').tobytes()])
+
+            # lower/upper/translate are kept as None when not set, extrude_polygons handles it per feature
+            def evaluate(key, functions=functions):
+                return evaluate_expression_columns('number', config[key], properties, len(row_objs), functions, default_config[key])
+
+            extrusion = extrude_polygons(
+                batch,
+                evaluate('lower_limit_height'),
+                evaluate('upper_limit_height'),
+                evaluate('translate_z'),
+                config['remove_bottom_surface'],
+                triangulations
+            )
+
+            for index, polyhedron in enumerate(extrusion_to_ewkb(extrusion)):
+                row_obj = row_objs[index]
+                if polyhedron:
+                    writer.write([row_obj[c.name] for c in property_columns] + [polyhedron.hex(), level, row_obj['_partition_key']])
+                else:
+                    print(f'Error creating polyhedron:', {name: values[index] for name, values in properties.items()})
+
+        print(f"End polyhedrons conversion - gid {gid_start} elapsed time {time.time() - start}")
+
+
+def _gid_chunks(session, table_name, fid_column_name, chunk_size):
+    """[start, end) gid ranges of chunk_size rows each (keyset paging, no OFFSET scans)."""
+    starts = session.exec(text(
+        f"SELECT {fid_column_name} FROM ("
+        f"SELECT {fid_column_name}, row_number() OVER (ORDER BY {fid_column_name}) AS rn FROM {table_name}"
+        f") AS keys WHERE (rn - 1) % {int(chunk_size)} = 0 ORDER BY {fid_column_name}"
+    )).all()
+    starts = [row[0] for row in starts]
+    return [(gid_start, starts[idx + 1] if idx + 1 < len(starts) else None) for idx, gid_start in enumerate(starts)]
+
+
+def _worker_count(config):
+    return int(config.get('workers') or settings.DTT_VECTOR_WORKERS or max(1, get_available_cpus() // get_worker_concurrency()))
+
+
+def _init_conversion_process():
+    # forked workers must not reuse the parent's pooled connections
+    engine_tasks.dispose(close=False)
+
+
+def _convert_chunk(args):
+    return _polygons_to_polyhedrons(*args)
+
+
+def _convert_chunks(task, chunks, config, args):
+    """Run _polygons_to_polyhedrons over the gid chunks in a process pool, failing on the first failed chunk."""
+    table_name, table_task_name, triangulation_table_name, lod_table_names, *options = args
+    jobs = [
+        (table_name, table_task_name, triangulation_table_name, lod_table_names, gid_start, gid_end, *options)
+        for gid_start, gid_end in chunks
+    ]
+    # billiard, not multiprocessing: a Celery prefork worker is a daemonic process and only
+    # billiard lets it start child processes
+    pool = Pool(processes=max(1, min(_worker_count(config), len(jobs))), initializer=_init_conversion_process)
+    try:
+        for done, _ in enumerate(pool.imap_unordered(_convert_chunk, jobs), start=1):
+            task.update_state(state='PROGRESS', meta={'chunks_done': done, 'chunks_total': len(jobs)})
+        pool.close()
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _cell_filter(key, cell):
+    # half-open cells so a feature on a shared edge lands in exactly one partition
+    min_x, min_y, max_x, max_y = cell
+    return (
+        f"{key} && ST_MakeEnvelope({min_x!r}, {min_y!r}, {max_x!r}, {max_y!r}, 4326) "
+        f"AND ST_X({key}) >= {min_x!r} AND ST_X({key}) < {max_x!r} "
+        f"AND ST_Y({key}) >= {min_y!r} AND ST_Y({key}) < {max_y!r}"
+    )
+
+
+def _quadtree_partitions(table_task_name, key, partitions):
+    """Where clauses of about `partitions` non-empty quadtree cells over the table extent, splitting the fullest cell first."""
+    with Session(engine_tasks) as session:
+        extent = session.exec(text(
+            f"SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e), n FROM "
+            f"(SELECT ST_Extent({key}) AS e, count(*) AS n FROM {table_task_name}) AS extent"
+        )).first()
+        if extent is None or not extent[4]:
+            return []
+        min_x, min_y, max_x, max_y, count = extent
+        cells = [((min_x, min_y, math.nextafter(max_x, math.inf), math.nextafter(max_y, math.inf)), count)]
+
+        # bounded: a cell of coincident features never splits
+        for _ in range(partitions * 4):
+            if len(cells) >= partitions:
+                break
+            cells.sort(key=lambda cell: cell[1])
+            cell, count = cells[-1]
+            if count <= 1:
+                break
+            min_x, min_y, max_x, max_y = cell
+            mid_x, mid_y = (min_x + max_x) / 2, (min_y + max_y) / 2
+            quadrants = [
+                (min_x, min_y, mid_x, mid_y), (mid_x, min_y, max_x, mid_y),
+                (min_x, mid_y, mid_x, max_y), (mid_x, mid_y, max_x, max_y),
+            ]
+            counts = dict(session.exec(text(
+                f"SELECT (ST_X({key}) >= {mid_x!r})::int + 2 * (ST_Y({key}) >= {mid_y!r})::int AS quadrant, count(*) "
+                f"FROM {table_task_name} WHERE {_cell_filter(key, cell)} GROUP BY quadrant"
+            )).all())
+            cells = cells[:-1] + [(quadrant, counts[index]) for index, quadrant in enumerate(quadrants) if counts.get(index)]
+
+    return [_cell_filter(key, cell) for cell, count in cells]
+
+
+@celery.task(name="create_polygon_3dtiles", base=PipelineDatabaseTask, bind=True)
+def create_polygon_3dtiles(self, pipeline_extended):
     asset = pipeline_extended['asset']
     asset_id = asset['id']
     pipeline_id = pipeline_extended['id']
@@ -212,6 +428,7 @@ def create_polygon_3dtiles(pipeline_extended):
     geometry_column_name = 'geom'
     fid_column_name = 'gid'
     lod_column_name = 'lod'
+    partition_column_name = 'partition_key'
 
     pipeline_config = pipeline_extended.get('data') or {}
 
@@ -226,35 +443,70 @@ def create_polygon_3dtiles(pipeline_extended):
         'remove_bottom_surface': True,
         'add_lod': False,
         'lod_max_simplify_tolerance': 5,
-        'add_outline': False
+        # keep edges shared by neighbouring polygons matched when simplifying LOD levels (ST_CoverageSimplify)
+        'lod_coverage_simplify': True,
+        'add_outline': False,
+        'workers': None,
+        # > 1 exports that many quadtree cells with concurrent pg2b3dm processes under one root tileset
+        'partitions': 1
     }
 
     config = {**default_config, **pipeline_config}
 
     table = Table(table_name, MetaData(), autoload_with=engine_tasks)
     table_task_name = get_pipeline_table_name(pipeline_id)
+    triangulation_table_name = get_asset_triangulation_table_name(asset_id)
 
     columns = [Column('id', Integer, primary_key=True)]
     for c in table.c:
         if c.name not in [geometry_column_name, fid_column_name]:
             columns.append(Column(c.name, c.type, primary_key=False, autoincrement=c.autoincrement))
-    columns.append(Column(geometry_column_name, GeometryType))
+    columns.append(Column(geometry_column_name, GeometryType(binary=True)))
     columns.append(Column(lod_column_name, Integer))
+    columns.append(Column(partition_column_name, GeometryType('POINT', binary=True)))
 
-    table_tasks = Table(table_task_name, MetaData(), *columns)
+    # scratch table dropped after export: no WAL needed
+    table_tasks = Table(table_task_name, MetaData(), *columns, prefixes=['UNLOGGED'])
 
     with Session(engine_tasks) as session:
         session.exec(text(f"DROP TABLE IF EXISTS {table_task_name};"))
         session.commit()
         table_tasks.create(session.connection())
-        session.exec(text(f"CREATE INDEX ON {table_task_name} USING gist(st_centroid(st_envelope({geometry_column_name})));"))
+        _create_triangulation_table(session, triangulation_table_name)
         session.commit()
-        total_rows = session.exec(text(f"SELECT COUNT(*) FROM {table}")).first()[0]
+        chunks = _gid_chunks(session, table_name, fid_column_name, 1000)
 
-    chunks = list(range(0, total_rows, 1000))
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        for offset in chunks:
-            executor.submit(_polygons_to_polyhedrons, table, table_tasks, offset, 1000, geometry_column_name, fid_column_name, config, default_config, lod_column_name)
+    lod_tolerances = []
+    if config.get('add_lod'):
+        meters_in_degrees = 111194.87428468118
+        lod_max_simplify_tolerance = parse_expression('number', config['lod_max_simplify_tolerance'], {}, default_config['lod_max_simplify_tolerance'])
+        # a single simplified level below the full resolution geometry
+        lod_tolerances = [lod_max_simplify_tolerance / pow(2, level) / meters_in_degrees for level in range(1)]
+    # known up front, so a failure half way through the LOD levels still drops the ones created
+    lod_table_names = _lod_table_names(table_task_name, len(lod_tolerances))
+
+    try:
+        if lod_tolerances:
+            _create_lod_tables(
+                table_name, table_task_name, geometry_column_name, fid_column_name, lod_tolerances,
+                config.get('lod_coverage_simplify', True)
+            )
+        _convert_chunks(self, chunks, config, (
+            table_name, table_task_name, triangulation_table_name, lod_table_names, geometry_column_name, fid_column_name, config, default_config, lod_column_name,
+            partition_column_name
+        ))
+    finally:
+        with Session(engine_tasks) as session:
+            for lod_table_name in lod_table_names:
+                session.exec(text(f"DROP TABLE IF EXISTS {lod_table_name};"))
+            session.commit()
+
+    partitions = int(config.get('partitions') or 1)
+    centroid = f"st_centroid(st_envelope({geometry_column_name}))"
+    indexes = [f"USING gist({centroid})"]
+    if partitions > 1:
+        indexes.append(f"USING gist({partition_column_name})")
+    cluster_table(table_task_name, f"ST_GeoHash({centroid})", indexes)
 
     output_paths = setup_output_directory(pipeline_id)
 
@@ -264,16 +516,22 @@ def create_polygon_3dtiles(pipeline_extended):
 
     double_sided = 'true' if config['double_sided'] else 'false'
 
-    attributes = [c.name for c in columns if c.name not in [geometry_column_name, fid_column_name, lod_column_name]]
+    attributes = [c.name for c in columns if c.name not in [geometry_column_name, fid_column_name, lod_column_name, partition_column_name]]
 
     active_lod_column = lod_column_name if config.get('add_lod') else None
 
-    pg2b3dm(
+    export_args = (
         table_task_name, output_paths['output_path_3dtiles'], attributes,
         geometric_error_factor, max_geometric_error, geometry_column_name,
         max_features_per_tile, double_sided, fid_column_name, table,
         active_lod_column, config['add_outline']
     )
+    # partition on the source feature, not on the centroid of each (simplified) LOD geometry
+    queries = _quadtree_partitions(table_task_name, partition_column_name, partitions) if partitions > 1 else []
+    if len(queries) > 1:
+        pg2b3dm_partitioned(*export_args, queries, min(len(queries), _worker_count(config)))
+    else:
+        pg2b3dm(*export_args)
 
     with Session(engine_tasks) as session:
         session.exec(text(f"DROP TABLE IF EXISTS {table_task_name};"))
@@ -0,0 +1,97 @@
+"""Compare the original list based polyhedron builder with the array based extrusion engine.
+
+    cd backend && PYTHONPATH=. python scripts/benchmark_extrusion.py --count 100000
+
+Equivalence of the geometry is covered by app/tests/worker/test_extrusion.py, which also holds the
+list based reference; this script only reports timings and the number of features with a
+different triangle count.
+"""
+import argparse
+import math
+import random
+import time
+
+from app.tests.worker.test_extrusion import reference_geometry_to_polyhedral_surface
+from app.worker.tasks.vector.pg2b3dm.extrusion import extrude_polygons, geometries_to_batch, to_polyhedrons
+
+
+def _ring(cx, cy, radius, sides, z):
+    ring = []
+    for i in range(sides):
+        angle = 2 * math.pi * i / sides
+        ring.append([cx + radius * math.cos(angle), cy + radius * math.sin(angle), z])
+    return ring + [ring[0]]
+
+
+def generate_buildings(count, seed=0):
+    """Synthetic footprints: 4 to 12 sided outlines, one in ten with a courtyard, random heights."""
+    rng = random.Random(seed)
+    buildings = []
+    for _ in range(count):
+        cx, cy = rng.uniform(0, 10000), rng.uniform(0, 10000)
+        radius = rng.uniform(5, 30)
+        z = rng.uniform(0, 50)
+        rings = [_ring(cx, cy, radius, rng.randint(4, 12), z)]
+        if rng.random() < 0.1:
+            rings.append(list(reversed(_ring(cx, cy, radius / 3, 4, z))))
+        buildings.append({
+            'geometry': {'type': 'Polygon', 'coordinates': rings},
+            'height': rng.uniform(3, 60),
+        })
+    return buildings
+
+
+def run_lists(buildings, remove_bottom_surface):
+    return [
+        reference_geometry_to_polyhedral_surface(building['geometry'], {
+            'lower_limit': None,
+            'upper_limit': building['height'],
+            'translate_z': 0,
+            'remove_bottom_surface': remove_bottom_surface,
+        })
+        for building in buildings
+    ]
+
+
+def run_arrays(buildings, remove_bottom_surface):
+    batch = geometries_to_batch([building['geometry'] for building in buildings])
+    return extrude_polygons(
+        batch,
+        upper_limits=[building['height'] for building in buildings],
+        translate_z=0,
+        remove_bottom_surface=remove_bottom_surface
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--keep-bottom', action='store_true')
+    args = parser.parse_args()
+    remove_bottom_surface = not args.keep_bottom
+
+    buildings = generate_buildings(args.count)
+
+    start = time.perf_counter()
+    polyhedrons = run_lists(buildings, remove_bottom_surface)
+    lists_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = run_arrays(buildings, remove_bottom_surface)
+    arrays_elapsed = time.perf_counter() - start
+
+    list_triangles = sum(len(polyhedron) for polyhedron in polyhedrons)
+    array_triangles = len(result['triangles'])
+    mismatches = sum(
+        1 for polyhedron, converted in zip(polyhedrons, to_polyhedrons(result), strict=True)
+        if len(polyhedron) != len(converted)
+    )
+
+    print(f"buildings: {args.count}")
+    print(f"polyhedron (lists): {lists_elapsed:.2f}s, {list_triangles} triangles")
+    print(f"extrusion (arrays): {arrays_elapsed:.2f}s, {array_triangles} triangles")
+    print(f"speedup: {lists_elapsed / arrays_elapsed:.1f}x, features with a different triangle count: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
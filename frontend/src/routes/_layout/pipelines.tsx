@@ -322,7 +322,7 @@ const SelectAssets = React.forwardRef((props: any, ref) => {
       AssetsService.readAssets({
         skip: 0,
         limit: 9999,
-        extension: ".shp.zip,.las,.laz,.phg.zip,.obj,.obj.zip",
+        extension: ".shp.zip,.las,.laz,.las.zip,.phg.zip,.obj,.obj.zip",
         uploadStatus: "SUCCESS",
       }),
     queryKey: ["assets-select"],